@@ -2,9 +2,48 @@
 DENAS - Delira Efficient Neural Network Search
 """
 
-from .models import SeparableConv, PoolBranch, FixedLayer, FactorizedReduction, \
-    ENASLayer, ConvBranch, SharedCNN, Controller, ENASModelPyTorch
-from .predictor import ENASPredictor
-from .trainer import ENASTrainerPyTorch
-from .experiment import ENASExperimentPyTorch
-from denas.utils import ENASModelPyTorch
+import importlib
+
+# the public names are imported on first access, to avoid importing delira,
+# batchgenerators and tqdm if only the networks are needed
+_LAZY_ATTRS = {
+    "SeparableConv": ".models",
+    "PoolBranch": ".models",
+    "FixedLayer": ".models",
+    "FactorizedReduction": ".models",
+    "ENASLayer": ".models",
+    "ConvBranch": ".models",
+    "SharedCNN": ".models",
+    "Controller": ".models",
+    "ENASModelPyTorch": ".models",
+    "ENASPredictor": ".predictor",
+    "ENASTrainerPyTorch": ".trainer",
+    "ENASExperimentPyTorch": ".experiment",
+    "ArcHistory": ".history",
+    "MemmapDataset": ".data",
+    "MemmapDataManager": ".data",
+    "BatchAugmentation": ".data",
+    "create_memmap_dataset": ".data",
+    "BatchingServer": ".serving",
+    "serve": ".serving",
+    "export_torchscript": ".export",
+    "load_exported": ".export",
+    "OpInstrumentation": ".instrumentation",
+}
+
+__all__ = list(_LAZY_ATTRS.keys())
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRS:
+        raise AttributeError("module %r has no attribute %r"
+                             % (__name__, name))
+
+    value = getattr(importlib.import_module(_LAZY_ATTRS[name], __name__),
+                    name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(__all__))
@@ -0,0 +1,330 @@
+import copy
+import queue
+import time
+import traceback
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+"""
+Notes
+-----
+
+Actor-Learner evaluation of sampled architectures: The controller (learner)
+samples architectures and sends them to several local worker processes
+(actors). Each worker holds a snapshot of the shared CNN's weights, evaluates
+the architectures on its own shard of the training data and sends the
+achieved accuracy back. Since the controller keeps updating while
+architectures are in flight, the updates have to be off-policy corrected
+(see :meth:`ENASModelPyTorch.closure_controller_offpolicy`).
+
+Each result carries the version of the weights snapshot it was evaluated
+with, so that the learner knows how stale the reward is. A worker, which
+fails to evaluate an architecture, sends its traceback back and stops;
+:meth:`RewardWorkerPool.get` raises a :class:`RewardWorkerError` for failed
+or dead workers instead of waiting forever.
+"""
+
+
+class RewardWorkerError(RuntimeError):
+    """
+    Raised, if a reward worker failed or died
+
+    """
+    pass
+
+
+def arc_to_cpu(sample_arc):
+    """
+    Moves all tensors of an architecture to the cpu (e.g. to send it to
+    another process)
+
+    Parameters
+    ----------
+    sample_arc : dict
+        the architecture
+
+    Returns
+    -------
+    dict
+        the architecture with all tensors on the cpu
+
+    """
+    return {key: [val.detach().cpu() for val in value]
+            for key, value in sample_arc.items()}
+
+
+def _stack_samples(samples):
+    return {key: np.stack([_sample[key] for _sample in samples])
+            for key in samples[0].keys()}
+
+
+def _reward_worker_loop(rank, shared_cnn, dataset, transforms,
+                        prepare_batch_fn, num_workers, batch_size, device,
+                        num_threads, seed, task_queue, weight_queue,
+                        result_queue):
+    """
+    Main loop of a single reward worker
+
+    Parameters
+    ----------
+    rank : int
+        index of the current worker
+    shared_cnn : :class:`SharedCNN`
+        copy of the shared cnn
+    dataset : :class:`AbstractDataset`
+        the dataset to evaluate on; only the shard belonging to ``rank`` is
+        used
+    transforms :
+        the transforms to apply to each batch (may be None)
+    prepare_batch_fn : function
+        function to convert a batch to torch tensors on the correct device
+    num_workers : int
+        total number of workers (number of data shards)
+    batch_size : int
+        number of samples per evaluation
+    device : str
+        the device to evaluate on
+    num_threads : int
+        number of threads torch is allowed to use inside this worker
+    seed : int
+        random seed
+    task_queue : :class:`multiprocessing.Queue`
+        queue yielding tasks consisting of task id and architecture; a task
+        of ``None`` stops the worker
+    weight_queue : :class:`multiprocessing.Queue`
+        queue yielding state dicts and their versions
+    result_queue : :class:`multiprocessing.Queue`
+        queue to put the task id, the accuracy and the used weight version
+        to; on failure, None, the rank and the traceback are put instead
+
+    """
+    try:
+        torch.set_num_threads(num_threads)
+        rng = np.random.RandomState(seed + rank)
+
+        shard = np.arange(len(dataset))[rank::num_workers]
+        shared_cnn = shared_cnn.to(device).eval()
+        weights_version = 0
+
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+
+            # only the most recent snapshot of shared weights is of interest
+            new_weights = None
+            while True:
+                try:
+                    new_weights = weight_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if new_weights is not None:
+                weights_version, state_dict = new_weights
+                shared_cnn.load_state_dict(state_dict)
+
+            task_id, sample_arc = task
+
+            idxs = rng.choice(shard, size=min(batch_size, len(shard)),
+                              replace=False)
+            batch = _stack_samples([dataset[int(idx)] for idx in idxs])
+            if transforms is not None:
+                batch = transforms(**batch)
+            batch = prepare_batch_fn(batch, device, device)
+
+            with torch.no_grad():
+                preds = shared_cnn(batch["data"], sample_arc)["pred"]
+                acc = torch.mean((torch.argmax(preds, 1) == batch["label"]
+                                  ).to(torch.float)).item()
+
+            result_queue.put((task_id, acc, weights_version))
+
+    except Exception:
+        # exceptions may not be picklable, so only the traceback is sent
+        result_queue.put((None, rank, traceback.format_exc()))
+
+
+class RewardWorkerPool(object):
+    """
+    Pool of local processes evaluating architectures on their own data shards
+    with periodically synced snapshots of the shared CNN's weights
+
+    """
+
+    def __init__(self, shared_cnn, datamgr, prepare_batch_fn, num_workers=2,
+                 device="cpu", num_threads=1, max_in_flight=None, seed=0):
+        """
+
+        Parameters
+        ----------
+        shared_cnn : :class:`SharedCNN`
+            the shared cnn to evaluate architectures with
+        datamgr : :class:`BaseDataManager`
+            data manager holding the dataset, its transforms and the
+            batchsize to use for evaluation
+        prepare_batch_fn : function
+            function to convert a batch to torch tensors on the correct device
+        num_workers : int
+            number of worker processes
+        device : str
+            device, the workers evaluate on
+        num_threads : int
+            number of threads per worker
+        max_in_flight : int or None
+            maximum number of architectures, which are sent to the workers
+            without having been returned yet; defaults to two per worker
+        seed : int
+            random seed
+
+        """
+        if max_in_flight is None:
+            max_in_flight = 2 * num_workers
+
+        self.num_workers = num_workers
+        self.max_in_flight = max_in_flight
+        self.weights_version = 0
+
+        self._ctx = mp.get_context("spawn")
+        self._task_queue = self._ctx.Queue()
+        self._result_queue = self._ctx.Queue()
+        self._weight_queues = [self._ctx.Queue()
+                               for _ in range(num_workers)]
+        self._in_flight = 0
+
+        shared_cnn = copy.deepcopy(shared_cnn).cpu()
+
+        self._processes = [
+            self._ctx.Process(
+                target=_reward_worker_loop,
+                args=(rank, shared_cnn, datamgr.dataset, datamgr.transforms,
+                      prepare_batch_fn, num_workers, datamgr.batch_size,
+                      device, num_threads, seed, self._task_queue,
+                      self._weight_queues[rank], self._result_queue),
+                daemon=True)
+            for rank in range(num_workers)]
+
+    def start(self):
+        """
+        Starts all worker processes
+
+        """
+        for process in self._processes:
+            process.start()
+
+    def sync_weights(self, shared_cnn, version=None):
+        """
+        Sends a snapshot of the current shared weights to all workers
+
+        Parameters
+        ----------
+        shared_cnn : :class:`SharedCNN`
+            the shared cnn to take the snapshot of
+        version : int or None
+            the version to tag the snapshot with (e.g. the number of shared
+            cnn updates); defaults to the number of synchronizations
+
+        """
+        if version is None:
+            version = self.weights_version + 1
+        self.weights_version = version
+        state_dict = {key: val.detach().cpu()
+                      for key, val in shared_cnn.state_dict().items()}
+
+        for weight_queue in self._weight_queues:
+            weight_queue.put((self.weights_version, state_dict))
+
+    @property
+    def can_submit(self):
+        return self._in_flight < self.max_in_flight
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def submit(self, task_id, sample_arc):
+        """
+        Sends an architecture to the workers for evaluation
+
+        Parameters
+        ----------
+        task_id : int
+            identifier to map the result back to the architecture
+        sample_arc : dict
+            the architecture to evaluate
+
+        """
+        self._task_queue.put((task_id, arc_to_cpu(sample_arc)))
+        self._in_flight += 1
+
+    def _check_workers(self):
+        for rank, process in enumerate(self._processes):
+            if not process.is_alive():
+                raise RewardWorkerError(
+                    "Reward worker %d died unexpectedly (exit code %s)"
+                    % (rank, process.exitcode))
+
+    def get(self, timeout=None, poll_interval=1.):
+        """
+        Waits for the next evaluated architecture
+
+        Parameters
+        ----------
+        timeout : float or None
+            maximum time to wait (in seconds); waits as long as the workers
+            are alive if None
+        poll_interval : float
+            interval to check whether the workers are still alive (in
+            seconds)
+
+        Returns
+        -------
+        int
+            the task id
+        float
+            the accuracy
+        int
+            the version of the shared weights used for evaluation (see
+            :meth:`sync_weights`)
+
+        Raises
+        ------
+        :class:`RewardWorkerError`
+            if a worker failed or died
+        :class:`queue.Empty`
+            if no result arrived within ``timeout``
+
+        """
+        start = time.time()
+        while True:
+            if timeout is not None:
+                wait = min(poll_interval, timeout - (time.time() - start))
+            else:
+                wait = poll_interval
+
+            try:
+                result = self._result_queue.get(timeout=max(wait, 0.))
+                break
+            except queue.Empty:
+                self._check_workers()
+                if timeout is not None and time.time() - start >= timeout:
+                    raise
+
+        if result[0] is None:
+            raise RewardWorkerError("Reward worker %d failed:\n%s"
+                                    % result[1:])
+
+        self._in_flight -= 1
+        return result
+
+    def shutdown(self):
+        """
+        Stops all worker processes
+
+        """
+        for _ in self._processes:
+            self._task_queue.put(None)
+
+        for process in self._processes:
+            process.join()
@@ -0,0 +1,576 @@
+import os
+import queue
+import threading
+
+import numpy as np
+import torch
+
+from .models.preprocessing import zero_mean_unit_variance
+
+"""
+Notes
+-----
+
+Lightweight data pipeline for small image datasets: The images are stored
+once as uint8 numpy files and accessed memory-mapped, so all processes
+reading them share the same pages. Augmentation (pad, random crop and
+mirror) is done for whole batches in a single vectorized numpy pass and the
+conversion to float and the normalization is left to
+:meth:`ENASModelPyTorch.prepare_batch`, which does it on the computing device.
+
+The controller's rewards are only computed on no-grad forward passes, so
+they don't need a full augmenting pipeline: :class:`DeviceRewardSet` draws a
+subset of the data once (and optionally redraws it every few epochs), keeps
+it normalized on the computing device and serves the reward batches by
+indexing without any loader workers.
+"""
+
+
+def create_memmap_dataset(data_path, dataset="cifar10", train=True):
+    """
+    Converts a torchvision dataset to uint8 numpy files (if not done yet)
+
+    Parameters
+    ----------
+    data_path : str
+        directory to download the dataset to and to store the numpy files in
+    dataset : str
+        name of the torchvision dataset (``cifar10`` or ``cifar100``)
+    train : bool
+        whether to convert the train or the test split
+
+    Returns
+    -------
+    str
+        path of the image file (N x C x H x W, uint8)
+    str
+        path of the label file (N, int64)
+
+    """
+    split = "train" if train else "test"
+    data_file = os.path.join(data_path, "%s_%s_data.npy" % (dataset, split))
+    label_file = os.path.join(data_path, "%s_%s_labels.npy" % (dataset,
+                                                                split))
+
+    if not (os.path.isfile(data_file) and os.path.isfile(label_file)):
+        import torchvision
+
+        if dataset == "cifar10":
+            dset_cls = torchvision.datasets.CIFAR10
+        elif dataset == "cifar100":
+            dset_cls = torchvision.datasets.CIFAR100
+        else:
+            raise ValueError("Unknown dataset {}".format(dataset))
+
+        dset = dset_cls(root=data_path, train=train, download=True)
+
+        # torchvision stores the images channels last
+        np.save(data_file, np.ascontiguousarray(
+            np.asarray(dset.data, dtype=np.uint8).transpose(0, 3, 1, 2)))
+        np.save(label_file, np.asarray(dset.targets, dtype=np.int64))
+
+    return data_file, label_file
+
+
+class MemmapDataset(object):
+    """
+    Dataset of uint8 images, which are memory-mapped from a numpy file
+
+    """
+
+    def __init__(self, data_file, label_file):
+        """
+
+        Parameters
+        ----------
+        data_file : str
+            numpy file containing the images (N x C x H x W, uint8)
+        label_file : str
+            numpy file containing the labels (N)
+
+        """
+        self.data_file = data_file
+        self.label_file = label_file
+        self.data = np.load(data_file, mmap_mode="r")
+        self.labels = np.load(label_file)
+
+        assert self.data.dtype == np.uint8, "Images must be stored as uint8"
+        assert len(self.data) == len(self.labels), \
+            "Number of images and labels differ"
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        return {"data": np.asarray(self.data[index]),
+                "label": self.labels[index].reshape(1)}
+
+    def get_batch(self, indices):
+        """
+        Loads several samples at once
+
+        Parameters
+        ----------
+        indices : :class:`numpy.ndarray`
+            indices of the samples to load
+
+        Returns
+        -------
+        dict
+            batch dict containing the images (N x C x H x W, uint8) and the
+            labels (N x 1)
+
+        """
+        # sorted reads are much friendlier to the page cache
+        order = np.argsort(indices, kind="stable")
+        sorted_indices = indices[order]
+
+        data = np.empty((len(indices),) + self.data.shape[1:], np.uint8)
+        data[order] = self.data[sorted_indices]
+
+        return {"data": data,
+                "label": self.labels[indices].reshape(-1, 1)}
+
+    def __getstate__(self):
+        # don't pickle the mapped data but reopen it in the target process
+        return {"data_file": self.data_file, "label_file": self.label_file}
+
+    def __setstate__(self, state):
+        self.__init__(state["data_file"], state["label_file"])
+
+
+class BatchAugmentation(object):
+    """
+    Vectorized padding, random cropping and mirroring of whole uint8 batches
+    (equivalent to batchgenerators' ``PadTransform``,
+    ``RandomCropTransform`` and ``MirrorTransform`` applied per sample)
+
+    """
+
+    def __init__(self, pad_size=(36, 36), crop_size=(32, 32), mirror=True,
+                 seed=None):
+        """
+
+        Parameters
+        ----------
+        pad_size : tuple
+            spatial size after zero-padding
+        crop_size : tuple
+            spatial size of the random crops
+        mirror : bool
+            whether to randomly flip the images horizontally
+        seed : int or None
+            random seed
+
+        """
+        self.pad_size = pad_size
+        self.crop_size = crop_size
+        self.mirror = mirror
+        self.rng = np.random.RandomState(seed)
+
+    def __call__(self, **data_dict):
+        data = data_dict["data"]
+        n_samples, n_channels, height, width = data.shape
+
+        pad_h = self.pad_size[0] - height
+        pad_w = self.pad_size[1] - width
+        padded = np.pad(data, ((0, 0), (0, 0),
+                               (pad_h // 2, pad_h - pad_h // 2),
+                               (pad_w // 2, pad_w - pad_w // 2)),
+                        mode="constant")
+
+        # gather all crops at once by fancy indexing with per sample offsets
+        offsets_h = self.rng.randint(0, self.pad_size[0] - self.crop_size[0]
+                                     + 1, size=n_samples)
+        offsets_w = self.rng.randint(0, self.pad_size[1] - self.crop_size[1]
+                                     + 1, size=n_samples)
+
+        rows = offsets_h[:, None] + np.arange(self.crop_size[0])[None]
+        cols = offsets_w[:, None] + np.arange(self.crop_size[1])[None]
+
+        if self.mirror:
+            flip = self.rng.rand(n_samples) < 0.5
+            cols[flip] = cols[flip, ::-1]
+
+        data_dict["data"] = padded[
+            np.arange(n_samples)[:, None, None, None],
+            np.arange(n_channels)[None, :, None, None],
+            rows[:, None, :, None],
+            cols[:, None, None, :]]
+
+        return data_dict
+
+
+class _LoaderError(object):
+    """
+    Wraps an exception of the loader thread to pass it to the consumer
+
+    """
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class MemmapBatchGenerator(object):
+    """
+    Iterates batches of a :class:`MemmapDataset` in a single background
+    thread. Provides the parts of the ``MultiThreadedAugmenter`` interface,
+    which are used by :class:`ENASTrainerPyTorch`
+
+    """
+
+    def __init__(self, dataset, batch_size, transforms=None, shuffle=True,
+                 seed=1, num_prefetch=2):
+        """
+
+        Parameters
+        ----------
+        dataset : :class:`MemmapDataset`
+            the dataset to iterate
+        batch_size : int
+            number of samples per batch
+        transforms : callable or None
+            batch transforms (e.g. :class:`BatchAugmentation`)
+        shuffle : bool
+            whether to iterate in random order
+        seed : int
+            random seed for shuffling
+        num_prefetch : int
+            number of batches to prepare in advance
+
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.transforms = transforms
+
+        indices = np.arange(len(dataset))
+        if shuffle:
+            np.random.RandomState(seed).shuffle(indices)
+        self._indices = indices
+
+        self._queue = queue.Queue(maxsize=num_prefetch)
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def generator(self):
+        # batchgenerators' augmenters expose their loader as ``generator``
+        return self
+
+    @property
+    def num_batches(self):
+        return int(np.ceil(len(self._indices) / self.batch_size))
+
+    @property
+    def num_processes(self):
+        return 1
+
+    def _load(self):
+        try:
+            for start in range(0, len(self._indices), self.batch_size):
+                if self._stop.is_set():
+                    return
+
+                batch = self.dataset.get_batch(
+                    self._indices[start: start + self.batch_size])
+                if self.transforms is not None:
+                    batch = self.transforms(**batch)
+
+                self._put(batch)
+
+        except Exception as e:
+            # re-raised by the consumer, which would wait forever otherwise
+            self._put(_LoaderError(e))
+            return
+
+        self._put(None)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def __iter__(self):
+        self._finish()
+        self._stop.clear()
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._thread = threading.Thread(target=self._load, daemon=True)
+        self._thread.start()
+
+        # stop loading if the consumer doesn't iterate until the end
+        try:
+            while True:
+                batch = self._queue.get()
+                if batch is None:
+                    break
+                if isinstance(batch, _LoaderError):
+                    raise batch.exception
+                yield batch
+        finally:
+            self._finish()
+
+    def _finish(self):
+        """
+        Stops the background thread
+
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+
+class MemmapDataManager(object):
+    """
+    Data manager for :class:`MemmapDataset`, which can be used as drop-in
+    replacement for delira's ``BaseDataManager`` with
+    :class:`ENASExperimentPyTorch`
+
+    """
+
+    def __init__(self, dataset, batch_size, transforms=None, shuffle=True,
+                 n_process_augmentation=1, num_prefetch=2):
+        """
+
+        Parameters
+        ----------
+        dataset : :class:`MemmapDataset`
+            the dataset
+        batch_size : int
+            number of samples per batch
+        transforms : callable or None
+            batch transforms (e.g. :class:`BatchAugmentation`)
+        shuffle : bool
+            whether to iterate in random order
+        n_process_augmentation : int
+            only for compatibility; augmentation always runs in a single
+            background thread
+        num_prefetch : int
+            number of batches to prepare in advance
+
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.transforms = transforms
+        self.shuffle = shuffle
+        self.n_process_augmentation = n_process_augmentation
+        self.num_prefetch = num_prefetch
+
+    @property
+    def n_samples(self):
+        return len(self.dataset)
+
+    @property
+    def n_batches(self):
+        return int(np.ceil(self.n_samples / self.batch_size))
+
+    def get_batchgen(self, seed=1):
+        """
+        Creates a new batch generator
+
+        Parameters
+        ----------
+        seed : int
+            random seed for shuffling
+
+        Returns
+        -------
+        :class:`MemmapBatchGenerator`
+            the batch generator
+
+        """
+        return MemmapBatchGenerator(self.dataset, self.batch_size,
+                                    self.transforms, self.shuffle, seed,
+                                    self.num_prefetch)
+
+
+class DeviceRewardBatchGenerator(object):
+    """
+    Iterates random batches of a device-resident data subset. Provides the
+    parts of the ``MultiThreadedAugmenter`` interface, which are used by
+    :class:`ENASTrainerPyTorch`
+
+    """
+
+    def __init__(self, data, labels, batch_size, num_batches, seed=1):
+        """
+
+        Parameters
+        ----------
+        data : :class:`torch.Tensor`
+            the normalized images (N x C x H x W, on the computing device)
+        labels : :class:`torch.Tensor`
+            the labels (N x 1, on the computing device)
+        batch_size : int
+            number of samples per batch
+        num_batches : int
+            number of batches to iterate
+        seed : int
+            random seed for shuffling
+
+        """
+        self.data = data
+        self.labels = labels
+        self.batch_size = batch_size
+        self._num_batches = num_batches
+        self.seed = seed
+
+    @property
+    def generator(self):
+        # batchgenerators' augmenters expose their loader as ``generator``
+        return self
+
+    @property
+    def num_batches(self):
+        return self._num_batches
+
+    @property
+    def num_processes(self):
+        return 1
+
+    def __iter__(self):
+        # consecutive permutations of the subset, so that each sample is used
+        # once before any sample is used again
+        rng = np.random.RandomState(self.seed)
+        n_samples = len(self.labels)
+        n_perms = int(np.ceil(self._num_batches * self.batch_size /
+                              n_samples))
+        indices = torch.from_numpy(np.concatenate(
+            [rng.permutation(n_samples) for _ in range(n_perms)])).to(
+            self.labels.device)
+
+        for start in range(0, self._num_batches * self.batch_size,
+                           self.batch_size):
+            batch_indices = indices[start: start + self.batch_size]
+            yield {"data": self.data[batch_indices],
+                   "label": self.labels[batch_indices]}
+
+    def _finish(self):
+        """
+        Only for compatibility; there are no background workers to stop
+
+        """
+        pass
+
+
+class DeviceRewardSet(object):
+    """
+    Data manager serving the controller's reward batches from a subset of a
+    dataset, which is kept normalized on the computing device. Can be used
+    in place of the controller's data manager of :class:`ENASTrainerPyTorch`
+
+    """
+
+    def __init__(self, dataset, num_samples, batch_size, device,
+                 num_batches=None, refresh_every=None, seed=0, epsilon=1e-7):
+        """
+
+        Parameters
+        ----------
+        dataset : :class:`MemmapDataset` or :class:`AbstractDataset`
+            the dataset to draw the subset from (without augmentation)
+        num_samples : int
+            number of samples in the subset
+        batch_size : int
+            number of samples per batch
+        device : str or :class:`torch.device`
+            the computing device
+        num_batches : int or None
+            number of batches per epoch; a single pass over the subset if
+            None
+        refresh_every : int or None
+            number of epochs (i.e. seeds passed to :meth:`get_batchgen`)
+            after which a new subset is drawn; the subset is fixed if None
+        seed : int
+            random seed for drawing the subsets
+        epsilon : float
+            epsilon of the normalization
+
+        """
+        self.dataset = dataset
+        self.num_samples = min(num_samples, len(dataset))
+        self.batch_size = batch_size
+        self.device = device
+        self.num_batches = num_batches
+        self.refresh_every = refresh_every
+        self.seed = seed
+        self.epsilon = epsilon
+
+        self.n_process_augmentation = 0
+
+        self.data = None
+        self.labels = None
+        self._subset_id = None
+
+    @property
+    def n_samples(self):
+        return self.num_samples
+
+    @property
+    def n_batches(self):
+        if self.num_batches is not None:
+            return self.num_batches
+        return int(np.ceil(self.num_samples / self.batch_size))
+
+    def _load(self, indices):
+        if hasattr(self.dataset, "get_batch"):
+            return self.dataset.get_batch(indices)
+
+        samples = [self.dataset[int(_idx)] for _idx in indices]
+        return {key: np.stack([np.asarray(_sample[key])
+                               for _sample in samples])
+                for key in ("data", "label")}
+
+    def refresh(self, subset_id=0):
+        """
+        Draws a new subset and moves it to the computing device
+
+        Parameters
+        ----------
+        subset_id : int
+            number of the subset (seeds the drawing together with ``seed``)
+
+        """
+        indices = np.random.RandomState(self.seed + subset_id).choice(
+            len(self.dataset), self.num_samples, replace=False)
+        batch = self._load(indices)
+
+        # free the previous subset first to bound the device memory
+        self.data, self.labels = None, None
+        self.data = zero_mean_unit_variance(
+            torch.as_tensor(batch["data"]).to(self.device, torch.float),
+            self.epsilon)
+        self.labels = torch.as_tensor(batch["label"]).to(
+            self.device, torch.long).view(-1, 1)
+        self._subset_id = subset_id
+
+    def get_batchgen(self, seed=1):
+        """
+        Creates a new batch generator (and draws a new subset if necessary)
+
+        Parameters
+        ----------
+        seed : int
+            random seed for shuffling; also determines the subset if it is
+            refreshed
+
+        Returns
+        -------
+        :class:`DeviceRewardBatchGenerator`
+            the batch generator
+
+        """
+        if self.refresh_every is None:
+            subset_id = 0
+        else:
+            subset_id = seed // self.refresh_every
+
+        if subset_id != self._subset_id:
+            self.refresh(subset_id)
+
+        return DeviceRewardBatchGenerator(self.data, self.labels,
+                                          self.batch_size, self.n_batches,
+                                          seed)
@@ -43,12 +43,15 @@ class ENASExperimentPyTorch(PyTorchExperiment):
         callback = CosineAnnealingLRCallbackPyTorch(
             trainer.optimizers["shared_cnn"], T_max=T_max, eta_min=eta_min)
         trainer.register_callback(callback)
+        # kept to adapt the schedule's length (e.g. in budget mode)
+        trainer.lr_schedule_callback = callback
         return trainer
 
     def run(self, train_data_controller: BaseDataManager,
             train_data_shared_cnn: BaseDataManager,
             val_data: BaseDataManager = None,
-            params: Parameters = None, **kwargs):
+            params: Parameters = None, train_kwargs: dict = None,
+            val_score_mode: str = "lowest", **kwargs):
 
         """
         Setup and run training
@@ -63,6 +66,14 @@ class ENASExperimentPyTorch(PyTorchExperiment):
         params : :class:`Parameters` or None
             the parameters to use for training and model instantiation
             (will be merged with ``self.params``)
+        train_kwargs : dict or None
+            additional keyword arguments for
+            :meth:`ENASTrainerPyTorch.train` (e.g. to configure the search
+            mode)
+        val_score_mode : str
+            whether the ``val_score_key`` is best when it's ``"highest"``
+            (e.g. accuracies) or ``"lowest"`` (e.g. losses); determines the
+            best checkpoint, which the final architecture is selected with
         **kwargs :
             additional keyword arguments
 
@@ -85,6 +96,10 @@ class ENASExperimentPyTorch(PyTorchExperiment):
 
         trainer = self.setup(params, training=True, **kwargs)
 
+        # keep the trainer to allow access to the search results
+        # (e.g. the best architecture) after training
+        self.trainer = trainer
+
         self._run += 1
 
         num_epochs = kwargs.get("num_epochs", training_params.nested_get(
@@ -93,7 +108,10 @@ class ENASExperimentPyTorch(PyTorchExperiment):
         if num_epochs is None:
             num_epochs = self.n_epochs
 
+        if train_kwargs is None:
+            train_kwargs = {}
+
         return trainer.train(num_epochs, train_data_controller,
                              train_data_shared_cnn, val_data,
-                             self.val_score_key, kwargs.get("val_score_mode",
-                                                            "lowest"))
\ No newline at end of file
+                             self.val_score_key, val_score_mode,
+                             **train_kwargs)
@@ -0,0 +1,187 @@
+import json
+import warnings
+
+import torch
+
+"""
+Notes
+-----
+
+Exports a single architecture as frozen TorchScript module, which contains
+the architecture's weights, the architecture itself (traced into the graph)
+and the input preprocessing. The architecture and the preprocessing
+constants are additionally stored as extra files inside the archive.
+
+Loading an exported module only requires torch (:func:`load_exported` has no
+further dependencies and may also be replaced by a plain
+``torch.jit.load``)::
+
+    module, metadata = load_exported("best_arc.pt")
+    logits = module(images)  # uint8 or float, N x 3 x H x W
+"""
+
+ARC_FILE = "arc.json"
+METADATA_FILE = "metadata.json"
+
+
+class _ExportWrapper(torch.nn.Module):
+    """
+    Applies the preprocessing and runs a :class:`SharedCNN` with a single
+    architecture
+
+    """
+
+    def __init__(self, shared_cnn, sample_arc, normalize=True,
+                 epsilon=1e-7):
+        super().__init__()
+        self.shared_cnn = shared_cnn
+        self.sample_arc = sample_arc
+        self.normalize = normalize
+        self.epsilon = epsilon
+
+    def forward(self, x):
+        from .models.preprocessing import zero_mean_unit_variance
+
+        x = x.float()
+        if self.normalize:
+            x = zero_mean_unit_variance(x, self.epsilon)
+
+        return self.shared_cnn(x, self.sample_arc)["pred"]
+
+
+def arc_to_json(sample_arc):
+    """
+    Converts an architecture to a json string
+
+    Parameters
+    ----------
+    sample_arc : dict
+        the architecture as sampled by the :class:`Controller`
+
+    Returns
+    -------
+    str
+        the json string
+
+    """
+    return json.dumps({key: [val.detach().cpu().view(-1).tolist()
+                             for val in value]
+                       for key, value in sample_arc.items()})
+
+
+def arc_from_json(arc_str, device=None):
+    """
+    Converts a json string back to an architecture
+
+    Parameters
+    ----------
+    arc_str : str
+        the json string (see :func:`arc_to_json`)
+    device : str or :class:`torch.device` or None
+        device to put the tensors to
+
+    Returns
+    -------
+    dict
+        the architecture
+
+    """
+    return {key: [torch.tensor(val, dtype=torch.long, device=device)
+                  for val in value]
+            for key, value in json.loads(arc_str).items()}
+
+
+def export_torchscript(network, file_path, sample_arc=None, input_size=32,
+                       normalize=True, epsilon=1e-7, metadata=None):
+    """
+    Exports an architecture as frozen TorchScript module
+
+    Parameters
+    ----------
+    network : :class:`SharedCNN` or :class:`ENASModelPyTorch`
+        the network containing the weights; either a network with a fixed
+        architecture or the shared network of the search
+    file_path : str
+        the file to save the module to
+    sample_arc : dict or None
+        the architecture to export; defaults to the network's fixed
+        architecture
+    input_size : int
+        spatial size of the example inputs used for tracing
+    normalize : bool
+        whether to normalize the inputs to zero mean and unit variance
+        (per sample and channel) inside the module
+    epsilon : float
+        epsilon of the normalization
+    metadata : dict or None
+        additional (json serializable) information to store
+
+    Returns
+    -------
+    :class:`torch.jit.ScriptModule`
+        the frozen module
+
+    """
+    shared_cnn = getattr(network, "shared_cnn", network)
+    if sample_arc is None:
+        sample_arc = shared_cnn.fixed_arc
+    if sample_arc is None:
+        raise ValueError("An architecture is needed to export a network "
+                         "without fixed architecture")
+
+    was_training = shared_cnn.training
+    device = next(shared_cnn.parameters()).device
+    wrapper = _ExportWrapper(shared_cnn, sample_arc, normalize, epsilon).eval()
+
+    example = torch.rand(2, 3, input_size, input_size, device=device)
+    with torch.no_grad(), warnings.catch_warnings():
+        # the architecture's control flow is constant and therefore traced
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        traced = torch.jit.trace(wrapper, example, check_trace=False)
+    frozen = torch.jit.freeze(traced)
+
+    shared_cnn.train(was_training)
+
+    _metadata = {"input_size": input_size,
+                 "normalize": normalize,
+                 "epsilon": epsilon,
+                 "torch_version": torch.__version__}
+    _metadata.update(metadata or {})
+
+    torch.jit.save(frozen, file_path,
+                   _extra_files={ARC_FILE: arc_to_json(sample_arc),
+                                 METADATA_FILE: json.dumps(_metadata)})
+
+    return frozen
+
+
+def load_exported(file_path, device="cpu"):
+    """
+    Loads a module exported by :func:`export_torchscript`
+
+    Parameters
+    ----------
+    file_path : str
+        the exported file
+    device : str or :class:`torch.device`
+        device to load the module to
+
+    Returns
+    -------
+    :class:`torch.jit.ScriptModule`
+        the module (mapping N x 3 x H x W images to logits)
+    dict
+        the metadata; contains the architecture as json string (see
+        :func:`arc_from_json`) under the key ``"arc"``
+
+    """
+    extra_files = {ARC_FILE: "", METADATA_FILE: ""}
+    module = torch.jit.load(file_path, map_location=device,
+                            _extra_files=extra_files)
+
+    metadata = json.loads(extra_files[METADATA_FILE])
+    metadata["arc"] = extra_files[ARC_FILE]
+    if isinstance(metadata["arc"], bytes):
+        metadata["arc"] = metadata["arc"].decode()
+
+    return module, metadata
@@ -0,0 +1,351 @@
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+from .models.arc_utils import encode_arc, decode_arc, num_skip_slots
+
+"""
+Notes
+-----
+
+The history is stored as a single binary file: a fixed size header followed
+by fixed width records, which are accessed as memory-mapped structured numpy
+array. Records are only ever appended, so the file can be analysed while the
+search is still running.
+"""
+
+_MAGIC = b"DENASHST"
+_VERSION = 1
+# magic, version, num_layers, number of records
+_HEADER = struct.Struct("<8sIIQ")
+_HEADER_SIZE = 64
+
+
+def history_dtype(num_layers):
+    """
+    Record layout of the architecture history
+
+    Parameters
+    ----------
+    num_layers : int
+        number of layers of the searched networks
+
+    Returns
+    -------
+    :class:`numpy.dtype`
+        structured dtype of a single record
+
+    """
+    n_skip_bytes = max(1, int(np.ceil(num_skip_slots(num_layers) / 8)))
+    return np.dtype([("epoch", "<i4"),
+                     ("step", "<i8"),
+                     ("reward", "<f4"),
+                     ("log_prob", "<f4"),
+                     ("entropy", "<f4"),
+                     ("branches", "i1", (num_layers,)),
+                     ("skips", "u1", (n_skip_bytes,))])
+
+
+class ArcHistory(object):
+    """
+    Append-only, memory-mapped log of all sampled architectures and their
+    rewards, log-probabilities and entropies
+
+    """
+
+    def __init__(self, file_path, num_layers=None, initial_capacity=65536):
+        """
+
+        Parameters
+        ----------
+        file_path : str
+            path of the history file; an existing history will be continued
+        num_layers : int or None
+            number of layers of the searched networks; may only be None if
+            ``file_path`` already exists
+        initial_capacity : int
+            number of records to allocate when creating a new file
+
+        """
+        self.file_path = file_path
+
+        if os.path.isfile(file_path):
+            with open(file_path, "rb") as f:
+                magic, version, _num_layers, n_records = _HEADER.unpack(
+                    f.read(_HEADER.size))
+
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("%s is no valid architecture history (v%d)"
+                                 % (file_path, _VERSION))
+            if num_layers is not None and num_layers != _num_layers:
+                raise ValueError("History has been created for %d layers, "
+                                 "but got %d" % (_num_layers, num_layers))
+            num_layers = _num_layers
+
+        else:
+            if num_layers is None:
+                raise ValueError("num_layers must be given to create a new "
+                                 "history")
+            n_records = 0
+            with open(file_path, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, _VERSION, num_layers, 0).ljust(
+                    _HEADER_SIZE, b"\0"))
+
+        self.num_layers = num_layers
+        self.dtype = history_dtype(num_layers)
+        self._n_records = n_records
+        self._capacity = 0
+        self._memmap = None
+        self._reserve(max(initial_capacity, n_records))
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _reserve(self, capacity):
+        """
+        Grows the file (and the memory map) to hold at least ``capacity``
+        records
+
+        """
+        if capacity <= self._capacity:
+            return
+
+        file_size = _HEADER_SIZE + capacity * self.dtype.itemsize
+        if os.path.getsize(self.file_path) < file_size:
+            with open(self.file_path, "r+b") as f:
+                f.truncate(file_size)
+
+        if self._memmap is not None:
+            self._memmap.flush()
+            del self._memmap
+
+        self._memmap = np.memmap(self.file_path, dtype=self.dtype, mode="r+",
+                                 offset=_HEADER_SIZE, shape=(capacity,))
+        self._capacity = capacity
+
+    def _write_header(self):
+        with open(self.file_path, "r+b") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, self.num_layers,
+                                 self._n_records))
+
+    def _write_loop(self):
+        while True:
+            records = [self._queue.get()]
+
+            # write everything, which is available, at once
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            valid_records = [_record for _record in records
+                             if _record is not None]
+
+            if valid_records:
+                with self._lock:
+                    n_new = len(valid_records)
+                    if self._n_records + n_new > self._capacity:
+                        self._reserve(max(2 * self._capacity,
+                                          self._n_records + n_new))
+
+                    self._memmap[self._n_records:
+                                 self._n_records + n_new] = np.array(
+                        valid_records, dtype=self.dtype)
+                    self._n_records += n_new
+                    self._memmap.flush()
+                    self._write_header()
+
+            for _ in records:
+                self._queue.task_done()
+
+            if len(valid_records) < len(records):
+                break
+
+    def append(self, sample_arc, reward, log_prob=0., entropy=0., epoch=0,
+               step=0):
+        """
+        Appends a sampled architecture to the history without waiting for it
+        to be written
+
+        Parameters
+        ----------
+        sample_arc : dict
+            the sampled architecture
+        reward : float
+            the reward (accuracy) of the architecture
+        log_prob : float
+            the log-probability of the architecture
+        entropy : float
+            the entropy of the sampling distribution
+        epoch : int
+            current epoch
+        step : int
+            current step
+
+        """
+        branches, skips = encode_arc(sample_arc, self.num_layers)
+        skips = np.packbits(skips)
+        if not skips.size:
+            skips = np.zeros(1, dtype=np.uint8)
+
+        self._queue.put((epoch, step, reward, log_prob, entropy, branches,
+                         skips))
+
+    def flush(self):
+        """
+        Waits until all appended records have been written
+
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Writes all pending records and stops the writer thread
+
+        """
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def __len__(self):
+        return self._n_records
+
+    @property
+    def records(self):
+        """
+        All records written so far (memory-mapped, read-only view)
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            structured array of records
+
+        """
+        with self._lock:
+            records = self._memmap[:self._n_records]
+        records = records.view(np.ndarray)
+        records.flags.writeable = False
+        return records
+
+    def skips(self, records=None):
+        """
+        Unpacks the skip connections of the given records
+
+        Parameters
+        ----------
+        records : :class:`numpy.ndarray` or None
+            records to unpack; all records if None
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            flattened skip connections (N x ``num_skip_slots(num_layers)``)
+
+        """
+        if records is None:
+            records = self.records
+        return np.unpackbits(records["skips"], axis=-1)[
+               ..., :num_skip_slots(self.num_layers)]
+
+    def top_k(self, k=10):
+        """
+        Records with the highest reward
+
+        Parameters
+        ----------
+        k : int
+            number of records to return
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            the ``k`` best records in descending order of their reward
+
+        """
+        records = self.records
+        k = min(k, len(records))
+        if not k:
+            return records[:0]
+
+        idxs = np.argpartition(-records["reward"], k - 1)[:k]
+        idxs = idxs[np.argsort(-records["reward"][idxs], kind="stable")]
+        return records[idxs]
+
+    def branch_frequencies(self, num_branches=6, epoch=None):
+        """
+        Relative frequencies of each branch type per layer
+
+        Parameters
+        ----------
+        num_branches : int
+            number of branch types
+        epoch : int or None
+            restrict to records of this epoch; all records if None
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            frequencies (shape: ``num_layers`` x ``num_branches``)
+
+        """
+        records = self.records
+        if epoch is not None:
+            records = records[records["epoch"] == epoch]
+
+        branches = records["branches"].astype(np.int64)
+        offsets = np.arange(self.num_layers) * num_branches
+        counts = np.bincount((branches + offsets).ravel(),
+                             minlength=self.num_layers * num_branches)
+        counts = counts.reshape(self.num_layers, num_branches)
+        return counts / max(len(records), 1)
+
+    def reward_by_epoch(self):
+        """
+        Mean and maximum reward per epoch
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            the epochs
+        :class:`numpy.ndarray`
+            the mean rewards
+        :class:`numpy.ndarray`
+            the maximum rewards
+
+        """
+        records = self.records
+        epochs, inverse = np.unique(records["epoch"], return_inverse=True)
+        rewards = records["reward"].astype(np.float64)
+        counts = np.bincount(inverse, minlength=len(epochs))
+        mean_rewards = np.bincount(inverse, weights=rewards,
+                                   minlength=len(epochs)) / counts
+
+        max_rewards = np.full(len(epochs), -np.inf)
+        np.maximum.at(max_rewards, inverse, rewards)
+
+        return epochs, mean_rewards, max_rewards
+
+    def decode(self, record, device=None):
+        """
+        Converts a record back to an architecture
+
+        Parameters
+        ----------
+        record : :class:`numpy.void`
+            a single record
+        device : str or :class:`torch.device` or None
+            device to put the architecture's tensors to
+
+        Returns
+        -------
+        dict
+            the architecture
+
+        """
+        return decode_arc(record["branches"], self.skips(record), device)
@@ -0,0 +1,328 @@
+import csv
+import os
+import time
+
+import numpy as np
+import torch
+
+from .models.cost import BRANCH_OPS
+
+"""
+Notes
+-----
+
+Opt-in instrumentation of the :class:`SharedCNN`'s forward passes in
+production runs: forward (pre-)hooks on the layers, their branches and the
+factorized reductions count how often each op runs and measure its time and
+memory. The ops are keyed by op type, layer and input resolution; the skip
+aggregation of a layer (skip connections and normalization) is measured as
+the time between the end of its last branch and the end of the layer.
+
+All calls are counted, but only a random fraction (``sample_rate``) of the
+network's forward passes is timed to keep the overhead small. On GPUs the
+timing uses CUDA events, which are only resolved when the statistics are
+read, so the measurement doesn't synchronize the device; the peak memory of
+the leaf ops (branches and reductions) is measured with the allocator's peak
+statistics, which are reset before each timed op.
+
+Usage::
+
+    instrumentation = OpInstrumentation(sample_rate=0.05,
+                                        file_path="op_stats.csv")
+    instrumentation.attach(shared_cnn)
+    ...  # train an epoch
+    instrumentation.dump(epoch)
+"""
+
+STAT_FIELDS = ("count", "timed", "seconds", "bytes", "peak_bytes")
+
+
+def _output_bytes(outputs):
+    if isinstance(outputs, torch.Tensor):
+        return outputs.numel() * outputs.element_size()
+    if isinstance(outputs, (list, tuple)):
+        return sum(_output_bytes(_out) for _out in outputs)
+    return 0
+
+
+def _layer_branches(layer):
+    """
+    The branches of a layer and their op names
+
+    """
+    if hasattr(layer, "branch"):
+        return [(BRANCH_OPS[int(layer.layer_type)], layer.branch)]
+    return list(zip(BRANCH_OPS, layer.branches))
+
+
+class OpInstrumentation(object):
+    """
+    Aggregates counts, time and memory of the ops of a :class:`SharedCNN`
+    per op type, layer and resolution
+
+    Parameters
+    ----------
+    sample_rate : float
+        fraction of the forward passes to measure (all passes are counted)
+    file_path : str or None
+        csv file to append the statistics to in :meth:`dump`
+    track_peak_memory : bool
+        whether to measure the peak memory of the leaf ops on GPUs (resets
+        the allocator's peak statistics)
+    max_pending : int
+        number of unresolved GPU measurements, after which they are resolved
+        (bounds the number of kept CUDA events)
+    seed : int or None
+        random seed for sampling the forward passes
+
+    """
+
+    def __init__(self, sample_rate=0.05, file_path=None,
+                 track_peak_memory=True, max_pending=10000, seed=None):
+        self.sample_rate = sample_rate
+        self.file_path = file_path
+        self.track_peak_memory = track_peak_memory
+        self.max_pending = max_pending
+
+        self._rng = np.random.RandomState(seed)
+        self._shared_cnn = None
+        self._handles = []
+        self._active = False
+        self._stack = []
+        self._pending = []
+        self._stats = {}
+
+    def attach(self, shared_cnn):
+        """
+        Registers the hooks on a network
+
+        Parameters
+        ----------
+        shared_cnn : :class:`SharedCNN`
+            the network to instrument
+
+        """
+        self.detach()
+        self._shared_cnn = shared_cnn
+
+        self._handles.append(shared_cnn.register_forward_pre_hook(
+            self._sample_hook))
+        self._handles.append(shared_cnn.register_forward_hook(
+            self._stop_hook))
+
+        for layer_id, layer in enumerate(shared_cnn.layers):
+            self._register(layer, "layer", layer_id)
+            for op, branch in _layer_branches(layer):
+                self._register(branch, op, layer_id)
+
+        # the reductions are ordered by pool layer and reduced layer
+        reduced_layers = [_layer_id for _pool_layer in shared_cnn.pool_layers
+                          for _layer_id in range(_pool_layer + 1)]
+        for layer_id, reduction in zip(reduced_layers,
+                                       shared_cnn.pooled_layers):
+            self._register(reduction, "reduction", layer_id)
+
+        # the fused reductions aren't modules and are measured explicitly
+        shared_cnn.instrumentation = self
+
+    def detach(self):
+        """
+        Removes all hooks from the instrumented network
+
+        """
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+        if self._shared_cnn is not None:
+            self._shared_cnn.instrumentation = None
+            self._shared_cnn = None
+
+    def _register(self, module, op, layer_id):
+        def _pre_hook(module, inputs):
+            self.begin(op, layer_id, inputs[0])
+
+        def _hook(module, inputs, outputs):
+            self.end(outputs)
+
+        self._handles.append(module.register_forward_pre_hook(_pre_hook))
+        self._handles.append(module.register_forward_hook(_hook))
+
+    def _sample_hook(self, module, inputs):
+        self._active = self._rng.rand() < self.sample_rate
+        self._stack = []
+
+    def _stop_hook(self, module, inputs, outputs):
+        self._active = False
+
+    def _entry(self, key):
+        if key not in self._stats:
+            self._stats[key] = np.zeros(len(STAT_FIELDS))
+        return self._stats[key]
+
+    @staticmethod
+    def _timestamp(device):
+        if device.type == "cuda":
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+        return time.perf_counter()
+
+    def begin(self, op, layer_id, x):
+        """
+        Starts measuring an op (called by the hooks)
+
+        Parameters
+        ----------
+        op : str
+            the op type
+        layer_id : int
+            the op's layer
+        x : :class:`torch.Tensor` or list
+            the op's input (or inputs)
+
+        """
+        if isinstance(x, (list, tuple)):
+            x = x[0]
+        key = (op, layer_id, x.shape[-1])
+        self._entry(key)[0] += 1
+        if op == "layer":
+            self._entry(("aggregation",) + key[1:])[0] += 1
+
+        if not self._active:
+            return
+
+        device = x.device
+        leaf = op != "layer"
+        if leaf and self.track_peak_memory and device.type == "cuda":
+            memory = torch.cuda.memory_allocated(device)
+            torch.cuda.reset_peak_memory_stats(device)
+        else:
+            memory = None
+
+        # key, device, start, end of the last child, memory at the start
+        self._stack.append([key, device, self._timestamp(device), None,
+                            memory])
+
+    def end(self, outputs):
+        """
+        Stops measuring the current op (called by the hooks)
+
+        Parameters
+        ----------
+        outputs : :class:`torch.Tensor` or list
+            the op's output (or outputs)
+
+        """
+        if not self._active or not self._stack:
+            return
+
+        key, device, start, last_child_end, memory = self._stack.pop()
+        end = self._timestamp(device)
+
+        if memory is not None:
+            peak = torch.cuda.max_memory_allocated(device) - memory
+        else:
+            peak = 0
+
+        num_bytes = _output_bytes(outputs)
+        self._pending.append((key, start, end, num_bytes, peak))
+        if key[0] == "layer" and last_child_end is not None:
+            self._pending.append((("aggregation",) + key[1:],
+                                  last_child_end, end, num_bytes, 0))
+
+        if self._stack:
+            self._stack[-1][3] = end
+
+        if len(self._pending) >= self.max_pending:
+            self._resolve()
+
+    def _resolve(self):
+        """
+        Adds all pending measurements to the statistics
+
+        """
+        for key, start, end, num_bytes, peak in self._pending:
+            if isinstance(end, float):
+                seconds = end - start
+            else:
+                end.synchronize()
+                seconds = start.elapsed_time(end) / 1000.
+
+            entry = self._entry(key)
+            entry[1] += 1
+            entry[2] += seconds
+            entry[3] += num_bytes
+            entry[4] = max(entry[4], peak)
+
+        self._pending = []
+
+    def stats(self):
+        """
+        The aggregated statistics
+
+        Returns
+        -------
+        list
+            one dict per op type, layer and resolution containing the number
+            of calls, of timed calls, the total time (in seconds) and output
+            bytes of the timed calls, the mean time (in milliseconds) and the
+            maximum peak memory (in bytes)
+
+        """
+        self._resolve()
+
+        rows = []
+        for (op, layer_id, resolution), entry in sorted(
+                self._stats.items(), key=lambda x: (x[0][1], x[0][0],
+                                                    x[0][2])):
+            row = {"op": op, "layer": layer_id, "resolution": resolution}
+            row.update({_field: int(_val) if _field != "seconds"
+                        else float(_val)
+                        for _field, _val in zip(STAT_FIELDS, entry)})
+            row["mean_ms"] = float(1e3 * entry[2] / max(entry[1], 1))
+            rows.append(row)
+
+        return rows
+
+    def reset(self):
+        """
+        Discards all statistics
+
+        """
+        self._pending = []
+        self._stats = {}
+
+    def dump(self, epoch, file_path=None):
+        """
+        Appends the statistics to a csv file and resets them
+
+        Parameters
+        ----------
+        epoch : int
+            the epoch to tag the statistics with
+        file_path : str or None
+            the csv file; defaults to ``file_path`` of the instrumentation
+
+        Returns
+        -------
+        list
+            the dumped statistics (see :meth:`stats`)
+
+        """
+        if file_path is None:
+            file_path = self.file_path
+
+        rows = self.stats()
+        if file_path is not None and rows:
+            write_header = not os.path.isfile(file_path)
+            with open(file_path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=["epoch"] +
+                                        list(rows[0].keys()))
+                if write_header:
+                    writer.writeheader()
+                for row in rows:
+                    writer.writerow({"epoch": epoch, **row})
+
+        self.reset()
+        return rows
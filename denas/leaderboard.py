@@ -0,0 +1,122 @@
+from .scheduling import _arc_key
+
+"""
+Notes
+-----
+
+Keeps the best architectures found during the search instead of selecting
+the best architecture from scratch every epoch: each epoch the current
+leaders are re-scored against the current shared weights together with a
+few newly sampled architectures, and the best ``size`` of them are kept.
+The final architecture is therefore chosen from the whole search history,
+while each epoch only evaluates ``size + num_new`` architectures.
+"""
+
+
+class ArcLeaderboard(object):
+    """
+    Persistent top-k leaderboard of architectures
+
+    Parameters
+    ----------
+    size : int
+        number of architectures to keep
+    num_new : int
+        number of newly sampled candidates per selection (more are sampled
+        as long as the leaderboard isn't full)
+    num_batches : int
+        number of batches, all candidates are scored on
+    final_num_batches : int or None
+        number of batches for the final selection at the end of the
+        training; defaults to ``num_batches``
+
+    """
+
+    def __init__(self, size=10, num_new=2, num_batches=1,
+                 final_num_batches=None):
+        self.size = size
+        self.num_new = num_new
+        self.num_batches = num_batches
+        self.final_num_batches = final_num_batches or num_batches
+
+        # dicts with the architecture, its latest score and the epoch it
+        # entered the leaderboard, sorted by score
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def num_samples(self):
+        """
+        Number of new architectures to sample for the next selection
+
+        """
+        return max(self.num_new, self.size - len(self.entries))
+
+    def candidates(self, new_arcs):
+        """
+        Combines the leaders with new architectures
+
+        Parameters
+        ----------
+        new_arcs : list
+            the newly sampled architectures
+
+        Returns
+        -------
+        list
+            the leaders followed by the new architectures, which aren't on
+            the leaderboard yet (without duplicates)
+        list
+            the epochs, the candidates entered the leaderboard (None for new
+            architectures)
+
+        """
+        arcs = [_entry["arc"] for _entry in self.entries]
+        epochs = [_entry["epoch"] for _entry in self.entries]
+
+        keys = {_arc_key(_arc) for _arc in arcs}
+        for arc in new_arcs:
+            key = _arc_key(arc)
+            if key not in keys:
+                keys.add(key)
+                arcs.append(arc)
+                epochs.append(None)
+
+        return arcs, epochs
+
+    def update(self, arcs, scores, epochs, epoch=None):
+        """
+        Replaces the leaderboard by the best of the scored candidates
+
+        Parameters
+        ----------
+        arcs : list
+            the candidates (see :meth:`candidates`)
+        scores : list
+            their scores under the current weights
+        epochs : list
+            the epochs, they entered the leaderboard (None for new
+            candidates)
+        epoch : int or None
+            the current epoch
+
+        """
+        entries = [{"arc": _arc, "score": float(_score),
+                    "epoch": _epoch if _epoch is not None else epoch}
+                   for _arc, _score, _epoch in zip(arcs, scores, epochs)]
+
+        # stable sort: on ties the older leaders stay ahead
+        entries.sort(key=lambda x: -x["score"])
+        self.entries = entries[:self.size]
+
+    @property
+    def best(self):
+        """
+        The best architecture and its latest score (None if empty)
+
+        """
+        if not self.entries:
+            return None, None
+        return self.entries[0]["arc"], self.entries[0]["score"]
@@ -1,4 +1,21 @@
+import importlib
+
 from .controller import Controller
 from .shared_cnn import SharedCNN, ConvBranch, ENASLayer, FactorizedReduction, \
     FixedLayer, PoolBranch, SeparableConv
-from .enas import ENASModelPyTorch
+from .arc_utils import encode_arc, encode_arcs, decode_arc
+from .cost import OpCostTable, LatencyTable, BRANCH_OPS, estimate_costs
+
+# depends on delira and is therefore only imported on first access
+_LAZY_ATTRS = {"ENASModelPyTorch": ".enas"}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRS:
+        raise AttributeError("module %r has no attribute %r"
+                             % (__name__, name))
+
+    value = getattr(importlib.import_module(_LAZY_ATTRS[name], __name__),
+                    name)
+    globals()[name] = value
+    return value
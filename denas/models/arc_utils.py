@@ -0,0 +1,123 @@
+import numpy as np
+import torch
+
+
+def num_skip_slots(num_layers):
+    """
+    Number of possible skip connections in a network with ``num_layers``
+    layers (layer ``i`` may connect to each of its ``i`` predecessors)
+
+    Parameters
+    ----------
+    num_layers : int
+        number of layers
+
+    Returns
+    -------
+    int
+        number of possible skip connections
+
+    """
+    return num_layers * (num_layers - 1) // 2
+
+
+def encode_arc(sample_arc, num_layers=None):
+    """
+    Encodes an architecture as fixed size numpy arrays
+
+    Parameters
+    ----------
+    sample_arc : dict
+        the architecture as sampled by the :class:`Controller`
+    num_layers : int or None
+        number of layers; inferred from ``sample_arc`` if None
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        branch ids per layer (shape: ``num_layers``)
+    :class:`numpy.ndarray`
+        flattened skip connections, where the skips of layer ``i`` are
+        stored at ``[i * (i - 1) // 2: i * (i + 1) // 2]``
+        (shape: ``num_skip_slots(num_layers)``)
+
+    """
+    if num_layers is None:
+        num_layers = len(sample_arc)
+
+    branches = np.zeros(num_layers, dtype=np.int8)
+    skips = np.zeros(num_skip_slots(num_layers), dtype=np.uint8)
+
+    for layer_id in range(num_layers):
+        value = sample_arc[str(layer_id)]
+        if value[0].numel() > 1:
+            raise ValueError("Only architectures searched with whole "
+                             "channels can be encoded")
+        branches[layer_id] = int(value[0])
+        if layer_id > 0:
+            start = num_skip_slots(layer_id)
+            skips[start: start + layer_id] = np.asarray(
+                value[1].detach().cpu().view(-1).numpy())
+
+    return branches, skips
+
+
+def encode_arcs(sample_arcs, num_layers=None):
+    """
+    Encodes several architectures as stacked numpy arrays
+
+    Parameters
+    ----------
+    sample_arcs : list
+        list of architectures as sampled by the :class:`Controller`
+    num_layers : int or None
+        number of layers; inferred from the first architecture if None
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        branch ids (shape: N x ``num_layers``)
+    :class:`numpy.ndarray`
+        flattened skip connections (shape: N x ``num_skip_slots(num_layers)``)
+
+    See Also
+    --------
+    :func:`encode_arc`
+
+    """
+    encoded = [encode_arc(_arc, num_layers) for _arc in sample_arcs]
+    return (np.stack([_enc[0] for _enc in encoded]),
+            np.stack([_enc[1] for _enc in encoded]))
+
+
+def decode_arc(branches, skips, device=None):
+    """
+    Converts an encoded architecture back to the format sampled by the
+    :class:`Controller`
+
+    Parameters
+    ----------
+    branches : :class:`numpy.ndarray`
+        branch ids per layer
+    skips : :class:`numpy.ndarray`
+        flattened skip connections
+    device : str or :class:`torch.device` or None
+        device to put the tensors to
+
+    Returns
+    -------
+    dict
+        the decoded architecture
+
+    """
+    sample_arc = {}
+    for layer_id in range(len(branches)):
+        sample_arc[str(layer_id)] = [
+            torch.tensor([int(branches[layer_id])], device=device)]
+        if layer_id > 0:
+            start = num_skip_slots(layer_id)
+            sample_arc[str(layer_id)].append(torch.tensor(
+                np.asarray(skips[start: start + layer_id], dtype=np.int64),
+                device=device))
+
+    return sample_arc
@@ -5,7 +5,8 @@ from torch.distributions.categorical import Categorical
 class Controller(torch.nn.Module):
     """
     Controller LSTM samples
-    1) what computation operation to use and
+    1) what computation operation to use (or, if not searching for whole
+       channels, which range of channels to compute for each operation) and
     2) which previous node to connect.
 
     """
@@ -59,7 +60,20 @@ class Controller(torch.nn.Module):
             self.w_soft = torch.nn.Linear(self.lstm_size, self.num_branches,
                                           bias=False)
         else:
-            assert False, "Not implemented error: search_whole_channels = False"
+            # for each branch: the first channel and the number of channels
+            # to compute
+            self.w_emb_start = torch.nn.ModuleList([
+                torch.nn.Embedding(self.out_filters, self.lstm_size)
+                for _ in range(self.num_branches)])
+            self.w_emb_count = torch.nn.ModuleList([
+                torch.nn.Embedding(self.out_filters, self.lstm_size)
+                for _ in range(self.num_branches)])
+            self.w_soft_start = torch.nn.ModuleList([
+                torch.nn.Linear(self.lstm_size, self.out_filters, bias=False)
+                for _ in range(self.num_branches)])
+            self.w_soft_count = torch.nn.ModuleList([
+                torch.nn.Linear(self.lstm_size, self.out_filters, bias=False)
+                for _ in range(self.num_branches)])
 
         self.w_attn_1 = torch.nn.Linear(self.lstm_size, self.lstm_size,
                                         bias=False)
@@ -78,7 +92,30 @@ class Controller(torch.nn.Module):
         torch.nn.init.uniform_(self.w_lstm.weight_hh_l0, -0.1, 0.1)
         torch.nn.init.uniform_(self.w_lstm.weight_ih_l0, -0.1, 0.1)
 
-    def forward(self):
+    def _scale_logit(self, logit):
+        if self.temperature is not None:
+            logit /= self.temperature
+        if self.tanh_constant is not None:
+            logit = self.tanh_constant * torch.tanh(logit)
+        return logit
+
+    def forward(self, arc=None):
+        """
+        Samples an architecture or, if ``arc`` is given, evaluates the
+        log-probability, entropy and skip penalty of that architecture under
+        the current policy
+
+        Parameters
+        ----------
+        arc : dict or None
+            architecture to evaluate instead of sampling a new one
+
+        Returns
+        -------
+        dict
+            dictionary containing the (sampled or given) architecture
+
+        """
         h0 = None  # setting h0 to None will initialize LSTM state with 0s
 
         anchors = []
@@ -108,7 +145,10 @@ class Controller(torch.nn.Module):
                     logit = self.tanh_constant * torch.tanh(logit)
 
                 branch_id_dist = Categorical(logits=logit)
-                branch_id = branch_id_dist.sample()
+                if arc is None:
+                    branch_id = branch_id_dist.sample()
+                else:
+                    branch_id = arc[str(layer_id)][0].to(logit.device)
 
                 arc_seq[str(layer_id)] = [branch_id]
 
@@ -121,7 +161,58 @@ class Controller(torch.nn.Module):
                 inputs = inputs.unsqueeze(0)
             else:
                 # https://github.com/melodyguan/enas/blob/master/src/cifar10/general_controller.py#L171
-                raise NotImplementedError()
+                config = []
+                for branch_id in range(self.num_branches):
+                    inputs = inputs.unsqueeze(0)
+                    output, hn = self.w_lstm(inputs, h0)
+                    output = output.squeeze(0)
+                    h0 = hn
+
+                    logit = self._scale_logit(
+                        self.w_soft_start[branch_id](output))
+
+                    start_dist = Categorical(logits=logit)
+                    if arc is None:
+                        start = start_dist.sample()
+                    else:
+                        start = arc[str(layer_id)][0][2 * branch_id].view(
+                            1).to(logit.device)
+                    config.append(start)
+
+                    log_probs.append(start_dist.log_prob(start).view(-1))
+                    entropys.append(start_dist.entropy().view(-1))
+
+                    inputs = self.w_emb_start[branch_id](start)
+                    inputs = inputs.unsqueeze(0)
+                    output, hn = self.w_lstm(inputs, h0)
+                    output = output.squeeze(0)
+                    h0 = hn
+
+                    logit = self._scale_logit(
+                        self.w_soft_count[branch_id](output))
+
+                    # only allow channel ranges inside the layer's width
+                    mask = torch.arange(self.out_filters,
+                                        device=logit.device) <= (
+                        self.out_filters - 1 - start)
+                    logit = logit.masked_fill(~mask.view(1, -1),
+                                              torch.finfo(logit.dtype).min)
+
+                    count_dist = Categorical(logits=logit)
+                    if arc is None:
+                        count = count_dist.sample()
+                    else:
+                        count = arc[str(layer_id)][0][2 * branch_id + 1].view(
+                            1).to(logit.device) - 1
+                    config.append(count + 1)
+
+                    log_probs.append(count_dist.log_prob(count).view(-1))
+                    entropys.append(count_dist.entropy().view(-1))
+
+                    inputs = self.w_emb_count[branch_id](count)
+
+                arc_seq[str(layer_id)] = [torch.cat(config)]
+                inputs = inputs.unsqueeze(0)
 
             output, hn = self.w_lstm(inputs, h0)
             output = output.squeeze(0)
@@ -137,7 +228,10 @@ class Controller(torch.nn.Module):
                     logit = self.tanh_constant * torch.tanh(logit)
 
                 skip_dist = Categorical(logits=logit)
-                skip = skip_dist.sample()
+                if arc is None:
+                    skip = skip_dist.sample()
+                else:
+                    skip = arc[str(layer_id)][1].to(logit.device)
                 skip = skip.view(layer_id)
 
                 arc_seq[str(layer_id)].append(skip)
@@ -0,0 +1,517 @@
+import numpy as np
+
+"""
+Notes
+-----
+
+Costs of architectures from the macro search space are estimated by summing
+per-operation costs from a lookup table instead of running the architecture.
+Each entry is indexed by the operation's name and the stage (resolution) it
+runs at, where stage ``i`` works on inputs downsampled by ``2 ** i``.
+"""
+
+# names of the ENASLayer branches (in order of their branch ids)
+BRANCH_OPS = ("conv3x3", "sep_conv3x3", "conv5x5", "sep_conv5x5", "avg_pool",
+              "max_pool")
+
+
+def pool_layers(num_layers):
+    """
+    Layers after which all previous outputs are reduced (as in
+    :class:`SharedCNN`)
+
+    Parameters
+    ----------
+    num_layers : int
+        number of layers
+
+    Returns
+    -------
+    list
+        ids of the pool layers
+
+    """
+    pool_distance = num_layers // 3
+    return [pool_distance - 1, 2 * pool_distance - 1]
+
+
+def layer_stages(num_layers):
+    """
+    Stage (number of preceding reductions) of each layer
+
+    Parameters
+    ----------
+    num_layers : int
+        number of layers
+
+    Returns
+    -------
+    list
+        stage per layer
+
+    """
+    _pool_layers = pool_layers(num_layers)
+    stages, stage = [], 0
+    for layer_id in range(num_layers):
+        stages.append(stage)
+        if layer_id in _pool_layers:
+            stage += 1
+    return stages
+
+
+def _op_params_flops_acts(op, channels, spatial, out_channels=None):
+    """
+    Parameters, FLOPs and produced activation values (per sample) of a single
+    operation of the networks; all cost estimates are derived from this
+    function
+
+    Parameters
+    ----------
+    op : str
+        the operation: one of ``BRANCH_OPS`` (a :class:`ConvBranch` or
+        :class:`PoolBranch` with equal in- and output planes), ``skip_add``
+        (adding a skip connection in :class:`ENASLayer`), ``skip_concat``
+        (the additional input planes of the 1x1 convolution in
+        :class:`FixedLayer` per concatenated skip connection), ``dim_reduc``
+        (the 1x1 convolution of the output in :class:`FixedLayer`),
+        ``layer_norm`` (the output of :class:`ENASLayer`), ``reduction``
+        (a :class:`FactorizedReduction`), ``stem`` or ``classifier``
+    channels : int
+        number of input planes
+    spatial : int
+        number of input pixels
+    out_channels : int or None
+        number of output planes; only used by ``reduction``, ``stem`` and
+        ``classifier``, defaults to ``channels``
+
+    Returns
+    -------
+    int
+        number of parameters
+    float
+        FLOPs
+    float
+        number of produced activation values
+
+    """
+    if out_channels is None:
+        out_channels = channels
+
+    if op in ("conv3x3", "conv5x5", "sep_conv3x3", "sep_conv5x5"):
+        kernel_size = 3 if op.endswith("3x3") else 5
+        if op.startswith("sep"):
+            weights = 2 * channels * channels + kernel_size ** 2 * channels
+            # depthwise output as additional intermediate
+            acts = 5 * channels * spatial
+        else:
+            weights = channels * channels + kernel_size ** 2 * channels ** 2
+            acts = 4 * channels * spatial
+        # two batchnorms with weight and bias
+        return weights + 4 * channels, 2 * weights * spatial, acts
+    elif op in ("avg_pool", "max_pool"):
+        # 1x1 conv followed by 9 comparisons / additions per value
+        return (channels * channels,
+                (2 * channels * channels + 9 * channels) * spatial,
+                3 * channels * spatial)
+    elif op == "skip_add":
+        return 0, channels * spatial, 0
+    elif op in ("skip_concat", "dim_reduc"):
+        # the output of dim_reduc passes a ReLU and a normalization
+        acts = (1 if op == "skip_concat" else 3) * channels * spatial
+        return (channels * channels, 2 * channels * channels * spatial,
+                acts)
+    elif op == "layer_norm":
+        return 0, 0, channels * spatial
+    elif op == "reduction":
+        # two paths with 1x1 convs, each producing half of the output planes
+        # at half of the resolution
+        return (channels * out_channels,
+                2 * channels * out_channels * spatial / 4,
+                2 * out_channels * spatial / 4)
+    elif op == "stem":
+        return (9 * channels * out_channels,
+                2 * 9 * channels * out_channels * spatial,
+                out_channels * spatial)
+    elif op == "classifier":
+        return channels * out_channels + out_channels, \
+            2 * channels * out_channels, 0
+    else:
+        raise ValueError("Unknown op {}".format(op))
+
+
+class OpCostTable(object):
+    """
+    Lookup table of per-operation costs, which allows to estimate the cost of
+    an architecture without running it
+
+    """
+
+    def __init__(self, costs: dict, num_layers, unit="flops",
+                 out_filters=None):
+        """
+
+        Parameters
+        ----------
+        costs : dict
+            dictionary mapping ``(op_name, stage)`` to the op's cost. Besides
+            the branch ops (see ``BRANCH_OPS``), the ops ``skip_add``
+            (adding a single skip connection in the searched network),
+            ``skip_concat`` (concatenating a single skip connection in the
+            final network), ``reduction`` (reducing a single previous output
+            at a pool layer, with the stage of its input), ``layer_norm`` and
+            ``dim_reduc`` (the ops at the end of each layer in the searched
+            and the final network), ``stem`` and ``classifier`` are used;
+            missing entries count as 0
+        num_layers : int
+            number of layers of the network
+        unit : str
+            unit of the costs (e.g. ``flops`` or ``us``)
+        out_filters : int or None
+            number of filters, the costs have been determined for; only
+            needed for architectures with sampled channel subsets
+
+        """
+        self.costs = costs
+        self.num_layers = num_layers
+        self.unit = unit
+        self.out_filters = out_filters
+
+        self._stages = layer_stages(num_layers)
+        self._pool_layers = pool_layers(num_layers)
+
+    def __getitem__(self, key):
+        return self.costs.get(key, 0.)
+
+    def arc_cost(self, sample_arc):
+        """
+        Estimates the cost of an architecture
+
+        Parameters
+        ----------
+        sample_arc : dict
+            the architecture as sampled by the :class:`Controller`
+
+        Returns
+        -------
+        float
+            the estimated cost
+
+        """
+        cost = self["stem", 0] + self["classifier", self._stages[-1]]
+
+        for layer_id in range(self.num_layers):
+            stage = self._stages[layer_id]
+            value = sample_arc[str(layer_id)]
+            config = [int(val) for val in value[0].view(-1).tolist()]
+
+            if len(config) == 1:
+                cost += self[BRANCH_OPS[config[0]], stage]
+            else:
+                # channel subsets: approximate each branch by the fraction
+                # of computed channels
+                if self.out_filters is None:
+                    raise ValueError("out_filters must be known to estimate "
+                                     "the cost of channel subsets")
+                for branch_id, op in enumerate(BRANCH_OPS):
+                    cost += self[op, stage] * config[2 * branch_id + 1] / \
+                        self.out_filters
+
+            if layer_id > 0:
+                cost += (self["skip_add", stage] +
+                         self["skip_concat", stage]) * int(value[1].sum())
+
+            cost += self["layer_norm", stage] + self["dim_reduc", stage]
+
+            if layer_id in self._pool_layers:
+                cost += self["reduction", stage] * (layer_id + 1)
+
+        return cost
+
+    @classmethod
+    def from_flops(cls, num_layers=12, out_filters=36, input_size=32,
+                   num_classes=10, num_input_channels=3, fixed=False):
+        """
+        Creates an analytic table containing the FLOPs of each operation,
+        which matches :func:`estimate_costs`
+
+        Parameters
+        ----------
+        num_layers : int
+            number of layers
+        out_filters : int
+            number of filters of the first stage
+        input_size : int
+            spatial size of the (square) inputs
+        num_classes : int
+            number of classes
+        num_input_channels : int
+            number of input channels
+        fixed : bool
+            if True, the FLOPs of the final network (:class:`SharedCNN` with
+            ``fixed_arc``) are tabulated; else the FLOPs of the searched
+            (shared) network
+
+        Returns
+        -------
+        :class:`OpCostTable`
+            the table
+
+        """
+        costs = {}
+        channels = out_filters
+        for stage in range(3):
+            spatial = (input_size // 2 ** stage) ** 2
+            ops = BRANCH_OPS + (("skip_concat", "dim_reduc") if fixed
+                                else ("skip_add", "layer_norm"))
+            for op in ops:
+                costs[op, stage] = float(
+                    _op_params_flops_acts(op, channels, spatial)[1])
+
+            # the final network doubles the filters at each reduction
+            out_channels = 2 * channels if fixed else channels
+            costs["reduction", stage] = float(_op_params_flops_acts(
+                "reduction", channels, spatial, out_channels)[1])
+            costs["classifier", stage] = float(_op_params_flops_acts(
+                "classifier", channels, 1, num_classes)[1])
+            channels = out_channels
+
+        costs["stem", 0] = float(_op_params_flops_acts(
+            "stem", num_input_channels, input_size ** 2, out_filters)[1])
+
+        return cls(costs, num_layers, unit="flops", out_filters=out_filters)
+
+
+class LatencyTable(object):
+    """
+    Measured per-operation latencies for several filter counts and batch
+    sizes, stored as versioned ``.npz`` file (see :mod:`denas.profiler` for
+    creating it)
+
+    """
+
+    VERSION = 1
+
+    def __init__(self, ops, stages, filters, batch_sizes, latencies,
+                 metadata=None):
+        """
+
+        Parameters
+        ----------
+        ops : :class:`numpy.ndarray`
+            op name of each entry
+        stages : :class:`numpy.ndarray`
+            stage of each entry
+        filters : :class:`numpy.ndarray`
+            number of filters of each entry
+        batch_sizes : :class:`numpy.ndarray`
+            batch size of each entry
+        latencies : :class:`numpy.ndarray`
+            latency of each entry in microseconds
+        metadata : dict or None
+            information about the profiled machine
+
+        """
+        self.ops = np.asarray(ops, dtype=str)
+        self.stages = np.asarray(stages, dtype=np.int64)
+        self.filters = np.asarray(filters, dtype=np.int64)
+        self.batch_sizes = np.asarray(batch_sizes, dtype=np.int64)
+        self.latencies = np.asarray(latencies, dtype=np.float64)
+
+        if metadata is None:
+            metadata = {}
+        self.metadata = metadata
+
+    def save(self, file_path):
+        """
+        Saves the table
+
+        Parameters
+        ----------
+        file_path : str
+            the file to save to
+
+        """
+        meta_keys = sorted(self.metadata.keys())
+        np.savez(file_path, version=np.array(self.VERSION), ops=self.ops,
+                 stages=self.stages, filters=self.filters,
+                 batch_sizes=self.batch_sizes, latencies=self.latencies,
+                 meta_keys=np.array(meta_keys, dtype=str),
+                 meta_values=np.array([str(self.metadata[key])
+                                       for key in meta_keys], dtype=str))
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Loads a table
+
+        Parameters
+        ----------
+        file_path : str
+            the file to load
+
+        Returns
+        -------
+        :class:`LatencyTable`
+            the loaded table
+
+        Raises
+        ------
+        ValueError
+            if the file has been created by an incompatible version
+
+        """
+        with np.load(file_path) as data:
+            version = int(data["version"])
+            if version != cls.VERSION:
+                raise ValueError("Latency table %s has version %d, but "
+                                 "version %d is required" % (
+                                     file_path, version, cls.VERSION))
+
+            metadata = dict(zip(data["meta_keys"].tolist(),
+                                data["meta_values"].tolist()))
+            return cls(data["ops"], data["stages"], data["filters"],
+                       data["batch_sizes"], data["latencies"], metadata)
+
+    def cost_table(self, num_layers, out_filters, batch_size=1):
+        """
+        Selects the entries for a single network configuration
+
+        Parameters
+        ----------
+        num_layers : int
+            number of layers of the network
+        out_filters : int
+            number of filters of the network
+        batch_size : int
+            batch size
+
+        Returns
+        -------
+        :class:`OpCostTable`
+            the latencies in microseconds
+
+        Raises
+        ------
+        KeyError
+            if the configuration hasn't been profiled
+
+        """
+        mask = (self.filters == out_filters) & \
+               (self.batch_sizes == batch_size)
+        if not mask.any():
+            raise KeyError("No latencies for %d filters and batch size %d"
+                           % (out_filters, batch_size))
+
+        costs = {(op, int(stage)): float(latency) for op, stage, latency in
+                 zip(self.ops[mask], self.stages[mask],
+                     self.latencies[mask])}
+
+        return OpCostTable(costs, num_layers, unit="us",
+                           out_filters=out_filters)
+
+
+def estimate_costs(branches, skips, out_filters=36, input_size=32,
+                   num_classes=10, fixed=True):
+    """
+    Analytic, vectorized estimate of the parameters, FLOPs and activations of
+    many architectures at once (without instantiating any network)
+
+    Parameters
+    ----------
+    branches : :class:`numpy.ndarray`
+        encoded branch ids (N x num_layers, see :func:`encode_arcs`)
+    skips : :class:`numpy.ndarray`
+        encoded skip connections (N x num_skip_slots(num_layers))
+    out_filters : int
+        number of filters of the first stage
+    input_size : int
+        spatial size of the (square) inputs
+    num_classes : int
+        number of classes
+    fixed : bool
+        if True, the costs of the final network (:class:`SharedCNN` with
+        ``fixed_arc``, i.e. doubling filters at each reduction and
+        concatenating skips in :class:`FixedLayer`) are estimated; else the
+        costs of the architecture inside the searched shared network
+
+    Returns
+    -------
+    dict
+        dictionary containing the number of parameters (``params``), the
+        FLOPs per sample (``flops``) and the number of activation values
+        produced per sample (``activations``) for each architecture
+
+    """
+    branches = np.asarray(branches, dtype=np.int64)
+    skips = np.asarray(skips, dtype=np.float64)
+    n_arcs, num_layers = branches.shape
+    _pool_layers = pool_layers(num_layers)
+    stages = layer_stages(num_layers)
+
+    # number of skip connections per layer: sum the flattened slots of
+    # each layer by multiplying with a (slots x layers) indicator matrix
+    slot_layers = np.repeat(np.arange(num_layers), np.arange(num_layers))
+    indicator = np.zeros((len(slot_layers), num_layers))
+    indicator[np.arange(len(slot_layers)), slot_layers] = 1.
+    n_skips = skips @ indicator
+
+    # per layer and branch type costs
+    branch_params = np.zeros((num_layers, len(BRANCH_OPS)))
+    branch_flops = np.zeros((num_layers, len(BRANCH_OPS)))
+    branch_acts = np.zeros((num_layers, len(BRANCH_OPS)))
+
+    # costs per skip connection and costs independent of the skips per layer
+    skip_params = np.zeros(num_layers)
+    skip_flops = np.zeros(num_layers)
+    skip_acts = np.zeros(num_layers)
+
+    channels = out_filters
+    base_params, base_flops, base_acts = _op_params_flops_acts(
+        "stem", 3, input_size ** 2, channels)
+
+    skip_op, layer_op = ("skip_concat", "dim_reduc") if fixed else \
+        ("skip_add", "layer_norm")
+    for layer_id in range(num_layers):
+        spatial = (input_size // 2 ** stages[layer_id]) ** 2
+
+        for branch_id, op in enumerate(BRANCH_OPS):
+            (branch_params[layer_id, branch_id],
+             branch_flops[layer_id, branch_id],
+             branch_acts[layer_id, branch_id]) = _op_params_flops_acts(
+                op, channels, spatial)
+
+        (skip_params[layer_id], skip_flops[layer_id],
+         skip_acts[layer_id]) = _op_params_flops_acts(skip_op, channels,
+                                                      spatial)
+        params, flops, acts = _op_params_flops_acts(layer_op, channels,
+                                                    spatial)
+        base_params += params
+        base_flops += flops
+        base_acts += acts
+
+        if layer_id in _pool_layers:
+            out_channels = 2 * channels if fixed else channels
+            # one reduction for each previous output
+            n_reductions = layer_id + 1
+            params, flops, acts = _op_params_flops_acts(
+                "reduction", channels, spatial, out_channels)
+            base_params += n_reductions * params
+            base_flops += n_reductions * flops
+            base_acts += n_reductions * acts
+            channels = out_channels
+
+    params, flops, acts = _op_params_flops_acts("classifier", channels, 1,
+                                                num_classes)
+    base_params += params
+    base_flops += flops
+    base_acts += acts
+
+    layer_idxs = np.arange(num_layers)[None]
+    params = branch_params[layer_idxs, branches].sum(1) + \
+        n_skips @ skip_params + base_params
+    flops = branch_flops[layer_idxs, branches].sum(1) + \
+        n_skips @ skip_flops + base_flops
+    acts = branch_acts[layer_idxs, branches].sum(1) + \
+        n_skips @ skip_acts + base_acts
+
+    return {"params": params, "flops": flops, "activations": acts}
@@ -1,7 +1,12 @@
 from delira.models import AbstractPyTorchNetwork
+import math
+import warnings
+import statistics
 import torch
 from .controller import Controller
 from .shared_cnn import SharedCNN
+from .preprocessing import zero_mean_unit_variance
+from .cost import OpCostTable, LatencyTable
 from delira.models.model_utils import scale_loss
 
 
@@ -24,7 +29,16 @@ class ENASModelPyTorch(AbstractPyTorchNetwork):
                  baseline=None,
                  controller_baseline_decay=0.99,
                  controller_entropy_weight=0.0001,
-                 child_grad_bound=5.0
+                 child_grad_bound=5.0,
+                 child_sparse_updates=False,
+                 controller_cost_target=None,
+                 controller_cost_exponent=-0.07,
+                 controller_cost_table=None,
+                 controller_cost_batch_size=1,
+                 controller_reward_min_samples=None,
+                 controller_reward_max_samples=None,
+                 controller_reward_confidence=0.95,
+                 controller_reward_tolerance=0.
                  ):
         super().__init__()
 
@@ -33,8 +47,51 @@ class ENASModelPyTorch(AbstractPyTorchNetwork):
         self.controller_baseline_decay = controller_baseline_decay
         self.controller_entropy_weight = controller_entropy_weight
         self.child_grad_bound = child_grad_bound
+        # only update the parameters used by the sampled architectures
+        # (needs an optimizer accepting them, see ArcAwareSGD)
+        self.child_sparse_updates = child_sparse_updates
+        if child_sparse_updates and not search_whole_channels:
+            # all branches are used by every channel subset architecture
+            warnings.warn("Sparse updates have no effect when searching "
+                          "channel subsets; all parameters are updated in "
+                          "every step")
         self._aggregation_counter = 1
 
+        # multi-objective reward: accuracy * (cost / target) ** exponent
+        self.controller_cost_target = controller_cost_target
+        self.controller_cost_exponent = controller_cost_exponent
+        if isinstance(controller_cost_table, str):
+            # measured latencies (see denas.profiler); the profiler measures
+            # the ops of the searched network at a constant width, so these
+            # costs rank the architectures, but don't predict the latency of
+            # the final network
+            controller_cost_table = LatencyTable.load(
+                controller_cost_table).cost_table(child_num_layers,
+                                                  child_out_filters,
+                                                  controller_cost_batch_size)
+        elif controller_cost_target is not None and \
+                controller_cost_table is None:
+            # FLOPs of the final network (growing filters, concatenated
+            # skips), which is deployed instead of the searched one
+            controller_cost_table = OpCostTable.from_flops(
+                child_num_layers, child_out_filters, fixed=True)
+        self.cost_table = controller_cost_table
+
+        # adaptive reward estimation: the architectures are evaluated on
+        # growing parts of the batch, until the confidence interval of the
+        # accuracy excludes the baseline (disabled if min_samples is None).
+        # max_samples caps the evaluated samples in both cases, i.e. on its
+        # own it evaluates a fixed part of the batch
+        if controller_reward_min_samples is not None and \
+                controller_reward_max_samples is not None and \
+                controller_reward_min_samples > controller_reward_max_samples:
+            raise ValueError("controller_reward_min_samples must not exceed "
+                             "controller_reward_max_samples")
+        self.controller_reward_min_samples = controller_reward_min_samples
+        self.controller_reward_max_samples = controller_reward_max_samples
+        self.controller_reward_confidence = controller_reward_confidence
+        self.controller_reward_tolerance = controller_reward_tolerance
+
         self._build_model(search_for, search_whole_channels, child_num_layers,
                           child_num_branches, child_out_filters,
                           controller_lstm_size, controller_lstm_num_layers,
@@ -62,7 +119,7 @@ class ENASModelPyTorch(AbstractPyTorchNetwork):
 
         self.shared_cnn = SharedCNN(child_num_layers, child_num_branches,
                                     child_out_filters, child_keep_prob,
-                                    child_fixed_arc)
+                                    child_fixed_arc, search_whole_channels)
 
     @property
     def controller_backprop(self):
@@ -77,12 +134,171 @@ class ENASModelPyTorch(AbstractPyTorchNetwork):
     def controller_skip_penalties(self):
         return self.controller.skip_penaltys
 
+    @staticmethod
+    def _cost_factor(model, sample_arc):
+        """
+        Computes the factor to scale the accuracy of an architecture with to
+        penalize its estimated cost (latency or FLOPs); FLOPs are those of
+        the final network built from the architecture (see
+        :meth:`OpCostTable.from_flops`)
+
+        Parameters
+        ----------
+        model : :class:`ENASModelPyTorch`
+            the model holding the cost table and the cost target
+        sample_arc : dict
+            the architecture
+
+        Returns
+        -------
+        float
+            the factor (1 if no cost target is set)
+        float or None
+            the estimated cost (None if no cost target is set)
+
+        """
+        if isinstance(model, torch.nn.DataParallel):
+            model = model.module
+
+        if model.controller_cost_target is None:
+            return 1., None
+
+        cost = model.cost_table.arc_cost(sample_arc)
+        factor = (cost / model.controller_cost_target) ** \
+            model.controller_cost_exponent
+        return factor, cost
+
+    @staticmethod
+    def _reward_predictions(model, inputs, labels, sample_arc, cost_factor):
+        """
+        Predicts (a part of) the controller's batch for the reward: If the
+        adaptive reward estimation is enabled, the architecture is evaluated
+        on chunks of doubling size (starting at the minimum number of
+        samples), until the Wilson confidence interval of its accuracy
+        excludes the accuracy matching the current baseline, is narrower
+        than the tolerance or the maximum number of samples is reached.
+        Otherwise the leading maximum number of samples (the whole batch if
+        not set) are evaluated
+
+        Parameters
+        ----------
+        model : :class:`ENASModelPyTorch`
+            the model
+        inputs : :class:`torch.Tensor`
+            the batch's inputs
+        labels : :class:`torch.Tensor`
+            the batch's labels
+        sample_arc : dict
+            the architecture to evaluate
+        cost_factor : float
+            the architecture's cost factor (see :meth:`_cost_factor`)
+
+        Returns
+        -------
+        dict
+            the predictions of the evaluated samples
+        int
+            the number of evaluated samples (the leading samples of the
+            batch)
+
+        """
+        if isinstance(model, torch.nn.DataParallel):
+            min_samples = model.module.controller_reward_min_samples
+            max_samples = model.module.controller_reward_max_samples
+            confidence = model.module.controller_reward_confidence
+            tolerance = model.module.controller_reward_tolerance
+            baseline = model.module.baseline
+            controller_entropy_weight = model.module.controller_entropy_weight
+            sample_entropy = model.module.controller.sample_entropy
+        else:
+            min_samples = model.controller_reward_min_samples
+            max_samples = model.controller_reward_max_samples
+            confidence = model.controller_reward_confidence
+            tolerance = model.controller_reward_tolerance
+            baseline = model.baseline
+            controller_entropy_weight = model.controller_entropy_weight
+            sample_entropy = model.controller.sample_entropy
+
+        if min_samples is None:
+            if max_samples is not None:
+                inputs = inputs[:max_samples]
+            return model("shared_cnn", inputs, sample_arc), inputs.shape[0]
+
+        num_samples = inputs.shape[0]
+        if max_samples is not None:
+            num_samples = min(num_samples, max_samples)
+
+        # the accuracy, which would give a reward equal to the baseline
+        if baseline is None:
+            threshold = None
+        else:
+            threshold = (float(baseline) - controller_entropy_weight *
+                         float(sample_entropy)) / cost_factor
+
+        z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+
+        preds, n_correct, n_seen = [], 0, 0
+        chunk_end = min(min_samples, num_samples)
+        while True:
+            pred = model("shared_cnn", inputs[n_seen: chunk_end],
+                         sample_arc)["pred"]
+            n_correct += (torch.argmax(pred, 1) ==
+                          labels[n_seen: chunk_end]).sum().item()
+            preds.append(pred)
+            n_seen = chunk_end
+
+            if n_seen >= num_samples:
+                break
+
+            acc = n_correct / n_seen
+            scale = 1 + z ** 2 / n_seen
+            center = (acc + z ** 2 / (2 * n_seen)) / scale
+            half_width = z * math.sqrt(acc * (1 - acc) / n_seen +
+                                       z ** 2 / (4 * n_seen ** 2)) / scale
+
+            if half_width <= tolerance or (
+                    threshold is not None and
+                    abs(center - threshold) > half_width):
+                break
+
+            chunk_end = min(2 * n_seen, num_samples)
+
+        return {"pred": torch.cat(preds)}, n_seen
+
+    @staticmethod
+    def prepare_data(data, input_device):
+        """
+        Converts the input images to a float tensor on the input device
+
+        Parameters
+        ----------
+        data : :class:`numpy.ndarray` or :class:`torch.Tensor`
+            the images
+        input_device : :class:`torch.device` or str
+            the device to compute on
+
+        Returns
+        -------
+        :class:`torch.Tensor`
+            the converted images
+
+        """
+        data = torch.as_tensor(data)
+
+        # raw uint8 images are only converted and normalized on the
+        # computing device to reduce the amount of transferred data
+        if data.dtype == torch.uint8:
+            return zero_mean_unit_variance(
+                data.to(input_device).to(torch.float))
+        return data.to(input_device, torch.float)
+
     @staticmethod
     def prepare_batch(batch: dict, input_device, output_device):
-        batch["data"] = torch.from_numpy(batch["data"]).to(input_device,
-                                                           torch.float)
-        batch["label"] = torch.from_numpy(batch["label"]).to(output_device,
-                                                             torch.long).squeeze(-1)
+        batch["data"] = ENASModelPyTorch.prepare_data(batch["data"],
+                                                      input_device)
+
+        batch["label"] = torch.as_tensor(batch["label"]).to(output_device,
+                                                            torch.long).squeeze(-1)
 
         return batch
 
@@ -99,8 +315,12 @@ class ENASModelPyTorch(AbstractPyTorchNetwork):
 
         if isinstance(model, torch.nn.DataParallel):
             child_grad_bound = model.module.child_grad_bound
+            sparse_updates = model.module.child_sparse_updates
+            shared_cnn = model.module.shared_cnn
         else:
             child_grad_bound = model.child_grad_bound
+            sparse_updates = model.child_sparse_updates
+            shared_cnn = model.shared_cnn
 
         with torch.no_grad():
             sample_arc = model("controller")["pred"]
@@ -112,6 +332,12 @@ class ENASModelPyTorch(AbstractPyTorchNetwork):
         assert (optimizers and losses) or not optimizers, \
             "Criterion dict cannot be emtpy, if optimizers are passed"
 
+        if optimizers and sparse_updates:
+            # the lazy updates of the skipped steps are owed before the
+            # forward pass, as in dense SGD
+            params = shared_cnn.active_parameters(sample_arc)
+            optimizers['shared_cnn'].catch_up(params)
+
         # choose suitable context manager:
         if optimizers:
             context_man = torch.enable_grad
@@ -137,14 +363,23 @@ class ENASModelPyTorch(AbstractPyTorchNetwork):
                             preds["preds"], data_dict["label"]).item()
 
         if optimizers:
-            optimizers['shared_cnn'].zero_grad()
+            if sparse_updates:
+                # zero, clip and step only the parameters used by the arc
+                for param in params:
+                    param.grad = None
+            else:
+                params = model.parameters()
+                optimizers['shared_cnn'].zero_grad()
             # perform loss scaling via apex if half precision is enabled
             with scale_loss(total_loss, optimizers["shared_cnn"]) as scaled_loss:
                 scaled_loss.backward()
 
-            grad_norm = torch.nn.utils.clip_grad_norm(model.parameters(),
+            grad_norm = torch.nn.utils.clip_grad_norm(params,
                                                       child_grad_bound)
-            optimizers['shared_cnn'].step()
+            if sparse_updates:
+                optimizers['shared_cnn'].step(active_params=params)
+            else:
+                optimizers['shared_cnn'].step()
 
         else:
 
@@ -173,17 +408,26 @@ class ENASModelPyTorch(AbstractPyTorchNetwork):
         assert (optimizers and losses) or not optimizers, \
             "Criterion dict cannot be emtpy, if optimizers are passed"
 
+        cost_factor, cost = ENASModelPyTorch._cost_factor(model, sample_arc)
+
         with torch.no_grad():
 
             inputs = data_dict.pop("data")
-            preds = model("shared_cnn", inputs, sample_arc)
+            preds, num_samples = ENASModelPyTorch._reward_predictions(
+                model, inputs, data_dict["label"], sample_arc, cost_factor)
+            labels = data_dict["label"][:num_samples]
 
-            acc = torch.mean((torch.argmax(preds["pred"], 1) == data_dict["label"]
+            acc = torch.mean((torch.argmax(preds["pred"], 1) == labels
                               ).to(torch.float))
 
         reward = acc.detach()
 
         loss_vals["controller_acc"] = acc.item()
+        loss_vals["controller_reward_samples"] = num_samples
+
+        if cost is not None:
+            reward = reward * cost_factor
+            loss_vals["controller_cost"] = cost
 
         if isinstance(model, torch.nn.DataParallel):
             controller_backprop = model.module.controller_backprop
@@ -211,7 +455,7 @@ class ENASModelPyTorch(AbstractPyTorchNetwork):
         reward += controller_entropy_weight * sample_entropy
 
         if baseline is None:
-            baseline = acc
+            baseline = acc * cost_factor
         else:
             baseline -= (1 - controller_baseline_decay) * (baseline - reward)
             baseline = baseline.detach()
@@ -227,7 +471,7 @@ class ENASModelPyTorch(AbstractPyTorchNetwork):
         with torch.no_grad():
             for key, metric_fn in metrics.items():
                 metric_vals["controller_" + key] = metric_fn(
-                    preds["pred"], data_dict["label"]).item()
+                    preds["pred"], labels).item()
 
         with scale_loss(loss,  optimizers["controller"]) as scaled_loss:
             scaled_loss.backward(retain_graph=True)
@@ -257,3 +501,149 @@ class ENASModelPyTorch(AbstractPyTorchNetwork):
             model.baseline = baseline
 
         return metric_vals, loss_vals, preds
+
+    @staticmethod
+    def closure_controller_offpolicy(model, sample_arc: dict, accuracy: float,
+                                     behaviour_log_prob: float,
+                                     optimizers: dict, losses={}, metrics={},
+                                     fold=0, importance_clip=1.0,
+                                     ppo_clip=None, update_baseline=True,
+                                     **kwargs):
+        """
+        Controller update from an architecture, which has been sampled and
+        evaluated elsewhere (e.g. by a reward worker) and might therefore be
+        off-policy. The log-probability of the architecture under the current
+        policy is recomputed and the REINFORCE term is weighted by the
+        truncated importance weight between current and behaviour policy.
+
+        Parameters
+        ----------
+        model : :class:`ENASModelPyTorch`
+            the model to update
+        sample_arc : dict
+            the evaluated architecture
+        accuracy : float
+            the accuracy, the architecture achieved
+        behaviour_log_prob : float
+            the log-probability of ``sample_arc`` under the policy, which
+            sampled it
+        optimizers : dict
+            dictionary containing all optimizers
+        losses : dict
+            dictionary containing all losses (unused)
+        metrics : dict
+            dictionary containing all metrics (unused)
+        fold : int
+            current fold (unused)
+        importance_clip : float or None
+            upper bound for the importance weights; no truncation if None
+        ppo_clip : float or None
+            if given, the PPO-style clipped surrogate objective is used
+            instead of the truncated importance weight: the probability ratio
+            between current and behaviour policy is clipped to
+            ``[1 - ppo_clip, 1 + ppo_clip]`` and the pessimistic term is
+            minimized (e.g. for repeated updates from a replay buffer)
+        update_baseline : bool
+            whether to update the moving average baseline with the reward
+            (should be False, if the architecture's reward has already been
+            used before)
+        **kwargs :
+            additional keyword arguments
+
+        Returns
+        -------
+        dict
+            metric values
+        dict
+            loss values
+        dict
+            the (empty) predictions
+
+        """
+
+        model("controller", arc=sample_arc)
+
+        loss_vals = {}
+        metric_vals = {}
+
+        acc = torch.tensor(accuracy, dtype=torch.float)
+
+        if isinstance(model, torch.nn.DataParallel):
+            controller_backprop = model.module.controller_backprop
+            num_aggregates = model.module.controller_num_aggregates
+            controller_baseline_decay = model.module.controller_baseline_decay
+            baseline = model.module.baseline
+            controller_entropy_weight = model.module.controller_entropy_weight
+            sample_entropy = model.module.controller.sample_entropy
+            sample_log_prob = model.module.controller.sample_log_prob
+            controller_skip_weight = model.module.controller.skip_weight
+            controller_skip_penalties = model.module.controller_skip_penalties
+            child_grad_bound = model.module.child_grad_bound
+        else:
+            controller_backprop = model.controller_backprop
+            num_aggregates = model.controller_num_aggregates
+            baseline = model.baseline
+            controller_baseline_decay = model.controller_baseline_decay
+            controller_entropy_weight = model.controller_entropy_weight
+            sample_entropy = model.controller.sample_entropy
+            sample_log_prob = model.controller.sample_log_prob
+            controller_skip_weight = model.controller.skip_weight
+            controller_skip_penalties = model.controller_skip_penalties
+            child_grad_bound = model.child_grad_bound
+
+        acc = acc.to(sample_log_prob.device)
+
+        cost_factor, cost = ENASModelPyTorch._cost_factor(model, sample_arc)
+        if cost is not None:
+            loss_vals["controller_cost"] = cost
+
+        reward = acc * cost_factor + controller_entropy_weight * sample_entropy
+
+        if baseline is None:
+            baseline = acc * cost_factor
+        elif update_baseline:
+            baseline -= (1 - controller_baseline_decay) * (baseline - reward)
+            baseline = baseline.detach()
+
+        if ppo_clip is None:
+            importance_weight = torch.exp(
+                sample_log_prob - behaviour_log_prob).detach()
+            if importance_clip is not None:
+                importance_weight = torch.clamp(importance_weight,
+                                                max=importance_clip)
+
+            loss = -1 * importance_weight * sample_log_prob * \
+                (reward - baseline)
+        else:
+            ratio = torch.exp(sample_log_prob - behaviour_log_prob)
+            importance_weight = ratio.detach()
+
+            loss = -1 * torch.min(
+                ratio * (reward - baseline),
+                torch.clamp(ratio, 1 - ppo_clip, 1 + ppo_clip) *
+                (reward - baseline))
+
+        if controller_skip_weight is not None:
+            loss += controller_skip_weight * controller_skip_penalties
+
+        loss = loss / num_aggregates
+
+        loss_vals["controller_acc"] = acc.item()
+        loss_vals["controller_loss"] = loss.item()
+        metric_vals["controller_importance_weight"] = importance_weight.item()
+
+        with scale_loss(loss, optimizers["controller"]) as scaled_loss:
+            scaled_loss.backward()
+
+        if controller_backprop:
+            torch.nn.utils.clip_grad_norm_(model.parameters(),
+                                           child_grad_bound)
+            optimizers["controller"].step()
+            optimizers["controller"].zero_grad()
+
+        if isinstance(model, torch.nn.DataParallel):
+            model.module.baseline = baseline
+        else:
+            model.baseline = baseline
+
+        return metric_vals, loss_vals, {}
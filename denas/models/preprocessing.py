@@ -0,0 +1,25 @@
+import torch
+
+
+def zero_mean_unit_variance(data: torch.Tensor, epsilon=1e-7):
+    """
+    Normalizes each channel of each sample to zero mean and unit variance
+    (equivalent to batchgenerators' ``ZeroMeanUnitVarianceTransform`` with
+    ``per_channel=True``), but works on whole batches on any device
+
+    Parameters
+    ----------
+    data : :class:`torch.Tensor`
+        floating point batch of shape N x C x H x W
+    epsilon : float
+        small value to avoid divisions by zero
+
+    Returns
+    -------
+    :class:`torch.Tensor`
+        normalized batch
+
+    """
+    mean = data.mean(dim=(2, 3), keepdim=True)
+    std = data.std(dim=(2, 3), keepdim=True, unbiased=False) + epsilon
+    return (data - mean) / std
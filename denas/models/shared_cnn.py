@@ -1,3 +1,5 @@
+import contextlib
+
 import torch
 import torch.nn.functional as F
 
@@ -7,9 +9,99 @@ Notes
 
 This implementation uses Instancenorm instead of Batchnorm to enable small 
 batchsizes
+
+For progressive searches, the search network can be run at reduced width
+(see :meth:`SharedCNN.set_fidelity`): all modules then use the leading
+channels of their weights, depending on the number of channels of their
+inputs.
 """
 
 
+def _sliced_batch_norm(bn, x, start, count):
+    """
+    Applies a batchnorm layer to a tensor containing only the channels
+    ``start`` to ``start + count`` of the layer's features (the running
+    statistics of these channels are updated in place)
+
+    """
+    if bn.training and bn.track_running_stats:
+        bn.num_batches_tracked += 1
+        if bn.momentum is None:
+            momentum = 1.0 / float(bn.num_batches_tracked)
+        else:
+            momentum = bn.momentum
+    else:
+        momentum = 0.
+
+    running_mean, running_var = bn.running_mean, bn.running_var
+    if running_mean is not None:
+        running_mean = running_mean[start: start + count]
+        running_var = running_var[start: start + count]
+
+    weight, bias = bn.weight, bn.bias
+    if weight is not None:
+        weight = weight[start: start + count]
+        bias = bias[start: start + count]
+
+    return F.batch_norm(x, running_mean, running_var, weight, bias,
+                        bn.training or not bn.track_running_stats, momentum,
+                        bn.eps)
+
+
+def _instance_norm(norm, x):
+    """
+    Applies an instancenorm layer (without affine parameters) to a tensor
+    with possibly fewer channels than the layer's features
+
+    """
+    if x.shape[1] != norm.num_features:
+        return F.instance_norm(x, eps=norm.eps)
+    return norm(x)
+
+
+def _channel_subset_forward(branches, final_conv, final_norm, x, config):
+    """
+    Computes each branch only for its sampled range of output channels and
+    combines them with the matching input slices of the final 1x1 conv
+
+    Parameters
+    ----------
+    branches : list
+        the branches of the layer
+    final_conv : :class:`torch.nn.Conv2d`
+        1x1 conv mapping the concatenated outputs of all branches to the
+        output planes
+    final_norm : :class:`torch.nn.Module`
+        normalization after ``final_conv``
+    x : :class:`torch.Tensor`
+        input tensor
+    config : :class:`torch.Tensor`
+        first channel and number of channels for each branch
+        (``[start_0, count_0, start_1, count_1, ...]``)
+
+    Returns
+    -------
+    :class:`torch.Tensor`
+        result tensor
+
+    """
+    config = [int(val) for val in config.tolist()]
+    out_planes = final_conv.out_channels
+
+    outs, in_channels = [], []
+    for branch_id, branch in enumerate(branches):
+        start, count = config[2 * branch_id], config[2 * branch_id + 1]
+        outs.append(branch(x, start, count))
+
+        offset = branch_id * out_planes + start
+        in_channels.append(torch.arange(offset, offset + count,
+                                        device=x.device))
+
+    weight = final_conv.weight.index_select(1, torch.cat(in_channels))
+    out = F.conv2d(torch.cat(outs, dim=1), weight)
+    return final_norm(out)
+
+
 class FactorizedReduction(torch.nn.Module):
     """
     Reduce both spatial dimensions (width and height) by a factor of 2, and
@@ -73,6 +165,9 @@ class FactorizedReduction(torch.nn.Module):
         """
         if self.stride == 1:
             return self.fr(x)
+        elif x.shape[1] != self.in_planes:
+            # reduced width
+            return _fused_factorized_reduction([self], [x])[0]
         else:
             path1 = self.path1(x)
 
@@ -86,9 +181,59 @@ class FactorizedReduction(torch.nn.Module):
             return out
 
 
+def _fused_factorized_reduction(reductions, inputs):
+    """
+    Applies a :class:`FactorizedReduction` to each input at once: both paths
+    of all reductions are computed by a single grouped 1x1 convolution
+    (built from the reductions' weights) followed by a single normalization
+
+    Parameters
+    ----------
+    reductions : list
+        the reductions (with stride 2 and equal numbers of planes)
+    inputs : list
+        the inputs (one per reduction, all of the same shape)
+
+    Returns
+    -------
+    list
+        the reduced inputs
+
+    """
+    num_inputs = len(inputs)
+    # the inputs may have fewer channels than the reductions (reduced width)
+    in_planes = inputs[0].shape[1]
+    half_planes = reductions[0].out_planes * in_planes // \
+        reductions[0].in_planes // 2
+
+    x = torch.cat(inputs, dim=1)
+    path1 = x[:, :, ::2, ::2]
+    # pad the right and the bottom, then crop to include those pixels
+    path2 = F.pad(x, pad=(0, 1, 0, 1), mode='constant', value=0.)
+    path2 = path2[:, :, 1::2, 1::2]
+
+    weight = torch.cat(
+        [_red.path1[1].weight[:half_planes, :in_planes]
+         for _red in reductions] +
+        [_red.path2[1].weight[:half_planes, :in_planes]
+         for _red in reductions])
+    out = F.conv2d(torch.cat([path1, path2], dim=1), weight,
+                   groups=2 * num_inputs)
+
+    # reorder from (path, input, channel) to (input, path, channel)
+    batch_size, _, height, width = out.shape
+    out = out.view(batch_size, 2, num_inputs, half_planes, height, width)
+    out = out.transpose(1, 2).reshape(batch_size, -1, height, width)
+    out = F.instance_norm(out, eps=reductions[0].bn.eps)
+
+    return list(out.view(batch_size, num_inputs, 2 * half_planes, height,
+                         width).unbind(1))
+
+
 class ENASLayer(torch.nn.Module):
 
-    def __init__(self, layer_id, in_planes, out_planes):
+    def __init__(self, layer_id, in_planes, out_planes,
+                 search_whole_channels=True):
         """
 
         Parameters
@@ -99,6 +244,9 @@ class ENASLayer(torch.nn.Module):
             number of input planes
         out_planes : int
             number of output planes
+        search_whole_channels : bool
+            whether a single branch with all channels is sampled per layer or
+            a range of channels for each branch
 
         """
         super().__init__()
@@ -106,6 +254,7 @@ class ENASLayer(torch.nn.Module):
         self.layer_id = layer_id
         self.in_planes = in_planes
         self.out_planes = out_planes
+        self.search_whole_channels = search_whole_channels
 
         self.branch_0 = ConvBranch(in_planes, out_planes, kernel_size=3)
         self.branch_1 = ConvBranch(in_planes, out_planes, kernel_size=3,
@@ -116,8 +265,18 @@ class ENASLayer(torch.nn.Module):
         self.branch_4 = PoolBranch(in_planes, out_planes, 'avg')
         self.branch_5 = PoolBranch(in_planes, out_planes, 'max')
 
+        if not search_whole_channels:
+            self.final_conv = torch.nn.Conv2d(6 * out_planes, out_planes,
+                                              kernel_size=1, bias=False)
+            self.final_bn = torch.nn.InstanceNorm2d(out_planes)
+
         self.bn = torch.nn.InstanceNorm2d(out_planes)
 
+    @property
+    def branches(self):
+        return [self.branch_0, self.branch_1, self.branch_2, self.branch_3,
+                self.branch_4, self.branch_5]
+
     def forward(self, x, prev_layers, sample_arc):
         layer_type = sample_arc[0]
         if self.layer_id > 0:
@@ -125,7 +284,10 @@ class ENASLayer(torch.nn.Module):
         else:
             skip_indices = []
 
-        if layer_type == 0:
+        if not self.search_whole_channels:
+            out = _channel_subset_forward(self.branches, self.final_conv,
+                                          self.final_bn, x, layer_type)
+        elif layer_type == 0:
             out = self.branch_0(x)
         elif layer_type == 1:
             out = self.branch_1(x)
@@ -142,9 +304,9 @@ class ENASLayer(torch.nn.Module):
 
         for i, skip in enumerate(skip_indices):
             if skip == 1:
-                out += prev_layers[i]
+                out = out + prev_layers[i]
 
-        out = self.bn(out)
+        out = _instance_norm(self.bn, out)
         return out
 
 
@@ -177,7 +339,23 @@ class FixedLayer(torch.nn.Module):
         else:
             self.skip_indices = torch.zeros(1)
 
-        if self.layer_type == 0:
+        # a range of channels has been sampled for each branch
+        self.channel_subsets = self.layer_type.numel() > 1
+
+        if self.channel_subsets:
+            self.branches = torch.nn.ModuleList([
+                ConvBranch(in_planes, out_planes, kernel_size=3),
+                ConvBranch(in_planes, out_planes, kernel_size=3,
+                           separable=True),
+                ConvBranch(in_planes, out_planes, kernel_size=5),
+                ConvBranch(in_planes, out_planes, kernel_size=5,
+                           separable=True),
+                PoolBranch(in_planes, out_planes, 'avg'),
+                PoolBranch(in_planes, out_planes, 'max')])
+            self.final_conv = torch.nn.Conv2d(6 * out_planes, out_planes,
+                                              kernel_size=1, bias=False)
+            self.final_bn = torch.nn.InstanceNorm2d(out_planes)
+        elif self.layer_type == 0:
             self.branch = ConvBranch(in_planes, out_planes, kernel_size=3)
         elif self.layer_type == 1:
             self.branch = ConvBranch(in_planes, out_planes, kernel_size=3,
@@ -203,7 +381,11 @@ class FixedLayer(torch.nn.Module):
             torch.nn.InstanceNorm2d(out_planes))
 
     def forward(self, x, prev_layers, sample_arc):
-        out = self.branch(x)
+        if self.channel_subsets:
+            out = _channel_subset_forward(self.branches, self.final_conv,
+                                          self.final_bn, x, self.layer_type)
+        else:
+            out = self.branch(x)
 
         res_layers = []
         for i, skip in enumerate(self.skip_indices):
@@ -276,10 +458,52 @@ class ConvBranch(torch.nn.Module):
                 torch.nn.BatchNorm2d(out_planes),
                 torch.nn.ReLU())
 
-    def forward(self, x):
-        out = self.inp_conv1(x)
-        out = self.out_conv(out)
-        return out
+    def forward(self, x, start=None, count=None):
+        """
+        Feed tensor through branch
+
+        Parameters
+        ----------
+        x : :class:`torch.Tensor`
+            input tensor (with fewer than ``in_planes`` channels at reduced
+            width)
+        start : int or None
+            first output channel to compute; all channels if None
+        count : int or None
+            number of output channels to compute
+
+        Returns
+        -------
+        :class:`torch.Tensor`
+            result tensor
+
+        """
+        in_planes = x.shape[1]
+        if in_planes == self.in_planes:
+            out = self.inp_conv1(x)
+
+            if start is None:
+                return self.out_conv(out)
+        else:
+            conv, bn, relu = self.inp_conv1
+            out = F.conv2d(x, conv.weight[:in_planes, :in_planes])
+            out = relu(_sliced_batch_norm(bn, out, 0, in_planes))
+
+            if start is None:
+                start, count = 0, in_planes
+
+        conv, bn, relu = self.out_conv
+        if self.separable:
+            out = F.conv2d(out, conv.depthwise.weight[:in_planes],
+                           padding=conv.depthwise.padding, groups=in_planes)
+            out = F.conv2d(out, conv.pointwise.weight[start: start + count,
+                                                      :in_planes])
+        else:
+            out = F.conv2d(out, conv.weight[start: start + count, :in_planes],
+                           padding=conv.padding)
+
+        out = _sliced_batch_norm(bn, out, start, count)
+        return relu(out)
 
 
 class PoolBranch(torch.nn.Module):
@@ -316,8 +540,38 @@ class PoolBranch(torch.nn.Module):
         else:
             raise ValueError("Unknown pool {}".format(avg_or_max))
 
-    def forward(self, x):
-        out = self.conv1(x)
+    def forward(self, x, start=None, count=None):
+        """
+        Feed tensor through branch
+
+        Parameters
+        ----------
+        x : :class:`torch.Tensor`
+            input tensor (with fewer than ``in_planes`` channels at reduced
+            width)
+        start : int or None
+            first output channel to compute; all channels if None
+        count : int or None
+            number of output channels to compute
+
+        Returns
+        -------
+        :class:`torch.Tensor`
+            result tensor
+
+        """
+        in_planes = x.shape[1]
+        if start is None and in_planes == self.in_planes:
+            out = self.conv1(x)
+        else:
+            if start is None:
+                start, count = 0, in_planes
+            # the pooling acts channel-wise, so the channels can be selected
+            # before computing anything
+            conv, norm, relu = self.conv1
+            out = F.conv2d(x, conv.weight[start: start + count, :in_planes])
+            out = relu(F.instance_norm(out, eps=norm.eps))
+
         out = self.pool(out)
         return out
 
@@ -328,7 +582,9 @@ class SharedCNN(torch.nn.Module):
                  num_branches=6,
                  out_filters=24,
                  keep_prob=1.0,
-                 fixed_arc=None
+                 fixed_arc=None,
+                 search_whole_channels=True,
+                 fuse_reductions=True
                  ):
         super(SharedCNN, self).__init__()
 
@@ -337,6 +593,14 @@ class SharedCNN(torch.nn.Module):
         self.out_filters = out_filters
         self.keep_prob = keep_prob
         self.fixed_arc = fixed_arc
+        self.search_whole_channels = search_whole_channels
+        # compute the reductions of all previous layers as one grouped conv
+        self.fuse_reductions = fuse_reductions
+        # input resolution and number of channels (full fidelity if None)
+        self.resolution = None
+        self.width = None
+        # opt-in op instrumentation (see denas.instrumentation)
+        self.instrumentation = None
 
         pool_distance = self.num_layers // 3
         self.pool_layers = [pool_distance - 1, 2 * pool_distance - 1]
@@ -350,7 +614,8 @@ class SharedCNN(torch.nn.Module):
 
         for layer_id in range(self.num_layers):
             if self.fixed_arc is None:
-                layer = ENASLayer(layer_id, self.out_filters, self.out_filters)
+                layer = ENASLayer(layer_id, self.out_filters, self.out_filters,
+                                  self.search_whole_channels)
             else:
                 layer = FixedLayer(layer_id, self.out_filters, self.out_filters,
                                    self.fixed_arc[str(layer_id)])
@@ -376,9 +641,139 @@ class SharedCNN(torch.nn.Module):
                 torch.nn.init.kaiming_uniform_(m.weight, mode='fan_in',
                                                nonlinearity='relu')
 
+    def set_fidelity(self, resolution=None, width=None):
+        """
+        Sets the fidelity of the search network: the inputs are downsampled
+        to ``resolution`` and all layers only use their leading ``width``
+        channels. The weights remain shared with the full network.
+
+        Parameters
+        ----------
+        resolution : int or None
+            spatial size to downsample the inputs to; full size if None
+        width : int or None
+            number of channels of all layers; ``out_filters`` if None
+
+        """
+        if width is not None:
+            if self.fixed_arc is not None or not self.search_whole_channels:
+                raise ValueError("Reduced width is only supported for "
+                                 "searching whole channels")
+            if width % 2 or not 0 < width <= self.out_filters:
+                raise ValueError("Width must be even and at most %d"
+                                 % self.out_filters)
+            if width == self.out_filters:
+                width = None
+
+        self.resolution = resolution
+        self.width = width
+
+    def active_parameters(self, sample_arc):
+        """
+        Parameters used by the given architecture (all parameters except the
+        ones of unselected branches)
+
+        When searching channel subsets, each branch computes at least one
+        channel of every layer, so all parameters are used (the parameters
+        aren't sliced by channel).
+
+        Parameters
+        ----------
+        sample_arc : dict
+            the architecture
+
+        Returns
+        -------
+        list
+            the used parameters
+
+        """
+        if self.fixed_arc is not None:
+            return list(self.parameters())
+
+        unused = set()
+        for layer_id, layer in enumerate(self.layers):
+            config = sample_arc[str(layer_id)][0].view(-1).tolist()
+            if self.search_whole_channels:
+                used_branches = {config[0]}
+            else:
+                used_branches = {branch_id
+                                 for branch_id, count in enumerate(config[1::2])
+                                 if count > 0}
+
+            for branch_id, branch in enumerate(layer.branches):
+                if branch_id not in used_branches:
+                    unused.update(id(_param) for _param in branch.parameters())
+
+        return [_param for _param in self.parameters()
+                if id(_param) not in unused]
+
+    @contextlib.contextmanager
+    def recalibrated_batch_norm(self, sample_arc, batches):
+        """
+        Context manager re-estimating the running statistics of all
+        batchnorm layers for a single architecture (the statistics of the
+        shared network mix all architectures trained so far). The network is
+        in eval mode within the context; the shared statistics and the
+        previous mode are restored afterwards.
+
+        Parameters
+        ----------
+        sample_arc : dict
+            the architecture
+        batches : list
+            input tensors to estimate the statistics on
+
+        Yields
+        ------
+        :class:`SharedCNN`
+            the network with recalibrated statistics
+
+        """
+        norms = [_module for _module in self.modules()
+                 if isinstance(_module, torch.nn.modules.batchnorm._BatchNorm)
+                 and _module.track_running_stats]
+        saved = [(_norm.momentum, _norm.running_mean.clone(),
+                  _norm.running_var.clone(),
+                  _norm.num_batches_tracked.clone()) for _norm in norms]
+        was_training = self.training
+
+        try:
+            self.eval()
+            for _norm in norms:
+                _norm.reset_running_stats()
+                # cumulative average over all calibration batches
+                _norm.momentum = None
+                _norm.train()
+
+            with torch.no_grad():
+                for x in batches:
+                    self(x, sample_arc)
+
+            for _norm in norms:
+                _norm.eval()
+
+            yield self
+
+        finally:
+            for _norm, (momentum, mean, var, num_batches) in zip(norms, saved):
+                _norm.momentum = momentum
+                _norm.running_mean.copy_(mean)
+                _norm.running_var.copy_(var)
+                _norm.num_batches_tracked.copy_(num_batches)
+            self.train(was_training)
+
     def forward(self, x, sample_arc):
 
-        x = self.stem_conv(x)
+        if self.resolution is not None and x.shape[-1] != self.resolution:
+            x = F.adaptive_avg_pool2d(x, self.resolution)
+
+        if self.width is None:
+            x = self.stem_conv(x)
+        else:
+            conv, norm = self.stem_conv
+            x = F.conv2d(x, conv.weight[:self.width], padding=conv.padding)
+            x = F.instance_norm(x, eps=norm.eps)
 
         prev_layers = []
         pool_count = 0
@@ -387,16 +782,34 @@ class SharedCNN(torch.nn.Module):
                                       sample_arc[str(layer_id)])
             prev_layers.append(x)
             if layer_id in self.pool_layers:
-                for i, prev_layer in enumerate(prev_layers):
-                    # Go through the outputs of all previous layers
-                    # and downsample them
-                    prev_layers[i] = self.pooled_layers[pool_count](prev_layer)
-                    pool_count += 1
+                if self.fuse_reductions:
+                    instrumentation = self.instrumentation
+                    if instrumentation is not None:
+                        instrumentation.begin("fused_reduction", layer_id,
+                                              prev_layers)
+                    prev_layers = _fused_factorized_reduction(
+                        self.pooled_layers[
+                            pool_count: pool_count + len(prev_layers)],
+                        prev_layers)
+                    if instrumentation is not None:
+                        instrumentation.end(prev_layers)
+                    pool_count += len(prev_layers)
+                else:
+                    for i, prev_layer in enumerate(prev_layers):
+                        # Go through the outputs of all previous layers
+                        # and downsample them
+                        prev_layers[i] = self.pooled_layers[pool_count](
+                            prev_layer)
+                        pool_count += 1
                 x = prev_layers[-1]
 
         x = self.global_avg_pool(x)
         x = x.view(x.shape[0], -1)
         x = self.dropout(x)
-        out = self.classify(x)
+        if self.width is None:
+            out = self.classify(x)
+        else:
+            out = F.linear(x, self.classify.weight[:, :self.width],
+                           self.classify.bias)
 
         return {"pred": out}
@@ -0,0 +1,245 @@
+import torch
+
+"""
+Notes
+-----
+
+During the search, each step of the shared network only uses the branches
+selected by the sampled architecture; all other branches receive zero
+gradients. For those parameters SGD (with weight decay ``wd``, momentum
+``mu``, no dampening) degenerates to a linear map of parameter ``p`` and
+momentum buffer ``b``:
+
+    b' = mu * b + wd * p
+    p' = p - lr * b'                              (classic momentum)
+    p' = p - lr * (wd * p + mu * b')              (nesterov momentum)
+
+:class:`ArcAwareSGD` therefore only updates the parameters used in a step and
+records the learning rate of each step. Before a parameter is used again, the
+updates of the skipped steps are applied at once as product of the
+corresponding 2x2 matrices, which gives the same result as updating all
+parameters in every step. The pending updates have to be applied before the
+forward pass (see :meth:`ArcAwareSGD.catch_up`), since dense SGD would have
+applied them before computing the loss and gradients of the next step.
+"""
+
+
+class ArcAwareSGD(torch.optim.SGD):
+    """
+    SGD, which only updates the parameters used by the current architecture
+    and lazily applies weight decay and momentum to the other parameters
+
+    Parameters
+    ----------
+    params : iterable
+        the parameters to optimize
+    lr : float
+        learning rate
+    momentum : float
+        momentum factor
+    dampening : float
+        dampening for momentum (only 0 is supported)
+    weight_decay : float
+        weight decay (L2 penalty)
+    nesterov : bool
+        whether to use nesterov momentum
+
+    """
+
+    def __init__(self, params, lr, momentum=0, dampening=0, weight_decay=0,
+                 nesterov=False):
+        if dampening != 0:
+            raise ValueError("ArcAwareSGD does not support dampening")
+
+        super().__init__(params, lr=lr, momentum=momentum, dampening=0,
+                         weight_decay=weight_decay, nesterov=nesterov)
+
+        self._num_steps = 0
+        # learning rates of each group since step ``_history_start``
+        self._history_start = 0
+        self._lr_history = [[] for _ in self.param_groups]
+
+    def _transition(self, group, lr):
+        """
+        Matrix mapping (parameter, momentum) of an unused parameter to their
+        values after a single step
+
+        """
+        momentum, weight_decay = group["momentum"], group["weight_decay"]
+        if group["nesterov"]:
+            return ((1. - lr * weight_decay * (1. + momentum),
+                     -lr * momentum * momentum),
+                    (weight_decay, momentum))
+        return ((1. - lr * weight_decay, -lr * momentum),
+                (weight_decay, momentum))
+
+    def _catch_up_matrix(self, group_idx, start, cache):
+        """
+        Product of the transitions of all steps since ``start``
+
+        """
+        if start in cache:
+            return cache[start]
+
+        group = self.param_groups[group_idx]
+        matrix = ((1., 0.), (0., 1.))
+        for lr in self._lr_history[group_idx][start - self._history_start:]:
+            (a, b), (c, d) = self._transition(group, lr)
+            (e, f), (g, h) = matrix
+            matrix = ((a * e + b * g, a * f + b * h),
+                      (c * e + d * g, c * f + d * h))
+
+        cache[start] = matrix
+        return matrix
+
+    @torch.no_grad()
+    def _catch_up(self, param, group_idx, cache):
+        state = self.state[param]
+        start = state.get("last_step", self._history_start)
+        if start >= self._num_steps:
+            return
+
+        group = self.param_groups[group_idx]
+        (a, b), (c, d) = self._catch_up_matrix(group_idx, start, cache)
+
+        if group["momentum"] != 0:
+            buf = state.get("momentum_buffer", None)
+            if buf is None:
+                buf = torch.zeros_like(param)
+                state["momentum_buffer"] = buf
+            new_param = param * a + buf * b
+            buf.mul_(d).add_(param, alpha=c)
+            param.copy_(new_param)
+        else:
+            param.mul_(a)
+
+        state["last_step"] = self._num_steps
+
+    @torch.no_grad()
+    def catch_up(self, params=None):
+        """
+        Applies the pending lazy updates of the given parameters (must be
+        called before the parameters are used in the forward pass of a step)
+
+        Parameters
+        ----------
+        params : iterable or None
+            the parameters to update; all parameters if None
+
+        """
+        if params is None:
+            param_ids = None
+        else:
+            param_ids = {id(_param) for _param in params}
+
+        for group_idx, group in enumerate(self.param_groups):
+            cache = {}
+            for param in group["params"]:
+                if param_ids is None or id(param) in param_ids:
+                    self._catch_up(param, group_idx, cache)
+
+    @torch.no_grad()
+    def step(self, closure=None, *, active_params=None):
+        """
+        Performs a single optimization step
+
+        Parameters
+        ----------
+        closure : callable or None
+            a closure reevaluating the model and returning the loss
+        active_params : iterable or None
+            the parameters used in this step; all other parameters are
+            updated lazily. If None, all parameters are updated. The active
+            parameters have to be caught up (see :meth:`catch_up`) before
+            the loss is computed; this is done here if a closure is given
+
+        Returns
+        -------
+        :class:`torch.Tensor` or None
+            the loss returned by the closure
+
+        """
+        if active_params is not None:
+            active_params = list(active_params)
+
+        loss = None
+        if closure is not None:
+            self.catch_up(active_params)
+            with torch.enable_grad():
+                loss = closure()
+
+        if active_params is None:
+            active_ids = None
+        else:
+            active_ids = {id(_param) for _param in active_params}
+
+        for group_idx, group in enumerate(self.param_groups):
+            cache = {}
+            momentum = group["momentum"]
+            weight_decay = group["weight_decay"]
+
+            for param in group["params"]:
+                if active_ids is not None and id(param) not in active_ids:
+                    continue
+
+                self._catch_up(param, group_idx, cache)
+
+                if param.grad is None:
+                    d_p = torch.zeros_like(param)
+                else:
+                    d_p = param.grad
+                if weight_decay != 0:
+                    d_p = d_p.add(param, alpha=weight_decay)
+
+                if momentum != 0:
+                    state = self.state[param]
+                    buf = state.get("momentum_buffer", None)
+                    if buf is None:
+                        buf = torch.clone(d_p).detach()
+                        state["momentum_buffer"] = buf
+                    else:
+                        buf.mul_(momentum).add_(d_p)
+
+                    if group["nesterov"]:
+                        d_p = d_p.add(buf, alpha=momentum)
+                    else:
+                        d_p = buf
+
+                param.add_(d_p, alpha=-group["lr"])
+                self.state[param]["last_step"] = self._num_steps + 1
+
+            self._lr_history[group_idx].append(group["lr"])
+
+        self._num_steps += 1
+        return loss
+
+    @torch.no_grad()
+    def flush(self):
+        """
+        Applies all pending lazy updates, so that all parameters are up to
+        date (must be called before using the parameters for evaluation)
+
+        """
+        for group_idx, group in enumerate(self.param_groups):
+            cache = {}
+            for param in group["params"]:
+                self._catch_up(param, group_idx, cache)
+            self._lr_history[group_idx] = []
+        self._history_start = self._num_steps
+
+    def state_dict(self):
+        # pending updates are applied first to save the exact state
+        self.flush()
+        state_dict = super().state_dict()
+        state_dict["state"] = {
+            key: {_key: _val for _key, _val in param_state.items()
+                  if _key != "last_step"}
+            for key, param_state in state_dict["state"].items()}
+        return state_dict
+
+    def load_state_dict(self, state_dict):
+        super().load_state_dict(state_dict)
+        for param_state in self.state.values():
+            param_state["last_step"] = self._num_steps
+        self._history_start = self._num_steps
+        self._lr_history = [[] for _ in self.param_groups]
@@ -1,5 +1,7 @@
 from delira.training import Predictor
 from delira.training.train_utils import convert_torch_tensor_to_npy
+import torch
+from .models.enas import ENASModelPyTorch
 
 
 class ENASPredictor(Predictor):
@@ -28,3 +30,37 @@ class ENASPredictor(Predictor):
         return self._convert_batch_to_npy_fn(
             **pred
         )[1]
+
+    def predict_data(self, data):
+        """
+        Predicts a batch of inputs, which (unlike the batches for
+        :meth:`predict`) doesn't need to contain labels, e.g. for serving
+
+        Parameters
+        ----------
+        data : dict
+            the batch; ``data`` is converted like in
+            :meth:`ENASModelPyTorch.prepare_batch`, all other inputs (e.g. a
+            ``sample_arc``) are passed as they are
+
+        Returns
+        -------
+        dict
+            the predictions as numpy arrays
+
+        """
+        device = next(self.module.parameters()).device
+        data = {**data,
+                "data": ENASModelPyTorch.prepare_data(data["data"], device)}
+
+        mapped_data = {
+            k: data[v] for k, v in self.key_mapping.items()}
+
+        with torch.no_grad():
+            pred = self.module(
+                self.pred_mode, **mapped_data
+            )
+
+        return self._convert_batch_to_npy_fn(
+            **pred
+        )[1]
@@ -0,0 +1,246 @@
+import argparse
+import platform
+import time
+
+import numpy as np
+import torch
+
+from .models.cost import BRANCH_OPS, LatencyTable, pool_layers
+from .models.shared_cnn import ConvBranch, PoolBranch, FactorizedReduction, \
+    _fused_factorized_reduction
+
+"""
+Notes
+-----
+
+Measures the latency of every operation of the macro search space on the
+local machine and stores the results as :class:`LatencyTable`. The ops are
+measured in isolation (eval mode, no gradients) at all three resolutions
+used by :class:`SharedCNN`.
+
+The factorized reductions only run at the two pool layers (stages 0 and 1).
+By default :class:`SharedCNN` reduces all previous outputs of a pool layer at
+once (``fuse_reductions``); the fused reduction of a network with
+``num_layers`` layers is therefore measured and stored per reduced output, so
+that the cost model (one ``reduction`` per previous output) sums up to the
+measured latency.
+
+Usage::
+
+    python -m denas.profiler --filters 24 36 --batch_sizes 1 32 \
+        --output latency_table.npz
+"""
+
+
+def _build_op(op, channels, num_classes=10):
+    """
+    Creates the module (or function) computing a single op
+
+    """
+    if op == "conv3x3":
+        return ConvBranch(channels, channels, kernel_size=3)
+    elif op == "sep_conv3x3":
+        return ConvBranch(channels, channels, kernel_size=3, separable=True)
+    elif op == "conv5x5":
+        return ConvBranch(channels, channels, kernel_size=5)
+    elif op == "sep_conv5x5":
+        return ConvBranch(channels, channels, kernel_size=5, separable=True)
+    elif op == "avg_pool":
+        return PoolBranch(channels, channels, 'avg')
+    elif op == "max_pool":
+        return PoolBranch(channels, channels, 'max')
+    elif op == "reduction":
+        return FactorizedReduction(channels, channels)
+    elif op == "layer_norm":
+        return torch.nn.InstanceNorm2d(channels)
+    elif op == "stem":
+        return torch.nn.Sequential(
+            torch.nn.Conv2d(3, channels, kernel_size=3, padding=1,
+                            bias=False),
+            torch.nn.InstanceNorm2d(channels))
+    elif op == "classifier":
+        return torch.nn.Sequential(torch.nn.AdaptiveAvgPool2d((1, 1)),
+                                   torch.nn.Flatten(),
+                                   torch.nn.Linear(channels, num_classes))
+    else:
+        raise ValueError("Unknown op {}".format(op))
+
+
+def measure_latency(fn, inputs, device, num_warmup=5, num_repeats=20):
+    """
+    Measures the median latency of a function
+
+    Parameters
+    ----------
+    fn : callable
+        the function to measure
+    inputs : tuple
+        positional arguments of ``fn``
+    device : :class:`torch.device`
+        the device, the function runs on
+    num_warmup : int
+        number of calls before measuring
+    num_repeats : int
+        number of measured calls
+
+    Returns
+    -------
+    float
+        median latency in microseconds
+
+    """
+    def _sync():
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+
+    with torch.no_grad():
+        for _ in range(num_warmup):
+            fn(*inputs)
+        _sync()
+
+        timings = []
+        for _ in range(num_repeats):
+            start = time.perf_counter()
+            fn(*inputs)
+            _sync()
+            timings.append(time.perf_counter() - start)
+
+    return float(np.median(timings) * 1e6)
+
+
+def _reduction_latency(channels, x, num_inputs, fuse_reductions, device,
+                       num_warmup, num_repeats):
+    """
+    Measures the latency of the reductions at a pool layer per reduced input
+
+    """
+    if not fuse_reductions:
+        module = _build_op("reduction", channels).to(device).eval()
+        return measure_latency(module, (x,), device, num_warmup, num_repeats)
+
+    reductions = [_build_op("reduction", channels).to(device).eval()
+                  for _ in range(num_inputs)]
+
+    def _fused(*inputs):
+        return _fused_factorized_reduction(reductions, list(inputs))
+
+    return measure_latency(_fused, (x,) * num_inputs, device, num_warmup,
+                           num_repeats) / num_inputs
+
+
+def profile_ops(filters=(36,), batch_sizes=(1,), input_size=32,
+                device="cpu", num_warmup=5, num_repeats=20, verbose=False,
+                num_layers=12, fuse_reductions=True):
+    """
+    Measures all ops of the macro search space at all resolutions
+
+    Parameters
+    ----------
+    filters : tuple
+        filter counts to profile
+    batch_sizes : tuple
+        batch sizes to profile
+    input_size : int
+        spatial size of the network's input
+    device : str
+        device to profile on
+    num_warmup : int
+        number of unmeasured calls per op
+    num_repeats : int
+        number of measured calls per op
+    verbose : bool
+        whether to print each measurement
+    num_layers : int
+        number of layers of the network, whose pool layers determine the
+        number of fused reductions
+    fuse_reductions : bool
+        whether to measure the fused reductions (as used by default by
+        :class:`SharedCNN`) or a single :class:`FactorizedReduction`
+
+    Returns
+    -------
+    :class:`LatencyTable`
+        the measured latencies
+
+    """
+    device = torch.device(device)
+    pools = pool_layers(num_layers)
+    ops, stages, _filters, _batch_sizes, latencies = [], [], [], [], []
+
+    def _add(op, stage, channels, batch_size, latency):
+        ops.append(op)
+        stages.append(stage)
+        _filters.append(channels)
+        _batch_sizes.append(batch_size)
+        latencies.append(latency)
+        if verbose:
+            print("%-12s stage %d filters %3d batch %3d: %10.1f us" % (
+                op, stage, channels, batch_size, latency))
+
+    for channels in filters:
+        for batch_size in batch_sizes:
+            for stage in range(3):
+                size = input_size // 2 ** stage
+                x = torch.randn(batch_size, channels, size, size,
+                                device=device)
+
+                for op in BRANCH_OPS + ("layer_norm", "classifier"):
+                    module = _build_op(op, channels).to(device).eval()
+                    _add(op, stage, channels, batch_size, measure_latency(
+                        module, (x,), device, num_warmup, num_repeats))
+
+                if stage < len(pools):
+                    _add("reduction", stage, channels, batch_size,
+                         _reduction_latency(
+                             channels, x, pools[stage] + 1, fuse_reductions,
+                             device, num_warmup, num_repeats))
+
+                _add("skip_add", stage, channels, batch_size,
+                     measure_latency(torch.add, (x, x), device, num_warmup,
+                                     num_repeats))
+
+            stem = _build_op("stem", channels).to(device).eval()
+            x = torch.randn(batch_size, 3, input_size, input_size,
+                            device=device)
+            _add("stem", 0, channels, batch_size, measure_latency(
+                stem, (x,), device, num_warmup, num_repeats))
+
+    metadata = {"torch_version": torch.__version__,
+                "device": str(device),
+                "device_name": (torch.cuda.get_device_name(device)
+                                if device.type == "cuda"
+                                else platform.processor()),
+                "platform": platform.platform(),
+                "num_threads": torch.get_num_threads(),
+                "input_size": input_size,
+                "num_layers": num_layers,
+                "fuse_reductions": fuse_reductions,
+                "num_repeats": num_repeats,
+                "created": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+    return LatencyTable(ops, stages, _filters, _batch_sizes, latencies,
+                        metadata)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Profile the ops of the ENAS macro search space")
+    parser.add_argument("--filters", type=int, nargs="+", default=[36])
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1])
+    parser.add_argument("--input_size", type=int, default=32)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--num_repeats", type=int, default=20)
+    parser.add_argument("--num_layers", type=int, default=12)
+    parser.add_argument("--unfused_reductions", action="store_true")
+    parser.add_argument("--output", type=str, default="latency_table.npz")
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    table = profile_ops(args.filters, args.batch_sizes, args.input_size,
+                        args.device, num_repeats=args.num_repeats,
+                        verbose=True, num_layers=args.num_layers,
+                        fuse_reductions=not args.unfused_reductions)
+    table.save(args.output)
@@ -0,0 +1,121 @@
+import collections
+
+import numpy as np
+
+"""
+Notes
+-----
+
+Replay of evaluated architectures: Evaluating an architecture on the shared
+network dominates the cost of a controller step, but its reward only drives
+a single REINFORCE update. :class:`ArcReplayBuffer` keeps the evaluated
+architectures together with their accuracy and their log-probability under
+the policy, which sampled them. After each new evaluation the controller
+takes several additional updates on architectures drawn from the buffer,
+which are corrected by the ratio between current and behaviour policy and
+clipped as in PPO (see :meth:`ENASModelPyTorch.closure_controller_offpolicy`).
+
+The accuracies are only valid for the shared weights they were measured
+with. Each entry therefore carries the number of shared network updates at
+its evaluation and is discarded once the shared network has been updated
+more than ``max_staleness`` times since then.
+"""
+
+ReplayEntry = collections.namedtuple(
+    "ReplayEntry", ["sample_arc", "accuracy", "behaviour_log_prob",
+                    "version"])
+
+
+class ArcReplayBuffer(object):
+    """
+    Bounded buffer of evaluated architectures for off-policy controller
+    updates
+
+    Parameters
+    ----------
+    capacity : int
+        maximum number of architectures to keep (the oldest are dropped)
+    num_replays : int
+        number of additional controller updates from the buffer per newly
+        evaluated architecture
+    max_staleness : int
+        maximum number of shared network updates since an architecture's
+        evaluation to still replay it; since the shared network is updated
+        in whole phases, 0 only replays architectures of the current
+        controller phase
+    clip : float
+        clipping range of the probability ratio (see ``ppo_clip`` of
+        :meth:`ENASModelPyTorch.closure_controller_offpolicy`)
+    seed : int or None
+        random seed for drawing the architectures
+
+    """
+
+    def __init__(self, capacity=100, num_replays=4, max_staleness=0,
+                 clip=0.2, seed=None):
+        self.capacity = capacity
+        self.num_replays = num_replays
+        self.max_staleness = max_staleness
+        self.clip = clip
+
+        self._entries = collections.deque(maxlen=capacity)
+        self._rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, sample_arc, accuracy, behaviour_log_prob, version):
+        """
+        Adds an evaluated architecture
+
+        Parameters
+        ----------
+        sample_arc : dict
+            the architecture
+        accuracy : float
+            the accuracy, the architecture achieved
+        behaviour_log_prob : float
+            the log-probability of the architecture under the sampling policy
+        version : int
+            number of shared network updates at the evaluation
+
+        """
+        self._entries.append(ReplayEntry(sample_arc, float(accuracy),
+                                         float(behaviour_log_prob), version))
+
+    def prune(self, version):
+        """
+        Discards all stale architectures
+
+        Parameters
+        ----------
+        version : int
+            current number of shared network updates
+
+        """
+        while self._entries and \
+                version - self._entries[0].version > self.max_staleness:
+            self._entries.popleft()
+
+    def sample(self, version):
+        """
+        Draws architectures to replay (uniformly, with replacement)
+
+        Parameters
+        ----------
+        version : int
+            current number of shared network updates
+
+        Returns
+        -------
+        list
+            ``num_replays`` :class:`ReplayEntry` (empty if there are no
+            fresh architectures)
+
+        """
+        self.prune(version)
+        if not self._entries:
+            return []
+
+        return [self._entries[_idx] for _idx in self._rng.randint(
+            len(self._entries), size=self.num_replays)]
@@ -0,0 +1,374 @@
+import time
+
+import numpy as np
+import torch
+
+"""
+Notes
+-----
+
+Adapts the alternating search schedule to the state of the controller: after
+each epoch the controller's policy is probed (entropy and per-layer branch
+distribution of a number of sampled architectures) and the validation score
+is recorded. Once the policy has converged (small change of the branch
+distributions, optionally low entropy) and the validation score plateaus, the
+controller phases are shrunk (down to ``min_fraction`` of their steps, 0
+skips them). The search is stopped, once the selected best architecture has
+not changed for ``patience`` epochs.
+
+:class:`SearchBudget` limits a search by wall-clock time or FLOPs instead of a
+fixed number of epochs: the number of remaining epochs is re-estimated after
+each epoch from the measured costs of the last one.
+
+:class:`FidelitySchedule` starts the search at reduced input resolution
+and/or width of the shared network and grows it to full fidelity.
+"""
+
+
+def _arc_key(sample_arc):
+    return tuple(tuple(_val.view(-1).tolist()) for _key in sorted(
+        sample_arc.keys(), key=int) for _val in sample_arc[_key])
+
+
+class PhaseScheduler(object):
+    """
+    Decides on the length of the controller phases and on stopping the search
+
+    Parameters
+    ----------
+    distribution_tol : float
+        maximum mean (over layers) total variation distance between the
+        branch distributions of two consecutive epochs to consider the
+        policy converged
+    entropy_threshold : float or None
+        maximum mean entropy of the sampled architectures to consider the
+        policy converged; ignored if None
+    reward_tol : float
+        maximum absolute slope (per epoch) of the validation score to
+        consider it plateaued
+    window : int
+        number of epochs to estimate the validation score's slope on
+    shrink_factor : float
+        factor to shrink the controller phase with after each converged epoch
+    min_fraction : float
+        minimum fraction of the controller steps (0 skips the phases); the
+        fraction snaps to it once less than a single step would be left
+    patience : int or None
+        number of epochs without change of the best architecture to stop the
+        search after; never stops if None
+    min_epochs : int
+        number of epochs before the phases may be shrunk or the search be
+        stopped
+    num_samples : int
+        number of architectures to sample for probing the policy
+
+    """
+
+    def __init__(self, distribution_tol=0.02, entropy_threshold=None,
+                 reward_tol=1e-3, window=5, shrink_factor=0.5,
+                 min_fraction=0.1, patience=20, min_epochs=10,
+                 num_samples=100):
+        self.distribution_tol = distribution_tol
+        self.entropy_threshold = entropy_threshold
+        self.reward_tol = reward_tol
+        self.window = window
+        self.shrink_factor = shrink_factor
+        self.min_fraction = min_fraction
+        self.patience = patience
+        self.min_epochs = min_epochs
+        self.num_samples = num_samples
+
+        self.controller_fraction = 1.
+        self.stop = False
+
+        self._val_scores = []
+        self._prev_frequencies = None
+        self._best_arc_key = None
+        self._stable_epochs = 0
+        self._num_epochs = 0
+
+    def probe(self, controller):
+        """
+        Samples architectures from the controller to estimate its entropy and
+        branch distribution
+
+        Parameters
+        ----------
+        controller : :class:`Controller`
+            the controller
+
+        Returns
+        -------
+        float
+            mean entropy of the sampled architectures
+        :class:`numpy.ndarray`
+            branch distribution per layer (num_layers x num_branches); in
+            channel search mode the mean fraction of channels per branch
+
+        """
+        frequencies = np.zeros((controller.num_layers, controller.num_branches))
+        entropies = []
+
+        with torch.no_grad():
+            for _ in range(self.num_samples):
+                sample_arc = controller()["pred"]
+                entropies.append(controller.sample_entropy.item())
+
+                for layer_id in range(controller.num_layers):
+                    config = sample_arc[str(layer_id)][0].view(-1).cpu()
+                    if controller.search_whole_channels:
+                        frequencies[layer_id, int(config[0])] += 1
+                    else:
+                        counts = config[1::2].double().numpy()
+                        frequencies[layer_id] += counts / max(counts.sum(), 1)
+
+        return float(np.mean(entropies)), frequencies / self.num_samples
+
+    def _reward_plateaued(self):
+        if len(self._val_scores) < self.window:
+            return False
+
+        scores = np.asarray(self._val_scores[-self.window:], dtype=np.float64)
+        slope = np.polyfit(np.arange(len(scores)), scores, 1)[0]
+        return abs(slope) < self.reward_tol
+
+    def update(self, controller, val_score=None, best_arc=None):
+        """
+        Updates the schedule after an epoch
+
+        Parameters
+        ----------
+        controller : :class:`Controller`
+            the controller
+        val_score : float or None
+            the epoch's validation score (not used for the decision if None)
+        best_arc : dict or None
+            the epoch's best architecture (the search is never stopped if
+            None)
+
+        Returns
+        -------
+        dict
+            the probed statistics and the current decisions (for logging)
+
+        """
+        self._num_epochs += 1
+
+        entropy, frequencies = self.probe(controller)
+        if self._prev_frequencies is None:
+            change = float("inf")
+        else:
+            change = float(0.5 * np.abs(frequencies - self._prev_frequencies
+                                        ).sum(-1).mean())
+        self._prev_frequencies = frequencies
+
+        if val_score is not None:
+            self._val_scores.append(float(val_score))
+            plateaued = self._reward_plateaued()
+        else:
+            plateaued = True
+
+        converged = change < self.distribution_tol and plateaued and (
+            self.entropy_threshold is None or
+            entropy < self.entropy_threshold)
+
+        ready = self._num_epochs >= self.min_epochs
+        if converged and ready:
+            self.controller_fraction = max(
+                self.controller_fraction * self.shrink_factor,
+                self.min_fraction)
+        else:
+            self.controller_fraction = 1.
+
+        if best_arc is not None:
+            arc_key = _arc_key(best_arc)
+            if arc_key == self._best_arc_key:
+                self._stable_epochs += 1
+            else:
+                self._stable_epochs = 0
+            self._best_arc_key = arc_key
+
+            if ready and self.patience is not None and \
+                    self._stable_epochs >= self.patience:
+                self.stop = True
+
+        return {"schedule_entropy": entropy,
+                "schedule_distribution_change": change,
+                "schedule_controller_fraction": self.controller_fraction,
+                "schedule_stable_epochs": self._stable_epochs}
+
+    def num_controller_steps(self, num_steps):
+        """
+        Number of steps of the next controller phase
+
+        Parameters
+        ----------
+        num_steps : int
+            number of steps of a full controller phase
+
+        Returns
+        -------
+        int
+            the number of steps (0 to skip the phase)
+
+        """
+        # shrinking alone never reaches 0: once less than a single step is
+        # left, the fraction snaps to its minimum (skipping the phases for
+        # min_fraction=0)
+        if self.controller_fraction * num_steps < 1.:
+            self.controller_fraction = self.min_fraction
+
+        return int(np.ceil(num_steps * self.controller_fraction))
+
+
+class SearchBudget(object):
+    """
+    Total budget of a search (wall-clock time or FLOPs), which determines the
+    number of epochs from the measured costs of the previous epochs
+
+    Parameters
+    ----------
+    seconds : float or None
+        wall-clock budget in seconds
+    flops : float or None
+        FLOP budget (forward and backward passes of the shared network)
+    safety_margin : float
+        fraction of the budget kept unused to meet the deadline
+
+    """
+
+    def __init__(self, seconds=None, flops=None, safety_margin=0.05):
+        if (seconds is None) == (flops is None):
+            raise ValueError("Either a wall-clock or a FLOP budget must be "
+                             "given")
+
+        self.unit = "seconds" if seconds is not None else "flops"
+        self.total = float(seconds if seconds is not None else flops)
+        self.safety_margin = safety_margin
+
+        self._start = None
+        self._spent_flops = 0.
+
+    def start(self):
+        """
+        Starts the budget's clock
+
+        """
+        self._start = time.time()
+        self._spent_flops = 0.
+
+    @property
+    def spent(self):
+        if self.unit == "seconds":
+            return time.time() - self._start
+        return self._spent_flops
+
+    @property
+    def remaining(self):
+        return self.total - self.spent
+
+    def cost(self, seconds, forward_samples=0, training_samples=0,
+             flops_per_sample=None):
+        """
+        Converts measured quantities to the budget's unit
+
+        Parameters
+        ----------
+        seconds : float
+            measured wall-clock time
+        forward_samples : int
+            number of samples passed forward only
+        training_samples : int
+            number of samples passed forward and backward (a backward pass is
+            counted as two forward passes)
+        flops_per_sample : float or None
+            FLOPs of a forward pass per sample (needed for FLOP budgets)
+
+        Returns
+        -------
+        float
+            the cost
+
+        """
+        if self.unit == "seconds":
+            return seconds
+        return (forward_samples + 3 * training_samples) * flops_per_sample
+
+    def charge(self, cost):
+        """
+        Charges a cost to a FLOP budget (wall-clock budgets are charged by
+        their clock)
+
+        Parameters
+        ----------
+        cost : float
+            the cost in FLOPs
+
+        """
+        if self.unit == "flops":
+            self._spent_flops += cost
+
+    def epochs_left(self, epoch_cost, final_cost=0.):
+        """
+        Number of further epochs fitting into the budget
+
+        Parameters
+        ----------
+        epoch_cost : float
+            (estimated) cost of a single epoch
+        final_cost : float
+            (estimated) cost to reserve for the end of the search (e.g. the
+            final architecture selection)
+
+        Returns
+        -------
+        int
+            the number of epochs
+
+        """
+        available = self.remaining - self.safety_margin * self.total - \
+            final_cost
+        return max(int(available // max(epoch_cost, 1e-12)), 0)
+
+
+class FidelitySchedule(object):
+    """
+    Progressive schedule of the search network's fidelity (input resolution
+    and width, see :meth:`SharedCNN.set_fidelity`)
+
+    Parameters
+    ----------
+    milestones : list
+        list of dicts with the keys ``epoch`` and optionally ``resolution``
+        and ``width``; each milestone applies from its epoch on (until the
+        next one). Before the first milestone and for missing keys the full
+        fidelity is used
+
+    """
+
+    def __init__(self, milestones):
+        self.milestones = sorted(milestones, key=lambda x: x["epoch"])
+
+    def fidelity(self, epoch):
+        """
+        Fidelity of an epoch
+
+        Parameters
+        ----------
+        epoch : int
+            the epoch
+
+        Returns
+        -------
+        dict
+            the resolution and width (None for full fidelity)
+
+        """
+        fidelity = {"resolution": None, "width": None}
+        for milestone in self.milestones:
+            if milestone["epoch"] > epoch:
+                break
+            fidelity = {"resolution": milestone.get("resolution", None),
+                        "width": milestone.get("width", None)}
+
+        return fidelity
@@ -0,0 +1,355 @@
+import asyncio
+import collections
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+"""
+Notes
+-----
+
+Asynchronous serving layer for an :class:`ENASPredictor`. Concurrent requests
+(single samples) are queued and gathered into micro-batches, which are
+limited by a maximum batch size and a maximum waiting time. The batches are
+predicted on a single worker thread (which keeps the event loop responsive
+while torch releases the GIL) and the results are scattered back to the
+waiting requests. A bounded queue provides backpressure: if it is full, new
+requests are rejected instead of increasing the latency of all requests.
+
+The batches are predicted with :meth:`ENASPredictor.predict_data`, so the
+requests only need to contain the inputs (no labels). Stopping the server
+finishes the batch in progress and fails all queued requests.
+
+The endpoint speaks newline delimited JSON over TCP or a unix socket: each
+request line is a JSON object mapping the input keys to (nested) lists
+(e.g. ``{"data": [[[...]]]}``), each response line either contains the
+predictions or an ``"error"``. A request ``{"stats": true}`` returns the
+current latency counters.
+
+Usage::
+
+    server = BatchingServer(predictor, max_batch_size=32, max_wait_ms=2,
+                            static_inputs={"sample_arc": arc})
+    asyncio.run(serve(server, path="/tmp/denas.sock"))
+"""
+
+
+class ServerOverloadedError(RuntimeError):
+    """
+    Raised if a request is rejected, because the request queue is full
+
+    """
+    pass
+
+
+class LatencyCounter(object):
+    """
+    Keeps the latencies of the most recent requests to compute percentiles
+
+    Parameters
+    ----------
+    window_size : int
+        number of most recent latencies to keep
+
+    """
+
+    def __init__(self, window_size=10000):
+        self._latencies = collections.deque(maxlen=window_size)
+        self.num_requests = 0
+
+    def add(self, latency):
+        self._latencies.append(latency)
+        self.num_requests += 1
+
+    def percentile(self, q):
+        """
+        Computes a percentile of the recent latencies
+
+        Parameters
+        ----------
+        q : float
+            the percentile (between 0 and 100)
+
+        Returns
+        -------
+        float
+            the percentile in milliseconds (NaN if there are no latencies)
+
+        """
+        if not self._latencies:
+            return float("nan")
+        return float(np.percentile(self._latencies, q) * 1e3)
+
+
+class BatchingServer(object):
+    """
+    Gathers concurrent single-sample requests into micro-batches for an
+    :class:`ENASPredictor`
+
+    Parameters
+    ----------
+    predictor : :class:`ENASPredictor`
+        the predictor to run the batches with
+    max_batch_size : int
+        maximum number of samples per batch
+    max_wait_ms : float
+        maximum time (in milliseconds) to wait for further requests after
+        the first request of a batch arrived
+    max_queue_size : int
+        maximum number of queued requests; further requests are rejected
+    static_inputs : dict or None
+        inputs shared by all batches, which are not stacked (e.g. the
+        ``sample_arc`` of a :class:`SharedCNN` without fixed architecture)
+    window_size : int
+        number of most recent requests to compute the latency percentiles of
+
+    """
+
+    def __init__(self, predictor, max_batch_size=32, max_wait_ms=2.,
+                 max_queue_size=1024, static_inputs=None, window_size=10000):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.
+        self.max_queue_size = max_queue_size
+        self.static_inputs = static_inputs or {}
+
+        self.latencies = LatencyCounter(window_size)
+        self.num_batches = 0
+        self.num_rejected = 0
+        self._num_batched_samples = 0
+
+        self._queue = None
+        self._stopping = None
+        self._batch_task = None
+        self._executor = None
+
+    async def start(self):
+        """
+        Starts the batching loop (must be called within the event loop)
+
+        """
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._stopping = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._batch_task = asyncio.ensure_future(self._batch_loop())
+
+    async def stop(self):
+        """
+        Stops the batching loop and fails all pending requests
+
+        """
+        if self._batch_task is not None:
+            # the loop isn't cancelled, since cancelling a pending
+            # ``Queue.get`` may be swallowed and leave the loop running
+            self._stopping.set()
+            await self._batch_task
+            self._batch_task = None
+
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Server stopped"))
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def predict(self, sample: dict):
+        """
+        Predicts a single sample
+
+        Parameters
+        ----------
+        sample : dict
+            dictionary mapping the input keys to the sample's arrays (without
+            batch dimension)
+
+        Returns
+        -------
+        dict
+            dictionary containing the predictions for this sample
+
+        Raises
+        ------
+        ServerOverloadedError
+            if the request queue is full
+
+        """
+        future = asyncio.get_event_loop().create_future()
+        try:
+            self._queue.put_nowait((sample, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.num_rejected += 1
+            raise ServerOverloadedError("Request queue is full (%d requests)"
+                                        % self.max_queue_size)
+
+        return await future
+
+    async def _next_request(self, timeout=None):
+        """
+        Waits for the next queued request
+
+        Parameters
+        ----------
+        timeout : float or None
+            maximum time to wait (in seconds)
+
+        Returns
+        -------
+        tuple or None
+            the request; None on timeout or if the server is stopping
+
+        """
+        if self._stopping.is_set():
+            return None
+
+        get_task = asyncio.ensure_future(self._queue.get())
+        stop_task = asyncio.ensure_future(self._stopping.wait())
+        try:
+            await asyncio.wait({get_task, stop_task}, timeout=timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop_task.cancel()
+            if not get_task.done():
+                get_task.cancel()
+
+        # a request, which has already been taken from the queue, is kept
+        if get_task.done() and not get_task.cancelled():
+            return get_task.result()
+        return None
+
+    async def _batch_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            request = await self._next_request()
+            if request is None:
+                return
+
+            requests = [request]
+            deadline = loop.time() + self.max_wait
+
+            while len(requests) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                request = await self._next_request(timeout)
+                if request is None:
+                    break
+                requests.append(request)
+
+            # requests may have been cancelled by their clients meanwhile
+            requests = [_req for _req in requests if not _req[1].done()]
+            if not requests:
+                continue
+
+            try:
+                preds = await loop.run_in_executor(
+                    self._executor, self._predict_batch,
+                    [_req[0] for _req in requests])
+            except Exception as e:
+                for _, future, _ in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.num_batches += 1
+            self._num_batched_samples += len(requests)
+
+            end = time.perf_counter()
+            for idx, (_, future, start) in enumerate(requests):
+                self.latencies.add(end - start)
+                if not future.done():
+                    future.set_result({key: val[idx]
+                                       for key, val in preds.items()})
+
+    def _predict_batch(self, samples):
+        batch = {key: np.stack([np.asarray(_sample[key])
+                                for _sample in samples])
+                 for key in samples[0].keys()}
+        batch.update(self.static_inputs)
+
+        return self.predictor.predict_data(batch)
+
+    def stats(self):
+        """
+        Current serving statistics
+
+        Returns
+        -------
+        dict
+            number of requests, rejected requests and batches, mean batch
+            size, current queue size and the p50 and p99 latencies (in
+            milliseconds)
+
+        """
+        return {"num_requests": self.latencies.num_requests,
+                "num_rejected": self.num_rejected,
+                "num_batches": self.num_batches,
+                "mean_batch_size": (self._num_batched_samples /
+                                    max(self.num_batches, 1)),
+                "queue_size": (self._queue.qsize()
+                               if self._queue is not None else 0),
+                "p50_ms": self.latencies.percentile(50),
+                "p99_ms": self.latencies.percentile(99)}
+
+
+async def _handle_connection(server, reader, writer):
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+
+        try:
+            request = json.loads(line)
+            if request.get("stats", False):
+                response = server.stats()
+            else:
+                preds = await server.predict(
+                    {key: np.asarray(val, dtype=np.float32)
+                     for key, val in request.items()})
+                response = {key: np.asarray(val).tolist()
+                            for key, val in preds.items()}
+        except Exception as e:
+            response = {"error": "%s: %s" % (type(e).__name__, e)}
+
+        writer.write((json.dumps(response) + "\n").encode())
+        await writer.drain()
+
+    writer.close()
+
+
+async def serve(server: BatchingServer, host="127.0.0.1", port=None,
+                path=None):
+    """
+    Serves a :class:`BatchingServer` via newline delimited JSON until
+    cancelled
+
+    Parameters
+    ----------
+    server : :class:`BatchingServer`
+        the server to serve
+    host : str
+        the host to bind to (if serving via TCP)
+    port : int or None
+        the port to bind to (if serving via TCP)
+    path : str or None
+        the unix socket to bind to; takes precedence over ``host`` and
+        ``port``
+
+    """
+    def _handler(reader, writer):
+        return _handle_connection(server, reader, writer)
+
+    await server.start()
+    if path is not None:
+        endpoint = await asyncio.start_unix_server(_handler, path=path)
+    else:
+        endpoint = await asyncio.start_server(_handler, host=host, port=port)
+
+    try:
+        async with endpoint:
+            await endpoint.serve_forever()
+    finally:
+        await server.stop()
@@ -2,9 +2,23 @@ from delira.training import PyTorchNetworkTrainer
 from batchgenerators.dataloading import MultiThreadedAugmenter
 from tqdm import tqdm
 from .models import ENASModelPyTorch
+from .actor_learner import RewardWorkerPool
+from .history import ArcHistory
+from .data import DeviceRewardSet
+from .replay import ArcReplayBuffer
+from .leaderboard import ArcLeaderboard
+from .instrumentation import OpInstrumentation
+from .warm_start import warm_start as warm_start_model
+from .scheduling import PhaseScheduler, SearchBudget, FidelitySchedule
+from .models.arc_utils import encode_arcs
+from .models.cost import estimate_costs
 import torch
 import numpy as np
+import contextlib
 import logging
+import time
+import os
+import warnings
 
 
 class ENASTrainerPyTorch(PyTorchNetworkTrainer):
@@ -16,6 +30,8 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
 
         self.closure_fn_shared_cnn = network.closure_shared_cnn
         self.closure_fn_controller = network.closure_controller
+        self.closure_fn_controller_offpolicy = \
+            network.closure_controller_offpolicy
 
         super()._setup(network, optim_fn, optimizer_cls, optimizer_params,
                        lr_scheduler_cls, lr_scheduler_params, gpu_ids,
@@ -25,7 +41,12 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
     def train(self, num_epochs, datamgr_train_controller,
               datamgr_train_shared_cnn, datamgr_valid=None,
               val_score_key=None, val_score_mode='highest', reduce_mode='mean',
-              verbose=True, n_samples_val=100):
+              verbose=True, n_samples_val=100, num_reward_workers=0,
+              reward_worker_kwargs=None, reward_importance_clip=1.0,
+              best_arc_kwargs=None, history=None, bn_calibration_batches=0,
+              phase_scheduler=None, budget=None, fidelity_schedule=None,
+              reward_set=None, replay=None, instrumentation=None,
+              warm_start=None, interleaved=None):
         """
         Defines a routine to train a specified number of epochs
 
@@ -50,6 +71,72 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
             whether to show progress bars or not
         n_samples_val : int
             Number of samples to predict from for determining best architecture
+        num_reward_workers : int
+            number of worker processes evaluating the controller's
+            architectures asynchronously (actor-learner mode); if 0, the
+            controller is trained serially
+        reward_worker_kwargs : dict or None
+            additional keyword arguments for the :class:`RewardWorkerPool`
+        reward_importance_clip : float or None
+            upper bound of the importance weights correcting the off-policy
+            controller updates in actor-learner mode
+        best_arc_kwargs : dict or None
+            additional keyword arguments for :meth:`get_best_arc` (e.g. to
+            enable racing or a persistent leaderboard, which may also be
+            given by its keyword arguments)
+        history : :class:`ArcHistory` or str or None
+            history (or path to it) to append all architectures sampled
+            during controller training to; no history is kept if None
+        bn_calibration_batches : int
+            number of (cached) training batches to re-estimate the batchnorm
+            statistics on for each architecture, before it is scored for the
+            selection of the best architecture; the shared statistics are
+            used if 0
+        phase_scheduler : :class:`PhaseScheduler` or dict or None
+            scheduler (or its keyword arguments) shrinking or skipping the
+            controller phases once the controller has converged and stopping
+            the search once the best architecture is stable; the phases
+            always alternate fully if None
+        budget : :class:`SearchBudget` or dict or None
+            wall-clock or FLOP budget (or its keyword arguments) of the
+            search; if given, the search stops (with a checkpoint) once the
+            next epoch and the final architecture selection would exceed the
+            budget and the learning rate schedule is stretched to the planned
+            number of epochs. ``num_epochs`` remains an upper bound. Stretching
+            needs a ``lr_schedule_callback`` with a ``CosineAnnealingLR``
+            (as set up by :class:`ENASExperimentPyTorch`); other schedulers
+            raise a ValueError and a missing callback a warning
+        fidelity_schedule : :class:`FidelitySchedule` or list or None
+            schedule (or its milestones) of the shared network's input
+            resolution and width; always trains at full fidelity if None
+        reward_set : :class:`DeviceRewardSet` or dict or None
+            device-resident data subset (or the keyword arguments to draw it
+            from the dataset of ``datamgr_train_controller``, e.g.
+            ``num_samples`` and ``refresh_every``) to compute the
+            controller's rewards and select the best architecture on without
+            augmentation and loader workers; by default the controller keeps
+            its number of steps per epoch. The controller's data manager is
+            used if None
+        replay : :class:`ArcReplayBuffer` or dict or None
+            buffer (or its keyword arguments) of evaluated architectures to
+            take additional clipped off-policy controller updates from after
+            each evaluation; each architecture drives a single update if None
+        instrumentation : :class:`OpInstrumentation` or dict or None
+            instrumentation (or its keyword arguments) of the shared
+            network's ops, whose statistics are appended to its csv file
+            (default: ``op_stats.csv`` in the save path) after each epoch;
+            no instrumentation if None
+        warm_start : str or dict or None
+            checkpoint of a previous search (or the keyword arguments of
+            :func:`denas.warm_start.warm_start`, e.g. ``checkpoint`` and
+            ``logit_scale``) to initialize the shared network and the
+            controller from; ignored when resuming a search
+        interleaved : bool or dict or None
+            if given (optionally with ``update_every``), the controller is
+            trained from the pre-update accuracies of the shared network's
+            training steps: every ``update_every`` steps it takes off-policy
+            updates on the recorded architectures and the separate controller
+            phase is skipped
 
         Raises
         ------
@@ -59,6 +146,11 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
         """
         self._at_training_begin()
 
+        if warm_start is not None and self.start_epoch <= 1:
+            if isinstance(warm_start, str):
+                warm_start = {"checkpoint": warm_start}
+            warm_start_model(self.module, **warm_start)
+
         if val_score_mode == 'highest':
             best_val_score = 0
         elif val_score_mode == 'lowest':
@@ -105,16 +197,123 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
 
                 val_metric_keys[k] = v
 
+        self.reward_importance_clip = reward_importance_clip
+        if best_arc_kwargs is None:
+            best_arc_kwargs = {}
+        if isinstance(best_arc_kwargs.get("leaderboard", None), dict):
+            best_arc_kwargs = {
+                **best_arc_kwargs,
+                "leaderboard": ArcLeaderboard(**best_arc_kwargs["leaderboard"])}
+        self.best_arc_kwargs = best_arc_kwargs
+
+        if history is not None and \
+                not self.module.controller.search_whole_channels:
+            raise ValueError("The architecture history only supports "
+                             "searching whole channels")
+        if isinstance(history, str):
+            history = ArcHistory(history, self.module.controller.num_layers)
+        self.history = history
+
+        if isinstance(phase_scheduler, dict):
+            phase_scheduler = PhaseScheduler(**phase_scheduler)
+        self.phase_scheduler = phase_scheduler
+        self._last_best_arc = None
+
+        if isinstance(budget, dict):
+            budget = SearchBudget(**budget)
+        if budget is not None and budget.unit == "flops" and \
+                not self.module.controller.search_whole_channels:
+            raise ValueError("FLOP budgets only support searching whole "
+                             "channels")
+        self.budget = budget
+        if budget is not None:
+            self._check_budget_schedule()
+            budget.start()
+
+        if isinstance(fidelity_schedule, (list, tuple)):
+            fidelity_schedule = FidelitySchedule(fidelity_schedule)
+        if fidelity_schedule is not None and num_reward_workers > 0:
+            raise ValueError("Fidelity schedules are not supported in "
+                             "actor-learner mode")
+        self.fidelity_schedule = fidelity_schedule
+
+        if isinstance(replay, dict):
+            replay = ArcReplayBuffer(**replay)
+        self.replay_buffer = replay
+        self._shared_cnn_updates = 0
+
+        if interleaved is True:
+            interleaved = {}
+        if interleaved and num_reward_workers > 0:
+            raise ValueError("Interleaved training is not supported in "
+                             "actor-learner mode")
+        self.interleaved = interleaved or None
+        self._interleaved_rewards = []
+
+        if reward_set is not None and num_reward_workers > 0:
+            raise ValueError("Device-resident reward sets are not supported "
+                             "in actor-learner mode")
+        if isinstance(reward_set, dict):
+            reward_set = DeviceRewardSet(
+                datamgr_train_controller.dataset, **{
+                    "batch_size": datamgr_train_controller.batch_size,
+                    "device": self.input_device,
+                    "num_batches": int(np.ceil(
+                        len(datamgr_train_controller.dataset) /
+                        datamgr_train_controller.batch_size)),
+                    **reward_set})
+        if reward_set is not None:
+            datamgr_train_controller = reward_set
+
+        if bn_calibration_batches > 0:
+            self._calibration_data = self._cache_calibration_data(
+                datamgr_train_shared_cnn, bn_calibration_batches)
+        else:
+            self._calibration_data = None
+
+        if num_reward_workers > 0:
+            if reward_worker_kwargs is None:
+                reward_worker_kwargs = {}
+            self._reward_workers = RewardWorkerPool(
+                self.module.shared_cnn, datamgr_train_controller,
+                self.module.prepare_batch, num_workers=num_reward_workers,
+                **reward_worker_kwargs)
+            self._reward_workers.start()
+            num_controller_steps = int(np.ceil(
+                len(datamgr_train_controller.dataset) /
+                datamgr_train_controller.batch_size))
+        else:
+            self._reward_workers = None
+
+        # attached after the reward workers copied the shared network
+        if isinstance(instrumentation, dict):
+            instrumentation = OpInstrumentation(**instrumentation)
+        if instrumentation is not None:
+            if instrumentation.file_path is None:
+                instrumentation.file_path = os.path.join(self.save_path,
+                                                         "op_stats.csv")
+            instrumentation.attach(self.module.shared_cnn)
+        self.instrumentation = instrumentation
+
         for epoch in range(self.start_epoch, num_epochs + 1):
 
             self._at_epoch_begin(metrics_val, val_score_key, epoch,
                                  num_epochs)
 
+            if self.fidelity_schedule is not None:
+                self.module.shared_cnn.set_fidelity(
+                    **self.fidelity_schedule.fidelity(epoch))
+
             batch_gen_train_shared_cnn = datamgr_train_shared_cnn.get_batchgen(
                 seed=epoch)
-            batchgen_train_controller = datamgr_train_controller.get_batchgen(
-                seed=epoch
-            )
+            if self.interleaved is not None:
+                # the controller learns during the shared cnn phase
+                batchgen_train_controller = 0
+            elif self._reward_workers is None:
+                batchgen_train_controller = \
+                    datamgr_train_controller.get_batchgen(seed=epoch)
+            else:
+                batchgen_train_controller = num_controller_steps
 
             # train single network epoch
             train_metrics, train_losses = self._train_single_epoch(
@@ -125,6 +324,7 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
                 **train_metrics,
                 **train_losses}
 
+            eval_start = time.time()
             if datamgr_valid is not None:
                 preds_val, metrics_val = self._evaluate_single_epoch(
                     datamgr_valid,
@@ -133,6 +333,7 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
                     metric_keys=self.metric_keys,
                     verbose=verbose,
                     epoch=epoch)
+            eval_seconds = time.time() - eval_start
 
             total_metrics.update(metrics_val)
 
@@ -171,33 +372,151 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
                 logging.info({"value": {"value": val, "name": key
                                         }})
 
+            if self.instrumentation is not None:
+                self.instrumentation.dump(epoch)
+
+            if self.phase_scheduler is not None:
+                schedule_stats = self.phase_scheduler.update(
+                    self.module.controller,
+                    new_val_score if val_score_key is not None else None,
+                    self._last_best_arc)
+                for key, val in schedule_stats.items():
+                    logging.info({"value": {"value": val, "name": key}})
+
+                # stop the search once the best architecture is stable
+                if self.phase_scheduler.stop:
+                    logging.info("Best architecture stable, stopping search "
+                                 "after epoch %d" % epoch)
+                    self.stop_training = True
+
+            budget_exhausted = False
+            if self.budget is not None:
+                budget_exhausted = self._update_budget(
+                    epoch, eval_seconds, datamgr_train_shared_cnn.batch_size,
+                    datamgr_valid, n_samples_val)
+
             self._at_epoch_end(total_metrics, val_score_key, epoch, is_best)
 
+            if budget_exhausted:
+                logging.info("Budget exhausted, stopping search after epoch "
+                             "%d" % epoch)
+                if epoch % self.save_freq != 0:
+                    self.save_state(os.path.join(
+                        self.save_path, "checkpoint_epoch_%d.pt" % epoch),
+                        epoch)
+                self.stop_training = True
+
             is_best = False
 
             # stop training (might be caused by early stopping)
             if self.stop_training:
                 break
 
+        if self._reward_workers is not None:
+            self._reward_workers.shutdown()
+            self._reward_workers = None
+
+        if self.instrumentation is not None:
+            self.instrumentation.detach()
+
+        # the best architecture is selected at full fidelity
+        self.module.shared_cnn.set_fidelity()
+
+        if self.history is not None:
+            self.history.flush()
+
+        self.best_val_score = best_val_score
+
         return self._at_training_end(datamgr_valid, n_samples_val, verbose=verbose)
 
-    def _at_training_end(self, batchgen: MultiThreadedAugmenter, n_samples: int,
-                         verbose: bool):
-        self.get_best_arc(batchgen, n_samples=n_samples, verbose=verbose)
-        return super()._at_training_end()
+    def _at_training_end(self, datamgr, n_samples: int, verbose: bool):
+        """
+        Loads the best network (if available) and determines the best
+        architecture for it
+
+        Parameters
+        ----------
+        datamgr : DataManager or None
+            data manager holding the data to select the best architecture on;
+            no architecture is selected if None
+        n_samples : int
+            number of candidate architectures
+        verbose : bool
+            whether to display the candidates
+
+        Returns
+        -------
+        :class:`ENASModelPyTorch`
+            the best network
+
+        """
+        module = super()._at_training_end()
+
+        self.best_arc, self.best_arc_acc = None, None
+        best_arc_kwargs = dict(getattr(self, "best_arc_kwargs", {}))
+        leaderboard = best_arc_kwargs.pop("leaderboard", None)
+        if datamgr is not None and leaderboard is not None:
+            # the final architecture is chosen from the whole search history
+            self.best_arc, self.best_arc_acc = \
+                self._get_best_arc_leaderboard(
+                    datamgr.get_batchgen(), leaderboard,
+                    num_batches=leaderboard.final_num_batches,
+                    verbose=verbose)
+        elif datamgr is not None:
+            self.best_arc, self.best_arc_acc = self.get_best_arc(
+                datamgr.get_batchgen(), n_samples=n_samples, verbose=verbose,
+                **best_arc_kwargs)
+
+        return module
 
     def _train_single_epoch(self,
                             batchgen_train_shared_cnn: MultiThreadedAugmenter,
                             batchgen_train_controller: MultiThreadedAugmenter,
                             epoch: int, verbose=False):
 
+        shared_cnn_start = time.time()
+        num_shared_cnn_steps = batchgen_train_shared_cnn.generator.num_batches \
+            * batchgen_train_shared_cnn.num_processes
         metrics_shared_cnn, losses_shared_cnn = \
             self._train_single_epoch_shared_cnn(batchgen_train_shared_cnn,
                                                 epoch, verbose)
+        shared_cnn_seconds = time.time() - shared_cnn_start
 
-        metrics_controller, losses_controller = \
-            self._train_single_epoch_controller(batchgen_train_controller,
-                                                epoch, verbose)
+        if isinstance(batchgen_train_controller, int):
+            num_steps = batchgen_train_controller
+        else:
+            num_steps = batchgen_train_controller.generator.num_batches * \
+                batchgen_train_controller.num_processes
+
+        phase_scheduler = getattr(self, "phase_scheduler", None)
+        if phase_scheduler is not None:
+            num_steps = phase_scheduler.num_controller_steps(num_steps)
+
+        controller_start = time.time()
+        if num_steps == 0:
+            # the controller has converged (or is trained interleaved), its
+            # phase is skipped
+            if not isinstance(batchgen_train_controller, int):
+                batchgen_train_controller._finish()
+            metrics_controller, losses_controller = {}, {}
+        elif self._reward_workers is None:
+            metrics_controller, losses_controller = \
+                self._train_single_epoch_controller(batchgen_train_controller,
+                                                    epoch, verbose,
+                                                    max_steps=num_steps)
+        else:
+            # in actor-learner mode the workers load their own data and only
+            # the number of steps is passed
+            metrics_controller, losses_controller = \
+                self._train_single_epoch_controller_actor_learner(
+                    num_steps, epoch, verbose)
+
+        # measured costs of the phases (e.g. for budget mode)
+        self._epoch_costs = {"shared_cnn_steps": num_shared_cnn_steps,
+                             "shared_cnn_seconds": shared_cnn_seconds,
+                             "controller_steps": num_steps,
+                             "controller_seconds": time.time() -
+                             controller_start}
 
         return ({**metrics_shared_cnn, **metrics_controller},
                 {**losses_shared_cnn, **losses_controller})
@@ -228,10 +547,12 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
         else:
             iterable = enumerate(batchgen)
 
+        interleaved = getattr(self, "interleaved", None)
+
         for batch_nr, batch in iterable:
             data_dict = self._prepare_batch(batch)
 
-            _metrics, _losses, _ = self.closure_fn_shared_cnn(
+            _metrics, _losses, preds = self.closure_fn_shared_cnn(
                 self.module,
                 data_dict,
                 optimizers=self.optimizers,
@@ -243,30 +564,83 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
             metrics.append(_metrics)
             losses.append(_losses)
 
+            if interleaved is not None:
+                # the predictions were made before the update
+                with torch.no_grad():
+                    acc = torch.mean((torch.argmax(preds["pred"], 1) ==
+                                      data_dict["label"]).float()).item()
+                self._interleaved_rewards.append((
+                    self.module.controller.sample_arc, acc,
+                    self.module.controller.sample_log_prob.item(),
+                    self.module.controller.sample_entropy.item()))
+
+                if (batch_nr + 1) % interleaved.get("update_every", 1) == 0:
+                    self._train_controller_interleaved(epoch, batch_nr,
+                                                       metrics, losses)
+
+            self._shared_cnn_updates += 1
+
         batchgen._finish()
 
+        # the rewards are only valid for the current weights
+        if interleaved is not None and self._interleaved_rewards:
+            self._train_controller_interleaved(epoch, batch_nr, metrics,
+                                               losses)
+
+        # apply pending lazy updates before the weights are used elsewhere
+        if hasattr(self.optimizers["shared_cnn"], "flush"):
+            self.optimizers["shared_cnn"].flush()
+
         self.module.controller.train()
 
-        total_losses, total_metrics = {}, {}
+        return self._merge_step_results(metrics, losses)
 
-        for _metrics in metrics:
-            for key, val in _metrics.items():
-                if key in total_metrics:
-                    total_metrics[key].append(val)
-                else:
-                    total_metrics[key] = [val]
+    def _train_controller_interleaved(self, epoch, step, metrics, losses):
+        """
+        Updates the controller from the rewards recorded during the shared
+        network's training steps (off-policy corrected, since the controller
+        may have changed since sampling the architectures)
 
-        for _losses in losses:
-            for key, val in _losses.items():
-                if key in total_losses:
-                    total_losses[key].append(val)
-                else:
-                    total_losses[key] = [val]
+        Parameters
+        ----------
+        epoch : int
+            current epoch
+        step : int
+            current step of the shared network
+        metrics : list
+            list of metric dicts to append the updates' metrics to
+        losses : list
+            list of loss dicts to append the updates' losses to
 
-        return total_metrics, total_losses
+        """
+        for sample_arc, acc, behaviour_log_prob, behaviour_entropy in \
+                self._interleaved_rewards:
+            _metrics, _losses, _ = self.closure_fn_controller_offpolicy(
+                self.module,
+                sample_arc,
+                acc,
+                behaviour_log_prob,
+                optimizers=self.optimizers,
+                losses=self.losses,
+                metrics=self.train_metrics,
+                fold=self.fold,
+                batch_nr=step,
+                importance_clip=self.reward_importance_clip)
+
+            metrics.append(_metrics)
+            losses.append(_losses)
+
+            # the controller has been teacher forced with the architecture
+            self._record_arc(acc, epoch, step, log_prob=behaviour_log_prob,
+                             entropy=behaviour_entropy)
+
+            self._replay_controller(acc, metrics, losses,
+                                    behaviour_log_prob=behaviour_log_prob)
+
+        self._interleaved_rewards = []
 
     def _train_single_epoch_controller(self, batchgen: MultiThreadedAugmenter,
-                                       epoch, verbose=False):
+                                       epoch, verbose=False, max_steps=None):
         """
         Trains the controller network a single epoch
 
@@ -276,6 +650,8 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
             Generator yielding the training batches
         epoch : int
             current epoch
+        max_steps : int or None
+            maximum number of steps (all batches are used if None)
 
         """
 
@@ -285,6 +661,8 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
         self.module.shared_cnn.eval()
 
         n_batches = batchgen.generator.num_batches * batchgen.num_processes
+        if max_steps is not None:
+            n_batches = min(n_batches, max_steps)
         if verbose:
             iterable = tqdm(enumerate(batchgen), unit=' batch', total=n_batches,
                             desc='Epoch %d Controller' % epoch)
@@ -292,6 +670,8 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
             iterable = enumerate(batchgen)
 
         for batch_nr, batch in iterable:
+            if batch_nr >= n_batches:
+                break
             data_dict = self._prepare_batch(batch)
 
             _metrics, _losses, _ = self.closure_fn_controller(
@@ -306,10 +686,205 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
             metrics.append(_metrics)
             losses.append(_losses)
 
+            self._record_arc(_losses["controller_acc"], epoch, batch_nr)
+
+            self._replay_controller(_losses["controller_acc"], metrics,
+                                    losses)
+
         batchgen._finish()
 
         self.module.shared_cnn.train()
 
+        return self._merge_step_results(metrics, losses)
+
+    def _train_single_epoch_controller_actor_learner(self, num_steps, epoch,
+                                                     verbose=False):
+        """
+        Trains the controller network a single epoch with architectures
+        evaluated asynchronously by the reward workers
+
+        Parameters
+        ----------
+        num_steps : int
+            number of architectures to evaluate and update on
+        epoch : int
+            current epoch
+
+        """
+
+        metrics, losses = [], []
+
+        self.module.controller.train()
+
+        # the shared weights have changed during the last shared cnn phase
+        self._reward_workers.sync_weights(self.module.shared_cnn,
+                                          self._shared_cnn_updates)
+
+        if verbose:
+            pbar = tqdm(unit=' arc', total=num_steps,
+                        desc='Epoch %d Controller' % epoch)
+
+        pending = {}
+        n_submitted = 0
+        for step in range(num_steps):
+
+            # keep the workers busy
+            while n_submitted < num_steps and self._reward_workers.can_submit:
+                with torch.no_grad():
+                    sample_arc = self.module("controller")["pred"]
+                behaviour_log_prob = \
+                    self.module.controller.sample_log_prob.item()
+                behaviour_entropy = \
+                    self.module.controller.sample_entropy.item()
+
+                pending[n_submitted] = (sample_arc, behaviour_log_prob,
+                                        behaviour_entropy)
+                self._reward_workers.submit(n_submitted, sample_arc)
+                n_submitted += 1
+
+            task_id, acc, version = self._reward_workers.get()
+            sample_arc, behaviour_log_prob, behaviour_entropy = \
+                pending.pop(task_id)
+
+            _metrics, _losses, _ = self.closure_fn_controller_offpolicy(
+                self.module,
+                sample_arc,
+                acc,
+                behaviour_log_prob,
+                optimizers=self.optimizers,
+                losses=self.losses,
+                metrics=self.train_metrics,
+                fold=self.fold,
+                batch_nr=step,
+                importance_clip=self.reward_importance_clip)
+
+            metrics.append(_metrics)
+            losses.append(_losses)
+
+            # the controller has been teacher forced with the architecture
+            self._record_arc(acc, epoch, step, log_prob=behaviour_log_prob,
+                             entropy=behaviour_entropy)
+
+            # the reward is only as fresh as the weights it was measured with
+            self._replay_controller(acc, metrics, losses,
+                                    behaviour_log_prob=behaviour_log_prob,
+                                    version=version)
+
+            if verbose:
+                pbar.update(1)
+
+        if verbose:
+            pbar.close()
+
+        return self._merge_step_results(metrics, losses)
+
+    def _replay_controller(self, accuracy, metrics, losses,
+                           behaviour_log_prob=None, version=None):
+        """
+        Adds the controller's last architecture to the replay buffer (if any)
+        and takes the additional off-policy updates from the buffer
+
+        Parameters
+        ----------
+        accuracy : float
+            the accuracy of the architecture
+        metrics : list
+            list of metric dicts to append the updates' metrics to
+        losses : list
+            list of loss dicts to append the updates' losses to
+        behaviour_log_prob : float or None
+            the log-probability of the architecture under the policy, which
+            sampled it; the controller's last log-probability if None
+        version : int or None
+            number of shared cnn updates of the weights, the accuracy was
+            measured with; the current number if None
+
+        """
+        replay_buffer = getattr(self, "replay_buffer", None)
+        if replay_buffer is None:
+            return
+
+        if behaviour_log_prob is None:
+            behaviour_log_prob = self.module.controller.sample_log_prob.item()
+
+        if version is None:
+            version = self._shared_cnn_updates
+
+        replay_buffer.add(self.module.controller.sample_arc, accuracy,
+                          behaviour_log_prob, version)
+
+        for entry in replay_buffer.sample(self._shared_cnn_updates):
+            _metrics, _losses, _ = self.closure_fn_controller_offpolicy(
+                self.module,
+                entry.sample_arc,
+                entry.accuracy,
+                entry.behaviour_log_prob,
+                optimizers=self.optimizers,
+                losses=self.losses,
+                metrics=self.train_metrics,
+                fold=self.fold,
+                ppo_clip=replay_buffer.clip,
+                update_baseline=False)
+
+            # keep the statistics of the evaluated architectures separate
+            metrics.append({key.replace("controller_", "replay_", 1): val
+                            for key, val in _metrics.items()})
+            losses.append({key.replace("controller_", "replay_", 1): val
+                           for key, val in _losses.items()})
+
+    def _record_arc(self, reward, epoch, step, log_prob=None, entropy=None):
+        """
+        Appends the controller's last architecture to the history (if any)
+
+        Parameters
+        ----------
+        reward : float
+            the reward of the architecture
+        epoch : int
+            current epoch
+        step : int
+            current step
+        log_prob : float or None
+            the log-probability of the architecture under the policy, which
+            sampled it; the controller's last log-probability if None (only
+            valid, if the controller hasn't been updated since sampling)
+        entropy : float or None
+            the entropy of the sampling policy; the controller's last entropy
+            if None
+
+        """
+        if self.history is None:
+            return
+
+        controller = self.module.controller
+        if log_prob is None:
+            log_prob = controller.sample_log_prob.item()
+        if entropy is None:
+            entropy = controller.sample_entropy.item()
+
+        self.history.append(controller.sample_arc, reward, log_prob, entropy,
+                            epoch, step)
+
+    @staticmethod
+    def _merge_step_results(metrics, losses):
+        """
+        Converts lists of per-step metric and loss dicts to dicts of lists
+
+        Parameters
+        ----------
+        metrics : list
+            list of metric dicts
+        losses : list
+            list of loss dicts
+
+        Returns
+        -------
+        dict
+            merged metrics
+        dict
+            merged losses
+
+        """
         total_losses, total_metrics = {}, {}
 
         for _metrics in metrics:
@@ -328,7 +903,165 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
 
         return total_metrics, total_losses
 
-    def get_best_arc(self, batchgen, n_samples=10, verbose=False):
+    def _mean_arc_flops(self, num_samples=20):
+        """
+        Estimates the mean FLOPs per sample of a forward pass of the
+        architectures currently sampled by the controller
+
+        """
+        controller = self.module.controller
+        with torch.no_grad():
+            arcs = [controller()["pred"] for _ in range(num_samples)]
+
+        branches, skips = encode_arcs(arcs, controller.num_layers)
+        return float(estimate_costs(
+            branches, skips, self.module.shared_cnn.out_filters,
+            fixed=False)["flops"].mean())
+
+    def _check_budget_schedule(self):
+        """
+        Checks that the learning rate schedule can be stretched to the
+        number of epochs planned by the budget (only known during the search)
+
+        Raises
+        ------
+        ValueError
+            if the schedule isn't a :class:`CosineAnnealingLR`, whose length
+            can be adapted
+
+        """
+        lr_schedule_callback = getattr(self, "lr_schedule_callback", None)
+        if lr_schedule_callback is None:
+            warnings.warn("The trainer has no lr_schedule_callback; the "
+                          "learning rate schedule isn't adapted to the budget")
+            return
+
+        scheduler = getattr(lr_schedule_callback, "scheduler", None)
+        if not isinstance(scheduler,
+                          torch.optim.lr_scheduler.CosineAnnealingLR):
+            raise ValueError("Budgets can only stretch a CosineAnnealingLR "
+                             "schedule, but the lr_schedule_callback uses %s"
+                             % type(scheduler).__name__)
+
+    def _update_budget(self, epoch, eval_seconds, batch_size, datamgr_valid,
+                       n_samples_val):
+        """
+        Charges the last epoch to the budget, re-plans the number of epochs
+        and stretches the learning rate schedule accordingly
+
+        Parameters
+        ----------
+        epoch : int
+            the current epoch
+        eval_seconds : float
+            time spent for the epoch's evaluation
+        batch_size : int
+            the training batch size
+        datamgr_valid : DataManager or None
+            the validation data (used for the final architecture selection)
+        n_samples_val : int
+            number of candidates of the final architecture selection
+
+        Returns
+        -------
+        bool
+            whether the budget does not allow another epoch
+
+        """
+        costs = self._epoch_costs
+
+        if self.budget.unit == "flops":
+            flops_per_sample = self._mean_arc_flops()
+        else:
+            flops_per_sample = None
+
+        if datamgr_valid is not None:
+            n_eval_samples = len(datamgr_valid.dataset)
+        else:
+            n_eval_samples = 0
+
+        epoch_cost = self.budget.cost(
+            costs["shared_cnn_seconds"] + costs["controller_seconds"] +
+            eval_seconds,
+            forward_samples=(costs["controller_steps"] * batch_size +
+                             n_eval_samples),
+            training_samples=costs["shared_cnn_steps"] * batch_size,
+            flops_per_sample=flops_per_sample)
+        self.budget.charge(epoch_cost)
+
+        # each candidate of the final selection costs a forward pass on a
+        # single batch, which is what a controller step costs as well
+        if costs["controller_steps"] > 0:
+            step_seconds = costs["controller_seconds"] / \
+                costs["controller_steps"]
+        else:
+            step_seconds = costs["shared_cnn_seconds"] / \
+                max(costs["shared_cnn_steps"], 1) / 3
+        final_cost = 0.
+        if datamgr_valid is not None:
+            final_cost = n_samples_val * self.budget.cost(
+                step_seconds, forward_samples=batch_size,
+                flops_per_sample=flops_per_sample)
+
+        epochs_left = self.budget.epochs_left(epoch_cost, final_cost)
+
+        # anneal the learning rate until the last planned epoch (the
+        # scheduler is stepped with the absolute epoch, also when resuming;
+        # see _check_budget_schedule)
+        lr_schedule_callback = getattr(self, "lr_schedule_callback", None)
+        if lr_schedule_callback is not None:
+            lr_schedule_callback.scheduler.T_max = max(epoch + epochs_left, 1)
+
+        logging.info({"value": {"value": self.budget.remaining,
+                                "name": "budget_remaining"}})
+        logging.info({"value": {"value": epochs_left,
+                                "name": "budget_epochs_left"}})
+
+        return epochs_left < 1
+
+    def _cache_calibration_data(self, datamgr, n_batches):
+        """
+        Loads the batches to re-estimate the batchnorm statistics on
+
+        Parameters
+        ----------
+        datamgr : DataManager
+            data manager holding the (training) data
+        n_batches : int
+            number of batches to cache
+
+        Returns
+        -------
+        list
+            the batches' input tensors (on the network's device)
+
+        """
+        batches = []
+        batchgen = datamgr.get_batchgen(seed=0)
+        for batch in batchgen:
+            if len(batches) >= n_batches:
+                break
+            batches.append(self._prepare_batch(batch)["data"])
+        batchgen._finish()
+
+        return batches
+
+    def _scoring_context(self, sample_arc):
+        """
+        Context to score an architecture in: recalibrates the batchnorm
+        statistics for the architecture if calibration data is cached
+
+        """
+        calibration_data = getattr(self, "_calibration_data", None)
+        if not calibration_data:
+            return contextlib.suppress()
+
+        return self.module.shared_cnn.recalibrated_batch_norm(
+            sample_arc, calibration_data)
+
+    def get_best_arc(self, batchgen, n_samples=10, verbose=False,
+                     racing=False, keep_fraction=0.5, max_evaluations=None,
+                     leaderboard=None, epoch=None):
         """Evaluate several architectures and return the best performing one.
 
         Args:
@@ -337,6 +1070,15 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
             data_loaders: Dict containing data loaders.
             n_samples: Number of architectures to test when looking for the best one.
             verbose: If True, display the architecture and resulting validation accuracy.
+            racing: If True, select the best architecture by successive halving
+                (see :meth:`_get_best_arc_racing`).
+            keep_fraction: Fraction of candidates surviving each racing round.
+            max_evaluations: Budget of (architecture, batch) evaluations in
+                racing mode; unlimited if None.
+            leaderboard: If given, the :class:`ArcLeaderboard`'s leaders
+                and a few new architectures are scored instead of
+                ``n_samples`` new ones (see :meth:`_get_best_arc_leaderboard`).
+            epoch: Current epoch (to tag new leaders with).
 
         Returns:
             best_arc: The best performing architecture.
@@ -345,6 +1087,19 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
         All architectures are evaluated on the same minibatch from the validation set.
         """
 
+        if leaderboard is not None:
+            if racing:
+                raise ValueError("Racing and leaderboard can't be combined")
+            return self._get_best_arc_leaderboard(
+                batchgen, leaderboard, num_batches=leaderboard.num_batches,
+                epoch=epoch, verbose=verbose)
+
+        if racing:
+            return self._get_best_arc_racing(batchgen, n_samples=n_samples,
+                                             keep_fraction=keep_fraction,
+                                             max_evaluations=max_evaluations,
+                                             verbose=verbose)
+
         self.module.eval()
 
         n_batches = batchgen.generator.num_batches * batchgen.num_processes
@@ -366,7 +1121,7 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
                 sample_arc = self.module("controller")["pred"]  # perform forward pass to generate a new architecture
             arcs.append(sample_arc)
 
-            with torch.no_grad():
+            with torch.no_grad(), self._scoring_context(sample_arc):
                 pred = self.module("shared_cnn", batch["data"], sample_arc)
             val_acc = torch.mean((torch.max(pred["pred"], 1)[1] == batch["label"]).float())
             val_accs.append(val_acc.item())
@@ -383,6 +1138,181 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
         self.module.train()
         return best_arc, best_val_acc
 
+    def _get_best_arc_racing(self, batchgen, n_samples=10, keep_fraction=0.5,
+                             max_evaluations=None, verbose=False):
+        """
+        Selects the best architecture by successive halving: All candidates
+        are scored on a small shared batch, only the best ``keep_fraction``
+        of them survive and the amount of evaluation data is doubled for each
+        round until a single candidate remains, the data is exhausted or the
+        evaluation budget is spent.
+
+        Parameters
+        ----------
+        batchgen : MultiThreadedAugmenter
+            Generator yielding the evaluation batches
+        n_samples : int
+            number of candidate architectures
+        keep_fraction : float
+            fraction of candidates to keep after each round
+        max_evaluations : int or None
+            maximum number of (architecture, batch) evaluations; unlimited
+            if None
+        verbose : bool
+            whether to display the surviving architectures
+
+        Returns
+        -------
+        dict
+            the best architecture
+        float
+            the accuracy of the best architecture on all the data it has been
+            evaluated on
+
+        """
+        assert 0. < keep_fraction < 1., "keep_fraction must be in (0, 1)"
+
+        self.module.eval()
+
+        with torch.no_grad():
+            arcs = [self.module("controller")["pred"]
+                    for _ in range(n_samples)]
+
+        n_correct = np.zeros(n_samples)
+        n_seen = np.zeros(n_samples)
+        survivors = np.arange(n_samples)
+
+        batches = iter(batchgen)
+        n_evaluations = 0
+        n_new_batches = 1
+        exhausted = False
+
+        while len(survivors) > 1 and not exhausted:
+            # all survivors are evaluated on the same (new) batches
+            round_batches = []
+            for _ in range(n_new_batches):
+                if max_evaluations is not None and \
+                        n_evaluations + len(survivors) > max_evaluations:
+                    exhausted = True
+                    break
+
+                try:
+                    round_batches.append(self._prepare_batch(next(batches)))
+                except StopIteration:
+                    exhausted = True
+                    break
+
+                n_evaluations += len(survivors)
+
+            for idx in survivors:
+                if not round_batches:
+                    break
+                with torch.no_grad(), self._scoring_context(arcs[idx]):
+                    for batch in round_batches:
+                        pred = self.module("shared_cnn", batch["data"],
+                                           arcs[idx])
+                        n_correct[idx] += (torch.argmax(pred["pred"], 1) ==
+                                           batch["label"]).sum().item()
+                        n_seen[idx] += batch["label"].shape[0]
+
+            if not n_seen[survivors].all():
+                break
+
+            accs = n_correct[survivors] / n_seen[survivors]
+            # each round drops at least one candidate
+            n_keep = min(len(survivors) - 1,
+                         max(1, int(np.ceil(len(survivors) * keep_fraction))))
+            if not exhausted:
+                survivors = survivors[np.argsort(-accs, kind="stable")[
+                                      :n_keep]]
+            n_new_batches *= 2
+
+            if verbose:
+                logging.info("Racing: %d candidates left after %d "
+                             "evaluations" % (len(survivors), n_evaluations))
+
+        # the race usually ends before the data is exhausted
+        batchgen._finish()
+
+        accs = n_correct[survivors] / np.maximum(n_seen[survivors], 1)
+        best_idx = survivors[int(np.argmax(accs))]
+        best_arc = arcs[best_idx]
+        best_val_acc = float(np.max(accs))
+
+        if verbose:
+            self.print_arc(best_arc)
+            print('val_acc=' + str(best_val_acc))
+            print('-' * 80)
+
+        self.module.train()
+        return best_arc, best_val_acc
+
+    def _get_best_arc_leaderboard(self, batchgen, leaderboard, num_batches=1,
+                                  epoch=None, verbose=False):
+        """
+        Re-scores the leaders of a persistent leaderboard against the current
+        weights together with a few new architectures and updates the
+        leaderboard with the results
+
+        Parameters
+        ----------
+        batchgen : MultiThreadedAugmenter
+            Generator yielding the evaluation batches
+        leaderboard : :class:`ArcLeaderboard`
+            the leaderboard
+        num_batches : int
+            number of batches, all candidates are scored on
+        epoch : int or None
+            current epoch
+        verbose : bool
+            whether to display the best architecture
+
+        Returns
+        -------
+        dict
+            the best architecture
+        float
+            the accuracy of the best architecture
+
+        """
+        self.module.eval()
+
+        with torch.no_grad():
+            new_arcs = [self.module("controller")["pred"]
+                        for _ in range(leaderboard.num_samples)]
+        arcs, epochs = leaderboard.candidates(new_arcs)
+
+        batches = []
+        for batch in batchgen:
+            if len(batches) >= num_batches:
+                break
+            batches.append(self._prepare_batch(batch))
+        batchgen._finish()
+
+        n_seen = sum(_batch["label"].shape[0] for _batch in batches)
+        accs = []
+        for arc in arcs:
+            n_correct = 0
+            with torch.no_grad(), self._scoring_context(arc):
+                for batch in batches:
+                    pred = self.module("shared_cnn", batch["data"], arc)
+                    n_correct += (torch.argmax(pred["pred"], 1) ==
+                                  batch["label"]).sum().item()
+            accs.append(n_correct / max(n_seen, 1))
+
+        leaderboard.update(arcs, accs, epochs, epoch)
+        best_arc, best_val_acc = leaderboard.best
+
+        if verbose:
+            logging.info("Leaderboard: %d of %d candidates were new" % (
+                epochs.count(None), len(arcs)))
+            self.print_arc(best_arc)
+            print('val_acc=' + str(best_val_acc))
+            print('-' * 80)
+
+        self.module.train()
+        return best_arc, best_val_acc
+
     @staticmethod
     def print_arc(sample_arc):
         """Display a sample architecture in a readable format.
@@ -460,7 +1390,9 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
 
         best_arc, _ = self.get_best_arc(
             dmgr_train_controller.get_batchgen(seed=seed),
-            n_samples=n_samples, verbose=verbose)
+            n_samples=n_samples, verbose=verbose, epoch=epoch,
+            **getattr(self, "best_arc_kwargs", {}))
+        self._last_best_arc = best_arc
 
         orig_num_aug_processes = datamgr_val.n_process_augmentation
         orig_batch_size = datamgr_val.batch_size
@@ -486,43 +1418,45 @@ class ENASTrainerPyTorch(PyTorchNetworkTrainer):
 
         batch_list = []
 
-        for i, batch in iterable:
+        # score with batchnorm statistics of the best architecture
+        with self._scoring_context(best_arc):
+            for i, batch in iterable:
 
-            if not batch_list and (n_batches - i) < batchsize:
-                batchsize = n_batches - i
-                logging.debug("Set Batchsize down to %d to avoid cutting "
-                              "of the last batches" % batchsize)
+                if not batch_list and (n_batches - i) < batchsize:
+                    batchsize = n_batches - i
+                    logging.debug("Set Batchsize down to %d to avoid cutting "
+                                  "of the last batches" % batchsize)
 
-            batch_list.append(batch)
+                batch_list.append(batch)
 
-            # if queue is full process queue:
-            if batchsize is None or len(batch_list) >= batchsize:
+                # if queue is full process queue:
+                if batchsize is None or len(batch_list) >= batchsize:
 
-                batch_dict = {}
-                for batch in batch_list:
-                    for key, val in batch.items():
-                        if key in batch_dict.keys():
-                            batch_dict[key].append(val)
-                        else:
-                            batch_dict[key] = [val]
+                    batch_dict = {}
+                    for batch in batch_list:
+                        for key, val in batch.items():
+                            if key in batch_dict.keys():
+                                batch_dict[key].append(val)
+                            else:
+                                batch_dict[key] = [val]
 
-                for key, val_list in batch_dict.items():
-                    batch_dict[key] = np.concatenate(val_list)
+                    for key, val_list in batch_dict.items():
+                        batch_dict[key] = np.concatenate(val_list)
 
-                preds = self.predict("shared_cnn", batch_dict,
-                                     sample_arc=best_arc)
+                    preds = self.predict("shared_cnn", batch_dict,
+                                         sample_arc=best_arc)
 
-                # calculate metrics for predicted batch
-                _metric_vals = self.calc_metrics({**batch_dict, **preds},
-                                                 metrics=metrics,
-                                                 metric_keys=metric_keys)
+                    # calculate metrics for predicted batch
+                    _metric_vals = self.calc_metrics({**batch_dict, **preds},
+                                                     metrics=metrics,
+                                                     metric_keys=metric_keys)
 
-                for k, v in _metric_vals.items():
-                    metric_vals[k].append(v)
+                    for k, v in _metric_vals.items():
+                        metric_vals[k].append(v)
 
-                predictions_all.append(preds)
+                    predictions_all.append(preds)
 
-                batch_list = []
+                    batch_list = []
 
         batchgen._finish()
 
@@ -1,15 +1,25 @@
-from .models import ENASModelPyTorch
-import yaml
+import typing
 import numpy as np
 import torch
+from .optim import ArcAwareSGD
 
+if typing.TYPE_CHECKING:
+    from .models.enas import ENASModelPyTorch
 
-def create_optims_enas(model: ENASModelPyTorch, optim_cls: dict,
+
+def create_optims_enas(model: "ENASModelPyTorch", optim_cls: dict,
                        **optim_params):
+    shared_cnn_cls = optim_cls["shared_cnn"]
+    if getattr(model, "child_sparse_updates", False):
+        if shared_cnn_cls is not torch.optim.SGD:
+            raise ValueError("Sparse updates of the shared network are only "
+                             "supported for SGD")
+        shared_cnn_cls = ArcAwareSGD
+
     return {
         "controller": optim_cls["controller"](
             model.controller.parameters(), **optim_params["controller"]),
-        "shared_cnn": optim_cls["shared_cnn"](
+        "shared_cnn": shared_cnn_cls(
             model.shared_cnn.parameters(), **optim_params["shared_cnn"])}
 
 
@@ -59,6 +69,8 @@ class Config(object):
             configuration dict
 
         """
+        import yaml
+
         state_dict = {}
 
         # open config file
@@ -0,0 +1,218 @@
+import logging
+import re
+
+import torch
+
+"""
+Notes
+-----
+
+Warm-starts a search from the shared weights and the controller of a
+previous search, e.g. to re-search on a slightly changed dataset or with a
+deeper network. The previous network may differ in depth, number of branches
+and width:
+
+* each layer is initialized from the layer at the same relative depth of the
+  same stage (the network's resolutions are separated by its pool layers)
+  of the previous network; the factorized reductions are mapped alike
+* tensors of different shape are initialized with their leading block (the
+  channels, which are also used at reduced width, see
+  :meth:`SharedCNN.set_fidelity`); the rest keeps its initialization
+* the controller's LSTM doesn't depend on the depth; the rows of its
+  embeddings and output layers are copied for all common branches
+
+Since the previous policy may already be quite certain, the controller's
+output layers can be scaled down (``logit_scale < 1``) to raise the entropy
+of the warm-started policy and let it explore the changed setting again.
+"""
+
+
+def _pool_layers(num_layers):
+    pool_distance = num_layers // 3
+    return [pool_distance - 1, 2 * pool_distance - 1]
+
+
+def _stage_layers(num_layers, pool_layers):
+    """
+    Splits the layer indices into the stages between the pool layers
+
+    """
+    bounds = [0] + [_layer + 1 for _layer in pool_layers] + [num_layers]
+    return [list(range(bounds[i], bounds[i + 1]))
+            for i in range(len(bounds) - 1)]
+
+
+def map_layers(num_layers_old, num_layers_new):
+    """
+    Maps each layer of a network to the layer of a previous network at the
+    same relative depth within the same stage
+
+    Parameters
+    ----------
+    num_layers_old : int
+        number of layers of the previous network
+    num_layers_new : int
+        number of layers of the new network
+
+    Returns
+    -------
+    list
+        the index of the previous layer for each new layer
+
+    """
+    stages_old = _stage_layers(num_layers_old, _pool_layers(num_layers_old))
+    stages_new = _stage_layers(num_layers_new, _pool_layers(num_layers_new))
+
+    mapping = []
+    for layers_old, layers_new in zip(stages_old, stages_new):
+        for pos in range(len(layers_new)):
+            # centers of the layers at the same relative depth
+            rel_pos = (pos + 0.5) / len(layers_new)
+            old_pos = min(int(rel_pos * len(layers_old)), len(layers_old) - 1)
+            mapping.append(layers_old[old_pos])
+
+    return mapping
+
+
+def _copy_leading(target, source):
+    """
+    Copies the leading block of ``source`` into ``target`` (in-place)
+
+    Returns
+    -------
+    str
+        ``"copied"``, ``"partial"`` (different shapes) or ``"missing"``
+        (incompatible tensors)
+
+    """
+    if target.dim() != source.dim():
+        return "missing"
+
+    block = tuple(slice(0, min(_t, _s))
+                  for _t, _s in zip(target.shape, source.shape))
+    with torch.no_grad():
+        target[block].copy_(source[block].to(target.device, target.dtype))
+    return "copied" if target.shape == source.shape else "partial"
+
+
+def _shared_cnn_key_map(num_layers_old, num_layers_new):
+    """
+    Maps the parameter key prefixes of the new :class:`SharedCNN`'s layers and
+    reductions to the previous network's
+
+    """
+    layer_map = map_layers(num_layers_old, num_layers_new)
+    prefixes = {"layers.%d." % _new: "layers.%d." % _old
+                for _new, _old in enumerate(layer_map)}
+
+    pools_old = _pool_layers(num_layers_old)
+    pools_new = _pool_layers(num_layers_new)
+    offset_old, offset_new = 0, 0
+    for pool_old, pool_new in zip(pools_old, pools_new):
+        for layer_id in range(pool_new + 1):
+            # mapped layers stay within their stage and are reduced as well
+            prefixes["pooled_layers.%d." % (offset_new + layer_id)] = \
+                "pooled_layers.%d." % (offset_old + layer_map[layer_id])
+        offset_old += pool_old + 1
+        offset_new += pool_new + 1
+
+    return prefixes
+
+
+def _num_layers(state_dict, prefix):
+    pattern = re.compile(re.escape(prefix) + r"layers\.(\d+)\.")
+    layer_ids = [int(_match.group(1)) for _match in
+                 map(pattern.match, state_dict.keys()) if _match]
+    return max(layer_ids) + 1 if layer_ids else 0
+
+
+def load_checkpoint_state(checkpoint):
+    """
+    Extracts the model's state dict from a checkpoint
+
+    Parameters
+    ----------
+    checkpoint : str or dict
+        path of a checkpoint saved by the trainer, a loaded checkpoint or a
+        state dict of an :class:`ENASModelPyTorch`
+
+    Returns
+    -------
+    dict
+        the model's state dict
+
+    """
+    if isinstance(checkpoint, str):
+        checkpoint = torch.load(checkpoint, map_location="cpu")
+
+    return checkpoint.get("model", checkpoint)
+
+
+def warm_start(model, checkpoint, shared_cnn=True, controller=True,
+               logit_scale=1.):
+    """
+    Initializes a search model from the weights of a previous search
+
+    Parameters
+    ----------
+    model : :class:`ENASModelPyTorch`
+        the model to initialize (in-place, so existing optimizers stay valid)
+    checkpoint : str or dict
+        the previous search's checkpoint (see :func:`load_checkpoint_state`)
+    shared_cnn : bool
+        whether to initialize the shared network
+    controller : bool
+        whether to initialize the controller
+    logit_scale : float
+        factor to scale the controller's output layers with; values below 1
+        raise the entropy of the initial policy
+
+    Returns
+    -------
+    dict
+        the number of initialized (``"copied"``) and partially initialized
+        (``"partial"``, i.e. different shape) tensors and the number of
+        tensors without (compatible) counterpart (``"missing"``)
+
+    """
+    if isinstance(model, torch.nn.DataParallel):
+        model = model.module
+
+    source = load_checkpoint_state(checkpoint)
+    target = model.state_dict(keep_vars=True)
+
+    key_map = {}
+    if shared_cnn:
+        prefixes = _shared_cnn_key_map(
+            _num_layers(source, "shared_cnn."),
+            model.shared_cnn.num_layers)
+        for key in target:
+            if not key.startswith("shared_cnn."):
+                continue
+            sub_key = key[len("shared_cnn."):]
+            for prefix, old_prefix in prefixes.items():
+                if sub_key.startswith(prefix):
+                    sub_key = old_prefix + sub_key[len(prefix):]
+                    break
+            key_map[key] = "shared_cnn." + sub_key
+    if controller:
+        key_map.update({_key: _key for _key in target
+                        if _key.startswith("controller.")})
+
+    stats = {"copied": 0, "partial": 0, "missing": 0}
+    for key, old_key in key_map.items():
+        if old_key not in source:
+            stats["missing"] += 1
+        else:
+            stats[_copy_leading(target[key], source[old_key])] += 1
+
+    if controller and logit_scale != 1.:
+        with torch.no_grad():
+            for name, param in model.controller.named_parameters():
+                if name.startswith(("w_soft", "v_attn")):
+                    param.mul_(logit_scale)
+
+    logging.info("Warm start: %d tensors copied, %d partially copied, %d "
+                 "without counterpart" % (stats["copied"], stats["partial"],
+                                          stats["missing"]))
+    return stats
@@ -0,0 +1,321 @@
+from denas.utils import Config
+from denas.data import create_memmap_dataset
+from denas.models import encode_arc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import itertools
+import copy
+import time
+import csv
+import os
+
+import numpy as np
+
+# environment variables limiting the threads of the numerical backends
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS",
+                   "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def expand_grid(parameters: dict):
+    """
+    Expands all combinations of the given parameter values
+
+    Parameters
+    ----------
+    parameters : dict
+        dictionary mapping ``"group.key"`` of the config to a list of values
+
+    Returns
+    -------
+    list
+        list of dicts, each mapping ``"group.key"`` to a single value
+
+    """
+    keys = sorted(parameters.keys())
+    for key in keys:
+        if not isinstance(parameters[key], (list, tuple)):
+            raise ValueError("Grid search needs a list of values for %s"
+                             % key)
+
+    return [dict(zip(keys, values)) for values in
+            itertools.product(*[parameters[key] for key in keys])]
+
+
+def sample_random(parameters: dict, num_trials: int, seed=0):
+    """
+    Samples random parameter combinations
+
+    Parameters
+    ----------
+    parameters : dict
+        dictionary mapping ``"group.key"`` of the config to either a list of
+        values (to choose from) or a dict with the keys ``min``, ``max`` and
+        optionally ``log`` (to sample (log-)uniformly from)
+    num_trials : int
+        number of combinations to sample
+    seed : int
+        random seed
+
+    Returns
+    -------
+    list
+        list of dicts, each mapping ``"group.key"`` to a single value
+
+    """
+    rng = np.random.RandomState(seed)
+    trials = []
+    for _ in range(num_trials):
+        trial = {}
+        for key in sorted(parameters.keys()):
+            space = parameters[key]
+            if isinstance(space, (list, tuple)):
+                trial[key] = space[rng.randint(len(space))]
+            elif isinstance(space, dict):
+                if space.get("log", False):
+                    trial[key] = float(np.exp(rng.uniform(
+                        np.log(space["min"]), np.log(space["max"]))))
+                else:
+                    trial[key] = float(rng.uniform(space["min"],
+                                                   space["max"]))
+            else:
+                raise ValueError("Invalid search space for %s" % key)
+        trials.append(trial)
+
+    return trials
+
+
+def apply_overrides(config: dict, overrides: dict):
+    """
+    Sets the values of ``"group.key"`` entries of a config
+
+    Parameters
+    ----------
+    config : dict
+        the (nested) config
+    overrides : dict
+        dictionary mapping ``"group.key"`` to the new value
+
+    Returns
+    -------
+    dict
+        a modified copy of the config
+
+    """
+    config = copy.deepcopy(config)
+    for name, value in overrides.items():
+        group, key = name.split(".", 1)
+        if group not in config or key not in config[group]:
+            raise KeyError("%s is not part of the config" % name)
+        config[group][key] = value
+
+    return config
+
+
+def _limit_threads(num_threads: int):
+    import torch
+    torch.set_num_threads(num_threads)
+
+
+def format_arc(sample_arc: dict):
+    """
+    Formats an architecture for the summary table
+
+    Parameters
+    ----------
+    sample_arc : dict
+        the architecture
+
+    Returns
+    -------
+    str
+        the branch ids followed by the flattened skip connections (see
+        :func:`encode_arc`) for whole-channel architectures; otherwise all
+        values of each layer, with the layers separated by ``|``
+
+    """
+    try:
+        branches, skips = encode_arc(sample_arc)
+        return " ".join(str(n) for n in branches.tolist() + skips.tolist())
+    except ValueError:
+        # channel subsets (search_whole_channels=False)
+        return " | ".join(
+            " ".join(str(int(n)) for value in sample_arc[str(layer_id)]
+                     for n in value.detach().cpu().view(-1).tolist())
+            for layer_id in range(len(sample_arc)))
+
+
+def run_trial(trial_id: int, config: dict, overrides: dict, gpu_ids: list,
+              save_root: str):
+    """
+    Runs a single search with the given overrides
+
+    Parameters
+    ----------
+    trial_id : int
+        index of the trial
+    config : dict
+        the base config
+    overrides : dict
+        dictionary mapping ``"group.key"`` to the trial's value
+    gpu_ids : list
+        gpus to use for this trial (empty for cpu)
+    save_root : str
+        directory to save the trials' outputs to
+
+    Returns
+    -------
+    dict
+        summary of the trial
+
+    """
+    config = apply_overrides(config, overrides)
+
+    # all trials read the same memory-mapped copy of the dataset
+    config["training"]["data_backend"] = "memmap"
+    config["training"]["save_path"] = os.path.join(save_root,
+                                                   "trial_%03d" % trial_id)
+
+    # imported here, since it depends on the training dependencies, which
+    # are only needed by the trials' processes
+    from train import run_from_config
+
+    summary = {"trial": trial_id, **overrides}
+    start = time.time()
+    try:
+        experiment = run_from_config(config, gpu_ids=gpu_ids)
+        trainer = experiment.trainer
+
+        summary["best_val_score"] = trainer.best_val_score
+        summary["best_arc_acc"] = trainer.best_arc_acc
+        if trainer.best_arc is not None:
+            summary["best_arc"] = format_arc(trainer.best_arc)
+        summary["status"] = "ok"
+
+    except Exception as e:
+        summary["status"] = "failed: %r" % e
+
+    summary["duration"] = time.time() - start
+    return summary
+
+
+def write_summary(summaries: list, file_path: str,
+                  val_score_mode: str = "highest"):
+    """
+    Writes the trial summaries as csv table (sorted by validation score)
+
+    Parameters
+    ----------
+    summaries : list
+        list of trial summaries
+    file_path : str
+        the csv file to write
+    val_score_mode : str
+        whether the highest or the lowest validation score is best; trials
+        without score (e.g. failed ones) come last
+
+    """
+    sign = -1. if val_score_mode == "highest" else 1.
+
+    def _sort_key(summary):
+        score = summary.get("best_val_score")
+        if score is None:
+            return (1, 0.)
+        return (0, sign * float(score))
+
+    summaries = sorted(summaries, key=_sort_key)
+
+    fieldnames = []
+    for summary in summaries:
+        for key in summary.keys():
+            if key not in fieldnames:
+                fieldnames.append(key)
+
+    with open(file_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(summaries)
+
+
+def start_sweep(sweep_config_path: str = "./sweep.config",
+                config_path: str = "./enas.config"):
+    """
+    Runs all trials of a hyperparameter sweep in a bounded process pool
+
+    Parameters
+    ----------
+    sweep_config_path : str
+        path to the sweep definition (groups ``sweep`` and ``parameters``)
+    config_path : str
+        path to the base config
+
+    Returns
+    -------
+    list
+        the trial summaries
+
+    """
+    sweep_config = Config()(sweep_config_path)
+    sweep = sweep_config["sweep"]
+    parameters = sweep_config["parameters"]
+
+    config = Config()(config_path)
+
+    if sweep.get("mode", "grid") == "grid":
+        trials = expand_grid(parameters)
+    else:
+        trials = sample_random(parameters, sweep["num_trials"],
+                               sweep.get("seed", 0))
+
+    max_workers = sweep.get("max_workers", 2)
+    threads_per_trial = sweep.get("threads_per_trial", max(
+        1, multiprocessing.cpu_count() // max_workers))
+    gpu_ids = sweep.get("gpu_ids", None) or []
+    save_root = sweep.get("save_path", "./sweep")
+    os.makedirs(save_root, exist_ok=True)
+
+    # convert the dataset once before any trial starts
+    data_path = config["training"].get("data_path",
+                                       os.path.join(os.getcwd(), "data"))
+    os.makedirs(data_path, exist_ok=True)
+    create_memmap_dataset(data_path, "cifar10", train=True)
+    create_memmap_dataset(data_path, "cifar10", train=False)
+
+    # spawned workers inherit the environment of the parent
+    for env_var in THREAD_ENV_VARS:
+        os.environ[env_var] = str(threads_per_trial)
+
+    summaries = []
+    with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_limit_threads,
+            initargs=(threads_per_trial,)) as executor:
+
+        futures = []
+        for trial_id, overrides in enumerate(trials):
+            if gpu_ids:
+                trial_gpus = [gpu_ids[trial_id % len(gpu_ids)]]
+            else:
+                trial_gpus = []
+
+            futures.append(executor.submit(run_trial, trial_id, config,
+                                           overrides, trial_gpus, save_root))
+
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            print(summary)
+
+            # keep the table up to date while the sweep is running
+            write_summary(summaries, sweep.get(
+                "output", os.path.join(save_root, "summary.csv")),
+                val_score_mode=config["training"].get("val_score_mode",
+                                                      "highest"))
+
+    return summaries
+
+
+if __name__ == '__main__':
+    SWEEP_CONFIG_PATH = "./sweep.config"
+    CONFIG_PATH = "./enas.config"
+    start_sweep(SWEEP_CONFIG_PATH, CONFIG_PATH)
@@ -0,0 +1,106 @@
+import queue
+
+import numpy as np
+import pytest
+import torch
+
+from denas.actor_learner import RewardWorkerError, RewardWorkerPool
+from denas.models.controller import Controller
+from denas.models.shared_cnn import SharedCNN
+
+"""
+Notes
+-----
+
+The workers are spawned processes, which import torch first, so all waits
+are bounded by ``TIMEOUT`` instead of hanging the test session.
+"""
+
+NUM_LAYERS = 3
+TIMEOUT = 60.
+
+
+class _DataManager(object):
+    def __init__(self, dataset, batch_size=4):
+        self.dataset = dataset
+        self.transforms = None
+        self.batch_size = batch_size
+
+
+def _prepare_batch(batch, input_device, output_device):
+    return {"data": torch.from_numpy(batch["data"]).to(input_device),
+            "label": torch.from_numpy(batch["label"]).to(output_device)}
+
+
+def _dataset(n_samples=8, n_channels=3):
+    rng = np.random.RandomState(0)
+    return [{"data": rng.rand(n_channels, 8, 8).astype(np.float32),
+             "label": np.int64(idx % 10)} for idx in range(n_samples)]
+
+
+def _arc():
+    torch.manual_seed(0)
+    with torch.no_grad():
+        return Controller(num_layers=NUM_LAYERS)()["pred"]
+
+
+def _pool(dataset, num_workers=1):
+    pool = RewardWorkerPool(SharedCNN(num_layers=NUM_LAYERS, out_filters=8),
+                            _DataManager(dataset), _prepare_batch,
+                            num_workers=num_workers)
+    pool.start()
+    return pool
+
+
+def test_results_carry_the_weights_version():
+    shared_cnn = SharedCNN(num_layers=NUM_LAYERS, out_filters=8)
+    pool = _pool(_dataset(), num_workers=2)
+    try:
+        for task_id in range(3):
+            pool.submit(task_id, _arc())
+        results = [pool.get(timeout=TIMEOUT) for _ in range(3)]
+        assert sorted(_result[0] for _result in results) == [0, 1, 2]
+        assert all(0. <= _result[1] <= 1. for _result in results)
+        assert all(_result[2] == 0 for _result in results)
+        assert pool.in_flight == 0
+
+        # the snapshot reaches the workers asynchronously
+        pool.sync_weights(shared_cnn, version=7)
+        versions = []
+        while 7 not in versions and len(versions) < 20:
+            pool.submit(0, _arc())
+            versions.append(pool.get(timeout=TIMEOUT)[2])
+        assert set(versions) <= {0, 7}
+        assert versions[-1] == 7
+    finally:
+        pool.shutdown()
+
+
+def test_get_raises_worker_failures():
+    # images with the wrong number of channels fail in the worker
+    pool = _pool(_dataset(n_channels=1))
+    try:
+        pool.submit(0, _arc())
+        with pytest.raises(RewardWorkerError, match="failed"):
+            pool.get(timeout=TIMEOUT)
+    finally:
+        pool.shutdown()
+
+
+def test_get_raises_dead_workers():
+    pool = _pool(_dataset())
+    pool._processes[0].terminate()
+    pool._processes[0].join(TIMEOUT)
+
+    pool.submit(0, _arc())
+    with pytest.raises(RewardWorkerError, match="died"):
+        pool.get(timeout=TIMEOUT, poll_interval=0.1)
+
+
+def test_get_times_out():
+    pool = _pool(_dataset())
+    try:
+        with pytest.raises(queue.Empty):
+            pool.get(timeout=0.5, poll_interval=0.1)
+    finally:
+        pool.shutdown()
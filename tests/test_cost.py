@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from denas.models.arc_utils import decode_arc
+from denas.models.cost import OpCostTable, estimate_costs
+
+NUM_LAYERS = 12
+OUT_FILTERS = 36
+
+
+def _encoded_arcs(n_arcs=16, seed=0):
+    rng = np.random.RandomState(seed)
+    branches = rng.randint(0, 6, (n_arcs, NUM_LAYERS))
+    skips = rng.randint(0, 2, (n_arcs, NUM_LAYERS * (NUM_LAYERS - 1) // 2))
+    return branches, skips.astype(np.float64)
+
+
+@pytest.mark.parametrize("fixed", [True, False])
+def test_table_matches_estimate(fixed):
+    branches, skips = _encoded_arcs()
+    table = OpCostTable.from_flops(NUM_LAYERS, OUT_FILTERS, fixed=fixed)
+
+    flops = [table.arc_cost(decode_arc(_branches, _skips))
+             for _branches, _skips in zip(branches, skips)]
+
+    np.testing.assert_allclose(
+        flops, estimate_costs(branches, skips, OUT_FILTERS,
+                              fixed=fixed)["flops"])
+
+
+def test_final_network_costs_more_than_the_searched():
+    branches, skips = _encoded_arcs()
+
+    fixed = estimate_costs(branches, skips, OUT_FILTERS, fixed=True)
+    searched = estimate_costs(branches, skips, OUT_FILTERS, fixed=False)
+
+    # doubled filters after each reduction and concatenated skips
+    for key in ("params", "flops", "activations"):
+        assert (fixed[key] > searched[key]).all()
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from denas.data import BatchAugmentation, MemmapBatchGenerator, MemmapDataset
+
+SEED = 3
+
+
+def _images(n_samples=16, n_channels=3, size=8, seed=0):
+    return np.random.RandomState(seed).randint(
+        0, 256, (n_samples, n_channels, size, size)).astype(np.uint8)
+
+
+def _augment_per_sample(data, pad_size, crop_size, mirror, seed):
+    """
+    Pads, crops and mirrors one sample after the other, drawing the same
+    random numbers as :class:`BatchAugmentation`
+
+    """
+    rng = np.random.RandomState(seed)
+    n_samples = len(data)
+    offsets_h = rng.randint(0, pad_size[0] - crop_size[0] + 1, n_samples)
+    offsets_w = rng.randint(0, pad_size[1] - crop_size[1] + 1, n_samples)
+    if mirror:
+        flips = rng.rand(n_samples) < 0.5
+    else:
+        flips = np.zeros(n_samples, dtype=bool)
+
+    samples = []
+    for sample, offset_h, offset_w, flip in zip(data, offsets_h, offsets_w,
+                                                flips):
+        padded = np.zeros((sample.shape[0],) + tuple(pad_size), np.uint8)
+        top = (pad_size[0] - sample.shape[1]) // 2
+        left = (pad_size[1] - sample.shape[2]) // 2
+        padded[:, top: top + sample.shape[1],
+               left: left + sample.shape[2]] = sample
+
+        crop = padded[:, offset_h: offset_h + crop_size[0],
+                      offset_w: offset_w + crop_size[1]]
+        if flip:
+            crop = crop[:, :, ::-1]
+        samples.append(crop)
+
+    return np.stack(samples)
+
+
+@pytest.mark.parametrize("pad_size,crop_size,mirror", [
+    ((12, 12), (8, 8), True),
+    ((12, 12), (8, 8), False),
+    # odd padding and non-square crops
+    ((11, 13), (6, 9), True),
+])
+def test_batch_augmentation_matches_per_sample(pad_size, crop_size, mirror):
+    data = _images()
+
+    augmented = BatchAugmentation(pad_size, crop_size, mirror, seed=SEED)(
+        data=data, label=np.zeros((len(data), 1)))
+
+    assert augmented["data"].dtype == np.uint8
+    np.testing.assert_array_equal(
+        augmented["data"],
+        _augment_per_sample(data, pad_size, crop_size, mirror, SEED))
+
+
+def _dataset(tmp_path, n_samples=10):
+    np.save(str(tmp_path / "data.npy"), _images(n_samples))
+    np.save(str(tmp_path / "labels.npy"), np.arange(n_samples))
+    return MemmapDataset(str(tmp_path / "data.npy"),
+                         str(tmp_path / "labels.npy"))
+
+
+def test_batch_generator_covers_the_dataset(tmp_path):
+    dataset = _dataset(tmp_path)
+    batchgen = MemmapBatchGenerator(dataset, batch_size=4, seed=SEED)
+
+    batches = list(batchgen)
+
+    assert batchgen.num_batches == len(batches) == 3
+    labels = np.concatenate([_batch["label"][:, 0] for _batch in batches])
+    np.testing.assert_array_equal(np.sort(labels), np.arange(10))
+    for batch in batches:
+        np.testing.assert_array_equal(batch["data"],
+                                      dataset.data[batch["label"][:, 0]])
+
+
+def test_batch_generator_raises_loader_errors(tmp_path):
+    def _failing_transform(**batch):
+        raise KeyError("broken transform")
+
+    batchgen = MemmapBatchGenerator(_dataset(tmp_path), batch_size=4,
+                                    transforms=_failing_transform)
+
+    with pytest.raises(KeyError):
+        list(batchgen)
+    assert batchgen._thread is None
@@ -0,0 +1,86 @@
+import pytest
+import torch
+
+pytest.importorskip("delira")
+
+from denas.models.enas import ENASModelPyTorch  # noqa: E402
+
+BATCH_SIZE = 256
+NUM_CLASSES = 10
+
+
+class _FakeModel(object):
+    """
+    Predicts the labels stored in the inputs, flipping every
+    ``wrong_every``-th prediction, and counts the predicted samples
+
+    """
+
+    def __init__(self, min_samples=None, max_samples=None, baseline=None,
+                 wrong_every=None, tolerance=0.):
+        self.controller_reward_min_samples = min_samples
+        self.controller_reward_max_samples = max_samples
+        self.controller_reward_confidence = 0.95
+        self.controller_reward_tolerance = tolerance
+        self.baseline = baseline
+        self.controller_entropy_weight = 0.
+        self.controller = type("_Controller", (), {"sample_entropy": 0.})()
+        self.wrong_every = wrong_every
+        self.num_predicted = 0
+
+    def __call__(self, model_name, inputs, sample_arc):
+        labels = inputs[:, 0].long()
+        if self.wrong_every is not None:
+            offsets = torch.arange(self.num_predicted,
+                                   self.num_predicted + len(labels))
+            labels = torch.where(offsets % self.wrong_every == 0,
+                                 (labels + 1) % NUM_CLASSES, labels)
+        self.num_predicted += len(labels)
+        return {"pred": torch.nn.functional.one_hot(labels, NUM_CLASSES
+                                                    ).float()}
+
+
+def _batch():
+    labels = torch.arange(BATCH_SIZE) % NUM_CLASSES
+    return labels.float()[:, None], labels
+
+
+def _num_evaluated(model):
+    inputs, labels = _batch()
+    preds, num_samples = ENASModelPyTorch._reward_predictions(
+        model, inputs, labels, {}, 1.)
+    assert len(preds["pred"]) == num_samples == model.num_predicted
+    return num_samples
+
+
+def test_whole_batch_without_limits():
+    assert _num_evaluated(_FakeModel()) == BATCH_SIZE
+
+
+def test_max_samples_without_min_samples():
+    assert _num_evaluated(_FakeModel(max_samples=100)) == 100
+
+
+def test_stops_once_the_baseline_is_excluded():
+    # perfect accuracy is far above the baseline
+    assert _num_evaluated(_FakeModel(min_samples=16, baseline=0.2)) == 16
+
+
+def test_doubles_while_the_baseline_is_plausible():
+    # 50 % accuracy stays within the interval around a baseline of 0.5
+    model = _FakeModel(min_samples=16, max_samples=200, baseline=0.5,
+                       wrong_every=2)
+    assert _num_evaluated(model) == 200
+
+
+def test_stops_at_the_tolerance():
+    # the interval around 50 % accuracy narrows below 0.1 at 128 samples
+    model = _FakeModel(min_samples=16, baseline=0.5, wrong_every=2,
+                       tolerance=0.1)
+    assert _num_evaluated(model) == 128
+
+
+def test_min_samples_must_not_exceed_max_samples():
+    with pytest.raises(ValueError):
+        ENASModelPyTorch(controller_reward_min_samples=64,
+                         controller_reward_max_samples=32)
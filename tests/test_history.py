@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+import torch
+
+from denas.history import ArcHistory
+from denas.models.arc_utils import encode_arc
+from denas.models.controller import Controller
+
+NUM_LAYERS = 6
+
+
+def _arcs(num_arcs, seed=0):
+    torch.manual_seed(seed)
+    controller = Controller(num_layers=NUM_LAYERS)
+    with torch.no_grad():
+        return [controller()["pred"] for _ in range(num_arcs)]
+
+
+def _assert_same_arc(sample_arc, expected):
+    for value, expected_value in zip(encode_arc(sample_arc, NUM_LAYERS),
+                                     encode_arc(expected, NUM_LAYERS)):
+        np.testing.assert_array_equal(value, expected_value)
+
+
+def _fill(history, sample_arcs, epoch=0):
+    for step, sample_arc in enumerate(sample_arcs):
+        history.append(sample_arc, reward=step / 10., log_prob=-step,
+                       entropy=2. * step, epoch=epoch, step=step)
+    history.flush()
+
+
+def test_round_trip(tmp_path):
+    sample_arcs = _arcs(10)
+    # smaller than the number of records to grow the file
+    history = ArcHistory(str(tmp_path / "history.bin"), NUM_LAYERS,
+                         initial_capacity=4)
+    _fill(history, sample_arcs, epoch=3)
+
+    records = history.records
+    assert len(history) == len(records) == len(sample_arcs)
+    np.testing.assert_array_equal(records["step"], np.arange(10))
+    np.testing.assert_allclose(records["reward"], np.arange(10) / 10.,
+                               rtol=1e-6)
+    np.testing.assert_array_equal(records["log_prob"], -np.arange(10))
+    np.testing.assert_array_equal(records["entropy"], 2. * np.arange(10))
+    assert (records["epoch"] == 3).all()
+    for record, sample_arc in zip(records, sample_arcs):
+        _assert_same_arc(history.decode(record), sample_arc)
+
+    history.close()
+
+
+def test_resume(tmp_path):
+    file_path = str(tmp_path / "history.bin")
+    sample_arcs = _arcs(7)
+    history = ArcHistory(file_path, NUM_LAYERS, initial_capacity=4)
+    _fill(history, sample_arcs[:5])
+    history.close()
+
+    # the number of layers is read from the header
+    history = ArcHistory(file_path)
+    assert history.num_layers == NUM_LAYERS
+    assert len(history) == 5
+    _fill(history, sample_arcs[5:], epoch=1)
+    history.close()
+
+    history = ArcHistory(file_path, NUM_LAYERS)
+    assert len(history) == 7
+    np.testing.assert_array_equal(history.records["epoch"],
+                                  [0] * 5 + [1] * 2)
+    for record, sample_arc in zip(history.records, sample_arcs):
+        _assert_same_arc(history.decode(record), sample_arc)
+    history.close()
+
+
+def test_invalid_files(tmp_path):
+    file_path = str(tmp_path / "history.bin")
+    with pytest.raises(ValueError):
+        ArcHistory(file_path)
+
+    ArcHistory(file_path, NUM_LAYERS).close()
+    with pytest.raises(ValueError):
+        ArcHistory(file_path, NUM_LAYERS + 1)
+
+    other_path = str(tmp_path / "other.bin")
+    with open(other_path, "wb") as f:
+        f.write(b"\0" * 64)
+    with pytest.raises(ValueError):
+        ArcHistory(other_path)
+
+
+def test_analysis(tmp_path):
+    history = ArcHistory(str(tmp_path / "history.bin"), NUM_LAYERS)
+    _fill(history, _arcs(6), epoch=0)
+    _fill(history, _arcs(4, seed=1), epoch=1)
+
+    np.testing.assert_array_equal(history.top_k(3)["reward"],
+                                  np.float32([0.5, 0.4, 0.3]))
+    frequencies = history.branch_frequencies()
+    assert frequencies.shape == (NUM_LAYERS, 6)
+    np.testing.assert_allclose(frequencies.sum(1), 1.)
+
+    epochs, mean_rewards, max_rewards = history.reward_by_epoch()
+    np.testing.assert_array_equal(epochs, [0, 1])
+    np.testing.assert_allclose(mean_rewards, [0.25, 0.15], rtol=1e-6)
+    np.testing.assert_allclose(max_rewards, [0.5, 0.3], rtol=1e-6)
+    history.close()
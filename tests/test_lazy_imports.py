@@ -0,0 +1,61 @@
+import json
+import os
+import subprocess
+import sys
+
+"""
+Notes
+-----
+
+The public names of :mod:`denas` are resolved lazily, so that using only the
+networks neither imports the training dependencies nor pays for their import
+time. The imports are checked in a fresh interpreter, since the modules of
+the test session may already be loaded.
+"""
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# dependencies of the training code only
+HEAVY_MODULES = ("delira", "batchgenerators", "tqdm", "yaml")
+
+# time to import denas and resolve SharedCNN, once torch and numpy are loaded
+MAX_IMPORT_SECONDS = 0.5
+
+_SCRIPT = """
+import json
+import sys
+import time
+
+import numpy
+import torch
+
+start = time.perf_counter()
+import denas
+denas.SharedCNN
+duration = time.perf_counter() - start
+
+print(json.dumps({"duration": duration,
+                  "modules": sorted(set(_name.split(".")[0]
+                                        for _name in sys.modules))}))
+"""
+
+
+def _run_import():
+    output = subprocess.check_output([sys.executable, "-c", _SCRIPT],
+                                     cwd=REPO_ROOT)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def test_shared_cnn_import_skips_training_dependencies():
+    result = _run_import()
+
+    loaded = [_name for _name in HEAVY_MODULES
+              if _name in result["modules"]]
+    assert not loaded, "importing denas.SharedCNN loaded %s" % loaded
+
+
+def test_shared_cnn_import_time():
+    result = _run_import()
+
+    assert result["duration"] < MAX_IMPORT_SECONDS, \
+        "importing denas.SharedCNN took %.2f s" % result["duration"]
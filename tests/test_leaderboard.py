@@ -0,0 +1,65 @@
+import torch
+
+from denas.leaderboard import ArcLeaderboard
+
+
+def _arc(arc_id):
+    return {"0": [torch.tensor([arc_id])],
+            "1": [torch.tensor([0]), torch.tensor([1])]}
+
+
+def _ids(arcs):
+    return [int(_arc["0"][0]) for _arc in arcs]
+
+
+def test_candidates_skip_duplicates():
+    leaderboard = ArcLeaderboard(size=3)
+    leaderboard.update([_arc(0), _arc(1)], [0.5, 0.6], [None, None], epoch=0)
+
+    arcs, epochs = leaderboard.candidates([_arc(1), _arc(2), _arc(2)])
+
+    assert _ids(arcs) == [1, 0, 2]
+    assert epochs == [0, 0, None]
+
+
+def test_update_keeps_the_best_in_descending_order():
+    leaderboard = ArcLeaderboard(size=3)
+    leaderboard.update([_arc(_idx) for _idx in range(3)], [0.2, 0.4, 0.3],
+                       [None] * 3, epoch=0)
+
+    # re-scored leaders and new architectures
+    scores = {0: 0.1, 1: 0.5, 2: 0.3, 3: 0.45, 4: 0.05}
+    arcs, epochs = leaderboard.candidates([_arc(3), _arc(4)])
+    leaderboard.update(arcs, [scores[_idx] for _idx in _ids(arcs)], epochs,
+                       epoch=1)
+
+    assert _ids(_entry["arc"] for _entry in leaderboard.entries) == [1, 3, 2]
+    assert [_entry["score"] for _entry in leaderboard.entries] == \
+        [0.5, 0.45, 0.3]
+    # leaders keep the epoch they entered the leaderboard
+    assert [_entry["epoch"] for _entry in leaderboard.entries] == [0, 1, 0]
+    assert _ids([leaderboard.best[0]]) == [1]
+    assert leaderboard.best[1] == 0.5
+
+
+def test_update_keeps_older_leaders_on_ties():
+    leaderboard = ArcLeaderboard(size=1)
+    leaderboard.update([_arc(0)], [0.5], [None], epoch=0)
+
+    arcs, epochs = leaderboard.candidates([_arc(1)])
+    leaderboard.update(arcs, [0.5, 0.5], epochs, epoch=1)
+
+    assert _ids([leaderboard.best[0]]) == [0]
+
+
+def test_num_samples_fills_the_leaderboard():
+    leaderboard = ArcLeaderboard(size=5, num_new=2)
+    assert leaderboard.best == (None, None)
+    assert leaderboard.num_samples == 5
+
+    leaderboard.update([_arc(0), _arc(1)], [0.1, 0.2], [None, None], epoch=0)
+    assert leaderboard.num_samples == 3
+
+    arcs, epochs = leaderboard.candidates([_arc(_idx) for _idx in range(2, 5)])
+    leaderboard.update(arcs, [0.1] * 5, epochs, epoch=1)
+    assert leaderboard.num_samples == 2
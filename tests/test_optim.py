@@ -0,0 +1,89 @@
+import pytest
+import torch
+
+from denas.optim import ArcAwareSGD
+
+# parameter 1 is skipped in 2 of 3 steps, parameter 2 in every other step
+ACTIVE = [(0, 1, 2), (0,), (0, 2), (0,), (0, 1, 2), (0,), (0, 2), (0,)]
+
+
+def _params(seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return [torch.nn.Parameter(torch.randn(4, 3, generator=generator,
+                                           dtype=torch.float64))
+            for _ in range(3)]
+
+
+def _loss(params, active, step):
+    # non-linear in the parameters, so that stale weights change the grads
+    return sum(((step + 1) * params[_idx] ** 2).sin().sum() for _idx in active)
+
+
+@pytest.mark.parametrize("momentum,nesterov,weight_decay", [
+    (0., False, 1e-2),
+    (0.9, False, 1e-2),
+    (0.9, True, 1e-2),
+    (0.9, True, 0.),
+])
+def test_matches_dense_sgd(momentum, nesterov, weight_decay):
+    dense_params, sparse_params = _params(), _params()
+    kwargs = {"lr": 0.1, "momentum": momentum, "nesterov": nesterov,
+              "weight_decay": weight_decay}
+    dense = torch.optim.SGD(dense_params, **kwargs)
+    sparse = ArcAwareSGD(sparse_params, **kwargs)
+
+    for step, active in enumerate(ACTIVE):
+        # changing learning rates (e.g. by a scheduler)
+        for optim in (dense, sparse):
+            optim.param_groups[0]["lr"] = 0.1 / (step + 1)
+
+        # unused parameters have zero gradients in dense SGD
+        for param in dense_params:
+            param.grad = torch.zeros_like(param)
+        _loss(dense_params, active, step).backward()
+        dense.step()
+
+        active_params = [sparse_params[_idx] for _idx in active]
+        sparse.catch_up(active_params)
+        for param in active_params:
+            param.grad = None
+        _loss(sparse_params, active, step).backward()
+
+        for idx in active:
+            torch.testing.assert_close(sparse_params[idx].grad,
+                                       dense_params[idx].grad)
+
+        sparse.step(active_params=active_params)
+
+    sparse.flush()
+    for dense_param, sparse_param in zip(dense_params, sparse_params):
+        torch.testing.assert_close(sparse_param, dense_param)
+
+
+def test_closure_catches_up_before_the_loss():
+    dense_params, sparse_params = _params(), _params()
+    kwargs = {"lr": 0.1, "momentum": 0.9, "weight_decay": 1e-2}
+    dense = torch.optim.SGD(dense_params, **kwargs)
+    sparse = ArcAwareSGD(sparse_params, **kwargs)
+
+    for step, active in enumerate(ACTIVE):
+        for param in dense_params:
+            param.grad = torch.zeros_like(param)
+        dense_loss = _loss(dense_params, active, step)
+        dense_loss.backward()
+        dense.step()
+
+        def _closure():
+            for param in sparse_params:
+                param.grad = None
+            loss = _loss(sparse_params, active, step)
+            loss.backward()
+            return loss
+
+        sparse_loss = sparse.step(
+            _closure, active_params=[sparse_params[_idx] for _idx in active])
+        torch.testing.assert_close(sparse_loss, dense_loss)
+
+    sparse.flush()
+    for dense_param, sparse_param in zip(dense_params, sparse_params):
+        torch.testing.assert_close(sparse_param, dense_param)
@@ -0,0 +1,57 @@
+import pytest
+
+from denas.replay import ArcReplayBuffer
+
+
+def _buffer(versions, **kwargs):
+    buffer = ArcReplayBuffer(**kwargs)
+    for idx, version in enumerate(versions):
+        buffer.add({"id": idx}, accuracy=idx / 10., behaviour_log_prob=-idx,
+                   version=version)
+    return buffer
+
+
+def _ids(entries):
+    return [_entry.sample_arc["id"] for _entry in entries]
+
+
+@pytest.mark.parametrize("max_staleness,version,expected", [
+    # only the current phase's architectures
+    (0, 2, [3, 4]),
+    (1, 2, [1, 2, 3, 4]),
+    (2, 2, [0, 1, 2, 3, 4]),
+    (0, 3, []),
+])
+def test_prune_discards_stale_entries(max_staleness, version, expected):
+    buffer = _buffer([0, 1, 1, 2, 2], max_staleness=max_staleness)
+
+    buffer.prune(version)
+
+    assert _ids(buffer._entries) == expected
+
+
+def test_capacity_drops_the_oldest():
+    buffer = _buffer(range(5), capacity=3, max_staleness=10)
+
+    assert len(buffer) == 3
+    assert _ids(buffer._entries) == [2, 3, 4]
+
+
+def test_sample_draws_fresh_entries():
+    buffer = _buffer([0, 0, 1, 1], num_replays=20, seed=0)
+
+    entries = buffer.sample(version=1)
+
+    assert len(entries) == 20
+    assert set(_ids(entries)) == {2, 3}
+    assert entries[0].accuracy == entries[0].sample_arc["id"] / 10.
+    assert entries[0].behaviour_log_prob == -entries[0].sample_arc["id"]
+    assert buffer.sample(version=2) == []
+    assert len(buffer) == 0
+
+
+def test_sample_is_seeded():
+    first = _ids(_buffer(range(5), max_staleness=5, seed=1).sample(5))
+    second = _ids(_buffer(range(5), max_staleness=5, seed=1).sample(5))
+
+    assert first == second
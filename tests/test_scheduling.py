@@ -0,0 +1,124 @@
+import pytest
+import torch
+
+from denas.scheduling import FidelitySchedule, PhaseScheduler, SearchBudget
+
+
+class _FixedController(object):
+    """
+    Controller always sampling the same architecture, i.e. with a converged
+    policy
+
+    """
+
+    num_layers = 2
+    num_branches = 6
+    search_whole_channels = True
+
+    def __init__(self):
+        self.sample_entropy = torch.tensor(0.)
+
+    def __call__(self):
+        return {"pred": {"0": [torch.tensor([1])],
+                         "1": [torch.tensor([2]), torch.tensor([1])]}}
+
+
+def _controller_steps(scheduler, num_epochs, num_steps=20):
+    controller, steps = _FixedController(), []
+    for _ in range(num_epochs):
+        scheduler.update(controller)
+        steps.append(scheduler.num_controller_steps(num_steps))
+    return steps
+
+
+def test_converged_phases_shrink_to_skipping():
+    scheduler = PhaseScheduler(min_fraction=0., patience=None, min_epochs=1,
+                               num_samples=4)
+
+    # less than a single step would be left after 1/32 of the phase
+    assert _controller_steps(scheduler, 8) == [20, 10, 5, 3, 2, 0, 0, 0]
+
+
+def test_converged_phases_shrink_to_min_fraction():
+    scheduler = PhaseScheduler(min_fraction=0.1, patience=None, min_epochs=1,
+                               num_samples=4)
+
+    assert _controller_steps(scheduler, 6) == [20, 10, 5, 3, 2, 2]
+
+
+def test_phases_are_kept_before_min_epochs():
+    scheduler = PhaseScheduler(min_fraction=0., patience=None, min_epochs=3,
+                               num_samples=4)
+
+    assert _controller_steps(scheduler, 4) == [20, 20, 10, 5]
+
+
+def test_stops_once_the_best_arc_is_stable():
+    scheduler = PhaseScheduler(patience=2, min_epochs=1, num_samples=4)
+    controller = _FixedController()
+    best_arc = controller()["pred"]
+
+    stops = []
+    for _ in range(4):
+        scheduler.update(controller, best_arc=best_arc)
+        stops.append(scheduler.stop)
+    assert stops == [False, False, True, True]
+
+
+def _flop_budget(total=1000., safety_margin=0.1, spent=0.):
+    budget = SearchBudget(flops=total, safety_margin=safety_margin)
+    budget.start()
+    budget.charge(spent)
+    return budget
+
+
+def test_budget_needs_exactly_one_unit():
+    with pytest.raises(ValueError):
+        SearchBudget()
+    with pytest.raises(ValueError):
+        SearchBudget(seconds=10., flops=1e9)
+
+
+@pytest.mark.parametrize("spent,epoch_cost,final_cost,expected", [
+    # 900 of 1000 FLOPs are usable without the safety margin
+    (0., 100., 0., 9),
+    (0., 100., 250., 6),
+    (450., 100., 0., 4),
+    (0., 1000., 0., 0),
+    # overspent budgets don't plan negative epochs
+    (1000., 100., 0., 0),
+    (0., 100., 1000., 0),
+])
+def test_epochs_left(spent, epoch_cost, final_cost, expected):
+    budget = _flop_budget(spent=spent)
+
+    assert budget.epochs_left(epoch_cost, final_cost) == expected
+
+
+def test_epochs_left_of_free_epochs():
+    # zero-cost epochs (e.g. no steps at all) must not divide by zero
+    assert _flop_budget().epochs_left(0.) > 1e6
+
+
+def test_flop_costs_count_backward_passes_twice():
+    budget = _flop_budget()
+
+    assert budget.cost(5., forward_samples=2, training_samples=3,
+                       flops_per_sample=10.) == (2 + 3 * 3) * 10.
+    assert SearchBudget(seconds=60.).cost(5., forward_samples=2) == 5.
+
+
+def test_fidelity_milestones():
+    # unsorted milestones, the last one restores the full width
+    schedule = FidelitySchedule([
+        {"epoch": 10, "resolution": 24},
+        {"epoch": 2, "resolution": 16, "width": 12},
+        {"epoch": 20}])
+
+    fidelities = [schedule.fidelity(_epoch) for _epoch in (0, 2, 9, 10, 25)]
+
+    assert fidelities == [{"resolution": None, "width": None},
+                          {"resolution": 16, "width": 12},
+                          {"resolution": 16, "width": 12},
+                          {"resolution": 24, "width": None},
+                          {"resolution": None, "width": None}]
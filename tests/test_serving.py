@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from denas.serving import BatchingServer, ServerOverloadedError
+
+# generous bound for each test, whose server used to hang on stopping
+TIMEOUT = 10.
+
+
+def _run(coroutine):
+    """
+    Runs a coroutine in its own event loop and thread, so that a hanging
+    server fails the test instead of blocking it (a swallowed cancellation
+    also blocks ``asyncio.wait_for``)
+
+    """
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(asyncio.run(coroutine)), daemon=True)
+    thread.start()
+    thread.join(TIMEOUT)
+    if thread.is_alive():
+        pytest.fail("the server didn't stop within %d s" % TIMEOUT)
+    assert results, "the coroutine failed"
+    return results[0]
+
+
+class _SumPredictor(object):
+    """
+    Predicts the sum of each sample, optionally blocking until released
+
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.release.set()
+        self.batch_sizes = []
+
+    def predict_data(self, data):
+        self.release.wait()
+        self.batch_sizes.append(len(data["data"]))
+        return {"pred": data["data"].reshape(len(data["data"]), -1).sum(-1)}
+
+
+def _sample(value):
+    return {"data": np.full((2, 2), value, dtype=np.float32)}
+
+
+def test_predicts_data_only_requests():
+    async def _run_server():
+        predictor = _SumPredictor()
+        server = BatchingServer(predictor, max_batch_size=4, max_wait_ms=20)
+        await server.start()
+        preds = await asyncio.gather(*[server.predict(_sample(_val))
+                                       for _val in range(10)])
+        await server.stop()
+        return predictor, preds
+
+    predictor, preds = _run(_run_server())
+
+    assert [float(_pred["pred"]) for _pred in preds] == \
+        [4. * _val for _val in range(10)]
+    assert max(predictor.batch_sizes) <= 4
+    assert sum(predictor.batch_sizes) == 10
+
+
+def test_stop_after_rejected_requests():
+    async def _run_server():
+        predictor = _SumPredictor()
+        predictor.release.clear()
+        server = BatchingServer(predictor, max_batch_size=1, max_wait_ms=1,
+                                max_queue_size=2)
+        await server.start()
+
+        # the first request blocks the worker, two more fill the queue
+        requests = [asyncio.ensure_future(server.predict(_sample(0)))]
+        await asyncio.sleep(0.05)
+        requests += [asyncio.ensure_future(server.predict(_sample(_val)))
+                     for _val in range(1, 3)]
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(ServerOverloadedError):
+            await server.predict(_sample(3))
+
+        predictor.release.set()
+        await server.stop()
+        return server, await asyncio.gather(*requests,
+                                            return_exceptions=True)
+
+    server, results = _run(_run_server())
+
+    assert server.num_rejected == 1
+    # the batch in progress is finished, the queued requests are failed
+    assert float(results[0]["pred"]) == 0.
+    assert all(isinstance(_result, RuntimeError) for _result in results[1:])
+
+
+def test_stop_while_idle():
+    async def _run_server():
+        server = BatchingServer(_SumPredictor(), max_wait_ms=1)
+        await server.start()
+        await asyncio.sleep(0.05)
+        await server.stop()
+
+    _run(_run_server())
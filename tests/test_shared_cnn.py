@@ -0,0 +1,167 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from denas.models.controller import Controller
+from denas.models.shared_cnn import FactorizedReduction, SharedCNN, \
+    _fused_factorized_reduction
+
+NUM_LAYERS = 6
+OUT_FILTERS = 16
+
+
+def _arcs(num_arcs=3, seed=0):
+    torch.manual_seed(seed)
+    controller = Controller(num_layers=NUM_LAYERS, out_filters=OUT_FILTERS)
+    with torch.no_grad():
+        return [controller()["pred"] for _ in range(num_arcs)]
+
+
+def _network(out_filters=OUT_FILTERS, seed=0, **kwargs):
+    torch.manual_seed(seed)
+    return SharedCNN(num_layers=NUM_LAYERS, out_filters=out_filters,
+                     **kwargs).double().eval()
+
+
+def _inputs(batch_size=4, input_size=32, channels=3, seed=1):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randn(batch_size, channels, input_size, input_size,
+                       generator=generator, dtype=torch.float64)
+
+
+def _features(network, x, sample_arc):
+    """
+    Output of the last layer; the predictions don't depend on the inputs,
+    since the last layer's instance norm leaves nothing to the global
+    average pooling
+
+    """
+    features = []
+    handle = network.layers[-1].register_forward_hook(
+        lambda _module, _inputs, _output: features.append(_output))
+    try:
+        network(x, sample_arc)
+    finally:
+        handle.remove()
+    return features[0]
+
+
+def _leading_channels(full, reduced):
+    """
+    Loads the leading channels of each weight of ``full`` into ``reduced``
+
+    """
+    full_state = full.state_dict()
+    reduced.load_state_dict({
+        _key: full_state[_key][tuple(slice(0, _size)
+                                     for _size in _value.shape)]
+        for _key, _value in reduced.state_dict().items()})
+    return reduced
+
+
+@pytest.mark.parametrize("input_size", [8, 7])
+@pytest.mark.parametrize("out_planes", [OUT_FILTERS, 2 * OUT_FILTERS])
+def test_fused_reduction_matches_single_reductions(input_size, out_planes):
+    torch.manual_seed(0)
+    reductions = [FactorizedReduction(OUT_FILTERS, out_planes).double()
+                  for _ in range(3)]
+    inputs = [_inputs(input_size=input_size, channels=OUT_FILTERS,
+                      seed=_seed) for _seed in range(3)]
+
+    with torch.no_grad():
+        fused = _fused_factorized_reduction(reductions, inputs)
+        for reduction, x, out in zip(reductions, inputs, fused):
+            torch.testing.assert_close(out, reduction(x))
+
+
+@pytest.mark.parametrize("fixed", [False, True])
+def test_fused_network_matches_unfused(fixed):
+    x = _inputs()
+
+    for sample_arc in _arcs():
+        kwargs = {"fixed_arc": sample_arc} if fixed else {}
+        fused = _network(fuse_reductions=True, **kwargs)
+        unfused = _network(fuse_reductions=False, **kwargs)
+        unfused.load_state_dict(fused.state_dict())
+
+        with torch.no_grad():
+            torch.testing.assert_close(_features(fused, x, sample_arc),
+                                       _features(unfused, x, sample_arc))
+
+
+def _batch_norm_state(network):
+    return {_key: _value.clone() for _key, _value in
+            network.state_dict().items()
+            if _key.rsplit(".", 1)[-1] in ("running_mean", "running_var",
+                                             "num_batches_tracked")}
+
+
+def _train_statistics(network, seed):
+    network.train()
+    with torch.no_grad():
+        for sample_arc in _arcs(seed=seed):
+            network(_inputs(seed=seed), sample_arc)
+    network.eval()
+    return network
+
+
+def test_recalibration_ignores_the_shared_statistics():
+    # same weights, but statistics collected on different architectures
+    first = _train_statistics(_network(), seed=2)
+    second = _train_statistics(_network(), seed=3)
+    sample_arc = _arcs(1)[0]
+    batches = [_inputs(seed=_seed) for _seed in range(4, 6)]
+    x = _inputs()
+
+    with torch.no_grad(), \
+            first.recalibrated_batch_norm(sample_arc, batches), \
+            second.recalibrated_batch_norm(sample_arc, batches):
+        assert not first.training
+        torch.testing.assert_close(_features(first, x, sample_arc),
+                                   _features(second, x, sample_arc))
+
+
+def test_recalibration_restores_the_shared_statistics():
+    network = _train_statistics(_network(), seed=2)
+    network.train()
+    expected = _batch_norm_state(network)
+
+    with pytest.raises(RuntimeError):
+        with network.recalibrated_batch_norm(_arcs(1)[0], [_inputs()]):
+            raise RuntimeError()
+
+    assert network.training
+    for key, value in _batch_norm_state(network).items():
+        torch.testing.assert_close(value, expected[key])
+
+
+def test_reduced_fidelity_matches_a_smaller_network():
+    full = _network()
+    reduced = _leading_channels(full, _network(OUT_FILTERS // 2))
+    full.set_fidelity(resolution=16, width=OUT_FILTERS // 2)
+    x = _inputs()
+
+    with torch.no_grad():
+        for sample_arc in _arcs():
+            torch.testing.assert_close(
+                _features(full, x, sample_arc),
+                _features(reduced, F.adaptive_avg_pool2d(x, 16), sample_arc))
+
+
+def test_full_fidelity_is_restored():
+    network = _network()
+    x = _inputs()
+    sample_arc = _arcs(1)[0]
+
+    with torch.no_grad():
+        expected = _features(network, x, sample_arc)
+        network.set_fidelity(resolution=16, width=OUT_FILTERS // 2)
+        network.set_fidelity()
+        torch.testing.assert_close(_features(network, x, sample_arc),
+                                   expected)
+
+
+@pytest.mark.parametrize("width", [0, 7, 2 * OUT_FILTERS])
+def test_invalid_width(width):
+    with pytest.raises(ValueError):
+        _network().set_fidelity(width=width)
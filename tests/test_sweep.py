@@ -0,0 +1,30 @@
+import csv
+
+from sweep import write_summary
+
+
+def _read_trials(file_path):
+    with open(file_path, newline="") as f:
+        return [int(_row["trial"]) for _row in csv.DictReader(f)]
+
+
+def _summaries():
+    return [{"trial": 0, "best_val_score": 0.5, "status": "ok"},
+            {"trial": 1, "status": "failed: RuntimeError()"},
+            {"trial": 2, "best_val_score": 0.9, "status": "ok"},
+            {"trial": 3, "best_val_score": 0.0, "status": "ok"},
+            {"trial": 4, "best_val_score": 0.7, "status": "ok"}]
+
+
+def test_summary_ranks_highest_scores_first(tmp_path):
+    file_path = str(tmp_path / "summary.csv")
+    write_summary(_summaries(), file_path)
+
+    assert _read_trials(file_path) == [2, 4, 0, 3, 1]
+
+
+def test_summary_ranks_lowest_scores_first(tmp_path):
+    file_path = str(tmp_path / "summary.csv")
+    write_summary(_summaries(), file_path, val_score_mode="lowest")
+
+    assert _read_trials(file_path) == [3, 0, 4, 2, 1]
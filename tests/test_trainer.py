@@ -0,0 +1,216 @@
+import pytest
+import torch
+
+pytest.importorskip("delira")
+pytest.importorskip("batchgenerators")
+
+from denas.trainer import ENASTrainerPyTorch  # noqa: E402
+
+BATCH_SIZE = 10
+NUM_CLASSES = 10
+
+
+def _predictions(labels, accuracy):
+    labels = labels.clone()
+    n_correct = int(round(accuracy * len(labels)))
+    labels[n_correct:] = (labels[n_correct:] + 1) % NUM_CLASSES
+    return {"pred": torch.nn.functional.one_hot(labels, NUM_CLASSES).float()}
+
+
+class _FakeModule(object):
+    """
+    Samples the architectures ``0, 1, ...`` and predicts the leading
+    ``accuracies[arc]`` fraction of each batch correctly
+
+    """
+
+    def __init__(self, accuracies):
+        self.accuracies = accuracies
+        self.num_sampled = 0
+
+    def eval(self):
+        pass
+
+    def train(self):
+        pass
+
+    def __call__(self, model_name, *args):
+        if model_name == "controller":
+            self.num_sampled += 1
+            return {"pred": {"id": self.num_sampled - 1}}
+
+        data, sample_arc = args
+        return _predictions(data, self.accuracies[sample_arc["id"]])
+
+
+class _BatchGenerator(object):
+    num_processes = 1
+
+    def __init__(self, num_batches):
+        self.num_batches = num_batches
+        self.num_loaded = 0
+        self.finished = False
+
+    @property
+    def generator(self):
+        return self
+
+    def __iter__(self):
+        for _ in range(self.num_batches):
+            self.num_loaded += 1
+            labels = torch.arange(BATCH_SIZE) % NUM_CLASSES
+            yield {"data": labels, "label": labels}
+
+    def _finish(self):
+        self.finished = True
+
+
+def _trainer(accuracies):
+    # without delira's setup: the selection only needs the module
+    trainer = ENASTrainerPyTorch.__new__(ENASTrainerPyTorch)
+    trainer.module = _FakeModule(accuracies)
+    trainer._prepare_batch = lambda batch: batch
+    return trainer
+
+
+def test_racing_halves_the_candidates():
+    trainer = _trainer([0.3, 0.9, 0.5, 0.6, 0.1, 0.7, 0.2, 0.4])
+    batchgen = _BatchGenerator(100)
+
+    best_arc, best_acc = trainer._get_best_arc_racing(batchgen, n_samples=8)
+
+    assert best_arc["id"] == 1
+    assert best_acc == pytest.approx(0.9)
+    # 8, 4 and 2 candidates on 1, 2 and 4 new batches
+    assert batchgen.num_loaded == 7
+    assert batchgen.finished
+
+
+def test_racing_drops_a_candidate_every_round():
+    # ceil(2 * 0.9) would keep both remaining candidates forever
+    trainer = _trainer([0.5, 0.8, 0.2])
+    batchgen = _BatchGenerator(100)
+
+    best_arc, _ = trainer._get_best_arc_racing(batchgen, n_samples=3,
+                                               keep_fraction=0.9)
+
+    assert best_arc["id"] == 1
+    # 3 candidates on 1 batch, then 2 candidates on 2 batches
+    assert batchgen.num_loaded == 3
+
+
+def test_racing_stops_at_the_evaluation_budget():
+    trainer = _trainer([0.3, 0.9, 0.5, 0.6])
+    batchgen = _BatchGenerator(100)
+
+    # the second round's 2 x 2 evaluations exceed the budget after one batch
+    best_arc, best_acc = trainer._get_best_arc_racing(
+        batchgen, n_samples=4, max_evaluations=6)
+
+    assert best_arc["id"] == 1
+    assert best_acc == pytest.approx(0.9)
+    assert batchgen.num_loaded == 2
+
+
+def test_racing_with_exhausted_data():
+    trainer = _trainer([0.3, 0.9, 0.5, 0.6])
+    batchgen = _BatchGenerator(2)
+
+    best_arc, _ = trainer._get_best_arc_racing(batchgen, n_samples=4)
+
+    assert best_arc["id"] == 1
+    assert batchgen.num_loaded == 2
+
+
+class _FakeController(object):
+    """
+    Samples the architecture ``n`` with log-probability ``-n`` and entropy
+    ``n / 10`` in the ``n``-th training step
+
+    """
+
+    def __init__(self):
+        self.num_sampled = 0
+
+    def eval(self):
+        pass
+
+    def train(self):
+        pass
+
+    def sample(self):
+        arc_id = self.num_sampled
+        self.num_sampled += 1
+        self.sample_arc = {"id": arc_id}
+        self.sample_log_prob = torch.tensor(-float(arc_id))
+        self.sample_entropy = torch.tensor(arc_id / 10.)
+
+
+class _History(object):
+    def __init__(self):
+        self.records = []
+
+    def append(self, sample_arc, reward, log_prob, entropy, epoch, step):
+        self.records.append((sample_arc["id"], reward, log_prob, entropy,
+                             step))
+
+
+def _interleaved_trainer(update_every):
+    trainer = ENASTrainerPyTorch.__new__(ENASTrainerPyTorch)
+    trainer.module = type("_Module", (), {})()
+    trainer.module.controller = _FakeController()
+    trainer.module.shared_cnn = torch.nn.Module()
+    trainer._prepare_batch = lambda batch: batch
+    trainer.optimizers = {"shared_cnn": None}
+    trainer.losses, trainer.train_metrics, trainer.fold = {}, {}, 0
+    trainer.reward_importance_clip = 1.
+    trainer.history = _History()
+    trainer.interleaved = {"update_every": update_every}
+    trainer._interleaved_rewards = []
+    trainer._shared_cnn_updates = 0
+    trainer.controller_updates = []
+
+    def _closure_shared_cnn(module, data_dict, **kwargs):
+        # the architecture n predicts n / 10 of the batch correctly
+        module.controller.sample()
+        preds = _predictions(data_dict["label"],
+                             module.controller.sample_arc["id"] / 10.)
+        return {}, {"shared_cnn_loss": 0.}, preds
+
+    def _closure_controller_offpolicy(module, sample_arc, acc,
+                                      behaviour_log_prob, batch_nr, **kwargs):
+        # teacher forcing with the architecture
+        module.controller.sample_arc = sample_arc
+        trainer.controller_updates.append(
+            (sample_arc["id"], acc, behaviour_log_prob, batch_nr))
+        return {}, {"controller_loss": 0.}, None
+
+    trainer.closure_fn_shared_cnn = _closure_shared_cnn
+    trainer.closure_fn_controller_offpolicy = _closure_controller_offpolicy
+    return trainer
+
+
+def test_interleaved_rewards_update_the_controller():
+    trainer = _interleaved_trainer(update_every=2)
+    batchgen = _BatchGenerator(5)
+
+    trainer._train_single_epoch_shared_cnn(batchgen, epoch=0)
+
+    # every architecture once, after every second step and at the end
+    updates = trainer.controller_updates
+    assert [(_update[0], _update[3]) for _update in updates] == [
+        (0, 1), (1, 1), (2, 3), (3, 3), (4, 4)]
+    # rewarded with the accuracy and log-prob at sampling time
+    assert [_update[1] for _update in updates] == \
+        pytest.approx([0., 0.1, 0.2, 0.3, 0.4])
+    assert [_update[2] for _update in updates] == [0., -1., -2., -3., -4.]
+    assert trainer._shared_cnn_updates == 5
+    assert trainer._interleaved_rewards == []
+    assert batchgen.finished
+
+    # the history keeps the behaviour log-prob and entropy of each sample
+    records = trainer.history.records
+    assert [_record[0] for _record in records] == list(range(5))
+    assert [_record[2] for _record in records] == [0., -1., -2., -3., -4.]
+    assert [_record[3] for _record in records] == \
+        pytest.approx([0., 0.1, 0.2, 0.3, 0.4])
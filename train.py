@@ -1,5 +1,7 @@
 from denas import ENASExperimentPyTorch, ENASModelPyTorch
 from denas.utils import Config, accuracy_metric
+from denas.data import MemmapDataset, MemmapDataManager, BatchAugmentation, \
+    create_memmap_dataset
 from delira.training import Parameters
 from delira.data_loading.dataset import TorchvisionClassificationDataset
 from delira.data_loading import BaseDataManager
@@ -18,6 +20,9 @@ def create_datasets(config: dict, **kwargs):
     data_path = config["training"].pop("data_path",
                                        os.path.join(os.getcwd(), "data"))
 
+    if config["training"].pop("data_backend", "batchgenerators") == "memmap":
+        return create_memmap_datasets(data_path, batchsize)
+
     dset_train = TorchvisionClassificationDataset(
         "cifar10",
         root=data_path,
@@ -59,6 +64,27 @@ def create_datasets(config: dict, **kwargs):
             "val": dmgr_val}
 
 
+def create_memmap_datasets(data_path: str, batchsize: int):
+    os.makedirs(data_path, exist_ok=True)
+
+    dset_train = MemmapDataset(*create_memmap_dataset(data_path, "cifar10",
+                                                      train=True))
+    dset_val = MemmapDataset(*create_memmap_dataset(data_path, "cifar10",
+                                                    train=False))
+
+    # normalization is done on the device by ENASModelPyTorch.prepare_batch
+    dmgr_train_controller = MemmapDataManager(
+        dset_train, batchsize, transforms=BatchAugmentation((36, 36), (32, 32)))
+    dmgr_train_shared_cnn = MemmapDataManager(
+        dset_train, batchsize, transforms=BatchAugmentation((36, 36), (32, 32)))
+
+    dmgr_val = MemmapDataManager(dset_val, batchsize, shuffle=False)
+
+    return {"train_controller": dmgr_train_controller,
+            "train_shared_cnn": dmgr_train_shared_cnn,
+            "val": dmgr_val}
+
+
 def create_experiment_from_config(config: dict):
 
     params = Parameters(
@@ -86,7 +112,25 @@ def create_experiment_from_config(config: dict):
                     "baseline_decay", 0.99),
                 "controller_entropy_weight": config["controller"].pop(
                     "entropy_weight", 0.0001),
-                "child_grad_bound": config["child"].pop("grad_bound", 5.0)
+                "child_grad_bound": config["child"].pop("grad_bound", 5.0),
+                "child_sparse_updates": config["child"].pop(
+                    "sparse_updates", False),
+                "controller_cost_target": config["controller"].pop(
+                    "cost_target", None),
+                "controller_cost_exponent": config["controller"].pop(
+                    "cost_exponent", -0.07),
+                "controller_cost_table": config["controller"].pop(
+                    "cost_table", None),
+                "controller_cost_batch_size": config["controller"].pop(
+                    "cost_batch_size", 1),
+                "controller_reward_min_samples": config["controller"].pop(
+                    "reward_min_samples", None),
+                "controller_reward_max_samples": config["controller"].pop(
+                    "reward_max_samples", None),
+                "controller_reward_confidence": config["controller"].pop(
+                    "reward_confidence", 0.95),
+                "controller_reward_tolerance": config["controller"].pop(
+                    "reward_tolerance", 0.)
             },
             "training": {
                 "num_epochs": 500,
@@ -125,14 +169,45 @@ def start_training(config_path: str = "./enas.config", dset_kwargs: dict = {},
 
     config = Config()(config_path)
 
+    return run_from_config(config, dset_kwargs, **kwargs)
+
+
+def run_from_config(config: dict, dset_kwargs: dict = {}, **kwargs):
+
     data = create_datasets(config, **dset_kwargs)
 
     experiment = create_experiment_from_config(config)
 
+    train_kwargs = {
+        "num_reward_workers": config["training"].pop("num_reward_workers", 0),
+        "history": config["training"].pop("history_path", None),
+        "bn_calibration_batches": config["training"].pop(
+            "bn_calibration_batches", 0),
+        "phase_scheduler": config["training"].pop("phase_scheduler", None),
+        "budget": config["training"].pop("budget", None),
+        "fidelity_schedule": config["training"].pop("fidelity_schedule",
+                                                    None),
+        "reward_set": config["training"].pop("reward_set", None),
+        "replay": config["training"].pop("replay", None),
+        "instrumentation": config["training"].pop("instrumentation", None),
+        "warm_start": config["training"].pop("warm_start", None),
+        "interleaved": config["training"].pop("interleaved", None),
+        "best_arc_kwargs": {
+            "racing": config["training"].pop("racing", False),
+            "leaderboard": config["training"].pop("leaderboard", None)
+        }
+    }
+
     experiment.run(train_data_controller=data["train_controller"],
                    train_data_shared_cnn=data["train_shared_cnn"],
                    val_data=data["val"], T_max=config["child"].pop("T_max"),
-                   eta_min=config["child"].pop("lr_min"), **kwargs)
+                   eta_min=config["child"].pop("lr_min"),
+                   train_kwargs=train_kwargs,
+                   val_score_mode=config["training"].pop("val_score_mode",
+                                                         "highest"),
+                   **kwargs)
+
+    return experiment
 
 
 if __name__ == '__main__':